@@ -0,0 +1,131 @@
+import contextlib
+import io
+import json
+import statistics
+import time
+import tracemalloc
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Optional
+from .stages import Stage
+
+# Default slowdown of the median time, or growth of the peak memory,
+# over the baseline that is flagged as a regression.
+DEFAULT_THRESHOLD = 0.1
+
+
+@dataclass
+class Measurement:
+    """Timings of the repeated runs of a stage and its peak memory."""
+
+    stage: str
+    times: list[float]
+    peak_memory: int
+    size: int = 0
+
+    @property
+    def median(self) -> float:
+        return statistics.median(self.times)
+
+    @property
+    def mean(self) -> float:
+        return statistics.fmean(self.times)
+
+    @property
+    def stdev(self) -> float:
+        return statistics.stdev(self.times) if len(self.times) > 1 else 0.0
+
+    @property
+    def throughput(self) -> Optional[float]:
+        """Bytes per second of the median run, for stages that process input."""
+        if not self.size or not self.median:
+            return None
+        return self.size / self.median
+
+    def __str__(self):
+        result = (
+            f"{self.stage:<18} median {self.median * 1000:9.2f} ms"
+            f"  min {min(self.times) * 1000:9.2f} ms"
+            f"  max {max(self.times) * 1000:9.2f} ms"
+            f"  stdev {self.stdev * 1000:8.2f} ms"
+            f"  peak {self.peak_memory / 1024 / 1024:7.1f} MiB"
+        )
+        if self.throughput is not None:
+            result += f"  {self.throughput / 1024:9.1f} KiB/s"
+        return result
+
+
+@dataclass
+class Regression:
+    stage: str
+    metric: str
+    baseline: float
+    current: float
+
+    @property
+    def change(self) -> float:
+        return self.current / self.baseline - 1 if self.baseline else 0.0
+
+    def __str__(self):
+        return (
+            f"{self.stage}: {self.metric} {self.change:+.1%} "
+            f"({self.baseline:.4g} -> {self.current:.4g})"
+        )
+
+
+def measure(stage: Stage, repeat: int = 5, warmup: int = 1) -> Measurement:
+    """
+    Time repeated runs of a stage, then trace one more run for its peak memory.
+
+    Memory is traced in its own run because tracemalloc slows down
+    the allocations it records. Output of the stage is discarded.
+    """
+    times = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for idx in range(warmup + repeat):
+            data = stage.setup()
+            start = time.perf_counter()
+            stage.run(data)
+            elapsed = time.perf_counter() - start
+            if idx >= warmup:
+                times.append(elapsed)
+
+        data = stage.setup()
+        tracemalloc.start()
+        try:
+            stage.run(data)
+            _, peak_memory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return Measurement(stage.name, times, peak_memory, stage.size)
+
+
+def save_baseline(measurements: list[Measurement], output: Path):
+    with open(output, "w") as f:
+        json.dump([asdict(m) for m in measurements], f, indent=2)
+        f.write("\n")
+
+
+def load_baseline(path: Path) -> dict[str, Measurement]:
+    with open(path, "r") as f:
+        return {m["stage"]: Measurement(**m) for m in json.load(f)}
+
+
+def compare(
+    measurements: list[Measurement],
+    baseline: dict[str, Measurement],
+    threshold: float = DEFAULT_THRESHOLD,
+) -> list[Regression]:
+    """Stages whose median time or peak memory grew by more than the threshold."""
+    regressions = []
+    for current in measurements:
+        previous = baseline.get(current.stage)
+        if previous is None:
+            continue
+        for metric, before, after in (
+            ("median", previous.median, current.median),
+            ("peak memory", previous.peak_memory, current.peak_memory),
+        ):
+            if before and after > before * (1 + threshold):
+                regressions.append(Regression(current.stage, metric, before, after))
+    return regressions
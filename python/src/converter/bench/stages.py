@@ -0,0 +1,207 @@
+import io
+import pickle
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Optional
+from lark import Lark, Tree
+from ..corpus import collect_files
+from ..emitter import LarkEmitter
+from ..expression import ExpressionFactory
+from ..incremental import Document, incremental_options, root_rule
+from ..lark_cache import serialize_parser
+from ..parser import (
+    ModuleLoader,
+    build_meta_parser,
+    build_rules,
+    parse_content,
+    process_rules,
+)
+from ..passes import PassManager
+
+TEST_DIRECTORY = Path(__file__).parent.parent.parent.parent / "tests"
+
+
+@dataclass
+class Stage:
+    """
+    A single measured step of the pipeline.
+
+    setup prepares the input of a run and isn't timed, e.g. a fresh rule
+    table for a pass that changes it in place.
+    """
+
+    name: str
+    run: Callable[[Any], Any]
+    setup: Callable[[], Any] = lambda: None
+    # bytes processed by a run, for the throughput
+    size: int = 0
+
+
+def _read_xtext() -> tuple[list[str], list[str]]:
+    """The XText files of the grammar and the terminals it hides."""
+    with ModuleLoader() as loader:
+        contents = [module.path.read_text() for module in loader.load()]
+        return contents, loader.hidden()
+
+
+def _parse_trees(parser: Lark, contents: list[str]) -> list:
+    return [parser.parse(content, start="start") for content in contents]
+
+
+def _transform(trees: list) -> list:
+    factory = ExpressionFactory()
+    return [rule for tree in trees for rule in build_rules(tree, factory).rules]
+
+
+def _parse_inline(parser: Lark, contents: list[str]) -> list:
+    factory = ExpressionFactory()
+    return [
+        rule
+        for content in contents
+        for rule in parse_content(parser, content, factory=factory)
+    ]
+
+
+def _emit(table) -> str:
+    out = io.StringIO()
+    LarkEmitter(out).emit(table)
+    return out.getvalue()
+
+
+def _parse_corpus(parser: Lark, contents: list[str]) -> int:
+    """Parse every file, returns how many of them the grammar rejects."""
+    failures = 0
+    for content in contents:
+        try:
+            parser.parse(content)
+        except Exception:
+            failures += 1
+    return failures
+
+
+def _documents(grammar: str, contents: list[str]) -> list[Document]:
+    """Documents of the files the grammar parses, for reparsing them."""
+    if root_rule(grammar) is None:
+        return []
+    parser = Lark(grammar, **incremental_options(grammar, {}))
+    documents = []
+    for content in contents:
+        try:
+            document = Document(parser, content)
+        except Exception:
+            continue
+        if document.elements:
+            documents.append(document)
+    return documents
+
+
+def _edit_span(document: Document) -> tuple[int, int]:
+    """
+    The inside of the last innermost { } block of a document, or its last
+    top level element if it has no block.
+    """
+    element = document.elements[-1]
+    span = (element.start, element.end)
+    element.update_positions()
+    if not isinstance(element.node, Tree):
+        return span
+    # in order of their start, the last block is the innermost one
+    for tree in element.node.iter_subtrees_topdown():
+        meta = tree.meta
+        if (
+            tree.data in document.blocks
+            and not meta.empty
+            and document.text[meta.end_pos - 1] == "}"
+        ):
+            span = (meta.start_pos + 1, meta.end_pos - 1)
+    return span
+
+
+def _reparse(documents: list[Document]):
+    """Retype the inside of the last innermost block of every document."""
+    for document in documents:
+        start, end = _edit_span(document)
+        document.edit(start, end, document.text[start:end])
+
+
+def build_stages(
+    grammar: Optional[str] = None,
+    corpus: Optional[list[Path]] = None,
+    parser_type: str = "lalr",
+) -> list[Stage]:
+    """
+    Build the stages of the pipeline, from meta parser to SysML parsing.
+
+    Each stage runs on the output of the stage before it, computed once
+    here. Without a grammar the one converted by the pipeline is loaded.
+    """
+    contents, hidden = _read_xtext()
+    xtext_size = sum(len(content.encode("utf-8")) for content in contents)
+    # xtext-parse and transform are measured on their own, the LALR meta
+    # parser usually does both at once, that's xtext-inline
+    meta_parser = build_meta_parser(parser_type, inline=False)
+    inline_parser = build_meta_parser(parser_type) if parser_type == "lalr" else None
+    trees = _parse_trees(meta_parser, contents)
+    rules = _transform(trees)
+    table = process_rules(rules, hidden)
+    PassManager().run(table)
+    if grammar is None:
+        grammar = _emit(table)
+    sysml_parser = Lark(grammar)
+    # what the parser cache reads on a warm run, without the disk
+    serialized_parser = serialize_parser(sysml_parser)
+    if corpus is None:
+        corpus = collect_files([str(TEST_DIRECTORY)])
+    corpus_contents = [path.read_text() for path in corpus]
+    corpus_size = sum(len(content.encode("utf-8")) for content in corpus_contents)
+    documents = _documents(grammar, corpus_contents)
+    edit_size = sum(
+        end - start for start, end in (_edit_span(document) for document in documents)
+    )
+
+    return [
+        Stage("meta-parser", lambda _: build_meta_parser(parser_type)),
+        Stage(
+            "xtext-parse",
+            lambda _: _parse_trees(meta_parser, contents),
+            size=xtext_size,
+        ),
+        Stage("transform", lambda _: _transform(trees)),
+        *(
+            [
+                Stage(
+                    "xtext-inline",
+                    lambda _: _parse_inline(inline_parser, contents),
+                    size=xtext_size,
+                )
+            ]
+            if inline_parser is not None
+            else []
+        ),
+        Stage(
+            "load-modules",
+            lambda _: ModuleLoader(
+                parser_type=parser_type, meta_parser=inline_parser or meta_parser
+            ).rules(),
+            size=xtext_size,
+        ),
+        Stage("process-rules", lambda _: process_rules(rules, hidden)),
+        Stage(
+            "passes",
+            lambda fresh: PassManager().run(fresh),
+            setup=lambda: process_rules(rules, hidden),
+        ),
+        Stage("emit", lambda _: _emit(table)),
+        Stage("lark-construction", lambda _: Lark(grammar)),
+        Stage(
+            "lark-cached",
+            lambda _: pickle.loads(serialized_parser),
+            size=len(serialized_parser),
+        ),
+        Stage(
+            "sysml-parse",
+            lambda _: _parse_corpus(sysml_parser, corpus_contents),
+            size=corpus_size,
+        ),
+        Stage("sysml-reparse", lambda _: _reparse(documents), size=edit_size),
+    ]
@@ -0,0 +1,183 @@
+import hashlib
+import os
+import pickle
+import re
+from dataclasses import replace
+from pathlib import Path
+from typing import Callable, Optional
+from .rule import XTextGrammar, XTextRule
+
+DEFAULT_CACHE_DIRECTORY = Path(".converter_cache")
+
+# Bump when the layout of the pickled cache changes.
+CACHE_VERSION = 2
+
+# Sources that decide how XText is turned into rules. A change to any of them
+# invalidates every cached rule.
+_FINGERPRINT_SOURCES = [
+    Path(__file__).parent / "lark" / "meta.lark",
+    Path(__file__).parent / "visitor.py",
+    Path(__file__).parent / "expression.py",
+    Path(__file__).parent / "rule.py",
+    Path(__file__).parent / "utils.py",
+]
+
+# Strings and comments are matched first so a ";" inside them is skipped,
+# only the captured ";" ends a statement.
+_STATEMENT_END = re.compile(
+    r"""'(?:\\.|[^'\\])*'|"(?:\\.|[^"\\])*"|//[^\n]*|/\*.*?\*/|(;)""", re.DOTALL
+)
+_COMMENTS = re.compile(r"//[^\n]*|/\*.*?\*/", re.DOTALL)
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def fingerprint(parser_type: str) -> str:
+    """Hash of everything besides the XText source that affects the rules."""
+    digest = hashlib.sha256(f"{CACHE_VERSION}:{parser_type}".encode("utf-8"))
+    for source in _FINGERPRINT_SOURCES:
+        digest.update(source.read_bytes())
+    return digest.hexdigest()
+
+
+def split_rule_statements(content: str) -> Optional[list[str]]:
+    """
+    Split XText source into one segment per rule statement.
+
+    The first segment also holds the grammar declaration and imports,
+    every other segment holds the comments in front of a rule and the rule itself.
+    Returns None when there is trailing content that isn't a comment,
+    the caller should fall back to a full parse to report the error.
+    """
+    segments = []
+    segment_start = 0
+    for match in _STATEMENT_END.finditer(content):
+        if match.group(1) is None:
+            continue
+        segments.append(content[segment_start : match.end()])
+        segment_start = match.end()
+
+    trailing = _COMMENTS.sub("", content[segment_start:])
+    if trailing.strip():
+        return None
+    return segments
+
+
+class ConversionCache:
+    """
+    Persistent cache of converted rules.
+
+    Rules are keyed by the content hash of their rule statement, files
+    by the hash of their whole content so unchanged files skip splitting too.
+    The declaration and imports of every file are kept with its entry.
+    """
+
+    def __init__(self, directory: Path = DEFAULT_CACHE_DIRECTORY):
+        self.directory = directory
+        self.fingerprint: Optional[str] = None
+        # file key -> (file hash, rule statement hashes, grammar header)
+        self.files: dict[str, tuple[str, list[str], XTextGrammar]] = {}
+        # rule statement hash -> rule
+        self.rules: dict[str, XTextRule] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def path(self) -> Path:
+        return self.directory / "rules.pickle"
+
+    def load(self, fingerprint: str):
+        """Load the cache from disk, dropping it if the fingerprint changed."""
+        self.fingerprint = fingerprint
+        self.files = {}
+        self.rules = {}
+        if not self.path.exists():
+            return
+
+        try:
+            with open(self.path, "rb") as f:
+                data = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            print(f"Warning: Ignoring unreadable cache '{self.path}'.")
+            return
+
+        if data.get("fingerprint") != fingerprint:
+            return
+        self.files = data["files"]
+        self.rules = data["rules"]
+
+    def save(self):
+        """Write the cache to disk, dropping rules no file refers to anymore."""
+        referenced = set()
+        for _, rule_hashes, _ in self.files.values():
+            referenced.update(rule_hashes)
+        self.rules = {h: rule for h, rule in self.rules.items() if h in referenced}
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        data = {
+            "fingerprint": self.fingerprint,
+            "files": self.files,
+            "rules": self.rules,
+        }
+        temp_path = self.path.with_suffix(".tmp")
+        with open(temp_path, "wb") as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self.path)
+
+    def clear(self):
+        self.files = {}
+        self.rules = {}
+        if self.path.exists():
+            self.path.unlink()
+
+    def parse_file(
+        self,
+        key: str,
+        content: str,
+        parse_segments: Callable[[list[tuple[str, str]]], list[XTextGrammar]],
+    ) -> XTextGrammar:
+        """
+        Get an XText file with its rules, parsing only what isn't cached.
+
+        parse_segments is called once with every uncached (source, start rule)
+        pair and returns the parsed grammar of each in the same order.
+        """
+        file_hash = content_hash(content)
+        entry = self.files.get(key)
+        if entry is not None and entry[0] == file_hash:
+            _, rule_hashes, header = entry
+            if all(h in self.rules for h in rule_hashes):
+                self.hits += len(rule_hashes)
+                return replace(header, rules=[self.rules[h] for h in rule_hashes])
+
+        segments = split_rule_statements(content)
+        if segments is None:
+            # let the parser report the problem
+            return parse_segments([(content, "start")])[0]
+
+        rule_hashes = [content_hash(segment) for segment in segments]
+        header = None
+        if entry is not None and entry[1][:1] == rule_hashes[:1]:
+            # the declaration is only parsed again with the first statement
+            header = entry[2]
+        missing: dict[str, tuple[str, str]] = {}
+        for idx, (segment, segment_hash) in enumerate(zip(segments, rule_hashes)):
+            if idx == 0 and header is None:
+                # the first segment carries the grammar declaration
+                missing[segment_hash] = (segment, "start")
+            elif segment_hash not in self.rules and segment_hash not in missing:
+                missing[segment_hash] = (segment, "rule_statement")
+
+        self.misses += len(missing)
+        self.hits += len(rule_hashes) - len(missing)
+        parsed = parse_segments(list(missing.values()))
+        for (segment_hash, (_, start)), grammar in zip(missing.items(), parsed):
+            if start == "start":
+                header = grammar.header()
+            (self.rules[segment_hash],) = grammar.rules
+
+        header = header if header is not None else XTextGrammar()
+        self.files[key] = (file_hash, rule_hashes, header)
+        return replace(header, rules=[self.rules[h] for h in rule_hashes])
@@ -1,66 +1,844 @@
+import contextlib
+import io
+import time
 import typer
-from .parser import process_rules, parse as fparse
+from .parser import (
+    DEFAULT_GRAMMAR,
+    ModuleLoader,
+    process_rules,
+    compare_parsers,
+    parse as fparse,
+)
+from .rule import XTextRule
+from .table import RuleTable
+from .passes import PASSES, PassManager
+from .emitter import BUFFER_SIZE, LarkEmitter, OutputFormat, emit_rules
+from .generator import GeneratorOptions, SysMLGenerator, generate_model
+from .cache import ConversionCache, DEFAULT_CACHE_DIRECTORY
+from .lark_cache import ParserCache, build_lark
+from .nodetable import NodeTableWriter
+from .predicates import find_predicates
+from .query import REFERENCE_RULES, ModelIndex
+from .keywords import collect_keywords, reserved_words, write_keyword_table
+from .bench.runner import (
+    DEFAULT_THRESHOLD,
+    compare,
+    load_baseline,
+    measure,
+    save_baseline,
+)
+from .bench.stages import build_stages
+from .corpus import (
+    PASSED,
+    CorpusReport,
+    collect_files,
+    iter_corpus,
+    write_json,
+    write_junit,
+)
+from .lalr import LALR_PASSES, REDUCE_REDUCE, find_conflicts, conflicts_by_rule
+from .tracing import Profiler, stage
+from .instrument import lark_grammar_rules
+from .watch import DEFAULT_INTERVAL, WatchSession
 from pathlib import Path
+from typing import Optional
 
 app = typer.Typer()
 
+TEST_DIRECTORY = Path(__file__).parent.parent.parent / "tests"
+
+
+def _parser_type(earley: bool) -> str:
+    return "earley" if earley else "lalr"
+
+
+def _pass_selection(
+    optimize: bool, lalr: bool, skip_pass: list[str]
+) -> tuple[set[str], Optional[set[str]]]:
+    """The disabled and enabled passes of the pass options."""
+    disabled = set(skip_pass)
+    if not optimize:
+        # only the rewrites the LALR parser needs
+        disabled |= {name for name, p in PASSES.items() if p.default}
+    enabled = LALR_PASSES if lalr else None
+    unknown = disabled - PASSES.keys()
+    if unknown:
+        raise typer.BadParameter(
+            f"Unknown passes: {', '.join(sorted(unknown))}", param_hint="--skip-pass"
+        )
+    return disabled, enabled
+
+
+def _lark_options(lalr: bool, lexer: Optional[str]) -> dict:
+    if lalr:
+        return {"parser": "lalr", "lexer": lexer or "contextual"}
+    return {"lexer": lexer or "dynamic"}
+
+
+def _conversion_cache(use_cache: bool, cache_dir: Path) -> Optional[ConversionCache]:
+    return ConversionCache(cache_dir) if use_cache else None
+
+
+def _parser_cache(use_cache: bool, cache_dir: Path) -> Optional[ParserCache]:
+    return ParserCache(cache_dir / "parsers") if use_cache else None
+
+
+GRAMMAR_OPTION = typer.Option(
+    DEFAULT_GRAMMAR, "--grammar", "-g", help="XText file or grammar name"
+)
+SEARCH_PATH_OPTION = typer.Option(
+    [],
+    "--search-path",
+    "-I",
+    help="Directory grammars named by 'with' are looked up in, before the bundled ones",
+)
+CACHE_OPTION = typer.Option(
+    True,
+    "--cache/--no-cache",
+    help="Reuse rules converted and parsers built by previous runs",
+)
+CACHE_DIR_OPTION = typer.Option(
+    DEFAULT_CACHE_DIRECTORY,
+    "--cache-dir",
+    help="Directory of the conversion and parser caches",
+)
+JOBS_OPTION = typer.Option(
+    1, "--jobs", "-j", min=1, help="Worker processes for parsing and rule building"
+)
+PROFILE_OPTION = typer.Option(
+    None, "--profile", help="Time every stage and write a Chrome trace to this file"
+)
+CPROFILE_OPTION = typer.Option(
+    None, "--cprofile", help="Write a cProfile dump of the run to this file"
+)
+PROFILE_TOP_OPTION = typer.Option(
+    10, "--profile-top", min=0, help="Most expensive rules listed by --profile"
+)
+PROFILE_MEMORY_OPTION = typer.Option(
+    False,
+    "--profile-memory/--no-profile-memory",
+    help="Also trace allocations of every stage, slows down the profiled run",
+)
+
+
+def _profile(
+    ctx: typer.Context,
+    trace: Optional[Path],
+    cprofile: Optional[Path],
+    top: int,
+    memory: bool,
+):
+    """Profile the rest of the command, the report is written when it ends."""
+    if trace is None and cprofile is None:
+        return
+    profiler = Profiler(trace_memory=memory, cprofile=cprofile is not None)
+
+    def finish():
+        profiler.stop()
+        for line in profiler.summary(top):
+            print(line)
+        if trace is not None:
+            profiler.write_trace(trace)
+            print(f"Wrote trace to {trace}.")
+        if cprofile is not None:
+            profiler.write_cprofile(cprofile)
+            print(f"Wrote cProfile dump to {cprofile}.")
+
+    ctx.call_on_close(finish)
+    profiler.start()
+
 
 @app.command()
-def parse():
+def parse(
+    ctx: typer.Context,
+    earley: bool = typer.Option(
+        False, "--earley", help="Parse with the slow Earley meta parser"
+    ),
+    check: bool = typer.Option(
+        False, "--check", help="Check that LALR and Earley produce identical rules"
+    ),
+    grammar: Path = GRAMMAR_OPTION,
+    search_path: list[Path] = SEARCH_PATH_OPTION,
+    use_cache: bool = CACHE_OPTION,
+    cache_dir: Path = CACHE_DIR_OPTION,
+    jobs: int = JOBS_OPTION,
+    profile: Optional[Path] = PROFILE_OPTION,
+    cprofile: Optional[Path] = CPROFILE_OPTION,
+    profile_top: int = PROFILE_TOP_OPTION,
+    profile_memory: bool = PROFILE_MEMORY_OPTION,
+):
     """
     Attempt to parse the KerML and SysML files using the Lark parser.
     """
+    _profile(ctx, profile, cprofile, profile_top, profile_memory)
+    if check:
+        if not compare_parsers():
+            print("LALR and Earley parsers produce different rules.")
+            raise typer.Exit(code=1)
+        print("LALR and Earley parsers produce identical rules.")
+        return
 
-    process_rules(fparse())
+    try:
+        rules = fparse(
+            _parser_type(earley),
+            _conversion_cache(use_cache, cache_dir),
+            jobs,
+            grammar,
+            search_path,
+            _parser_cache(use_cache, cache_dir),
+        )
+    except FileNotFoundError as e:
+        raise typer.BadParameter(str(e), param_hint="--grammar")
+    process_rules(rules)
 
 
 @app.command()
-def convert(output: Path = typer.Argument(..., help="Output file path")):
-    if not output.exists():
-        output.parent.mkdir(parents=True, exist_ok=True)
-    rules = process_rules(fparse())
+def convert(
+    ctx: typer.Context,
+    output: Path = typer.Argument(
+        ..., help="Output file path, a directory when converting several grammars"
+    ),
+    earley: bool = typer.Option(
+        False, "--earley", help="Parse with the slow Earley meta parser"
+    ),
+    grammar: list[str] = typer.Option(
+        [], "--grammar", "-g", help="XText file or grammar name, defaults to SysML"
+    ),
+    search_path: list[Path] = SEARCH_PATH_OPTION,
+    use_cache: bool = CACHE_OPTION,
+    cache_dir: Path = CACHE_DIR_OPTION,
+    jobs: int = JOBS_OPTION,
+    format: OutputFormat = typer.Option(
+        OutputFormat.LARK, "--format", help="Output backend"
+    ),
+    optimize: bool = typer.Option(
+        True,
+        "--optimize/--no-optimize",
+        help="Run the optimization passes, --no-optimize emits the rules unchanged",
+    ),
+    skip_pass: list[str] = typer.Option(
+        [], "--skip-pass", help=f"Disable a pass: {', '.join(PASSES)}"
+    ),
+    pass_report: bool = typer.Option(
+        False, "--pass-report", help="List every change made by the passes"
+    ),
+    lalr_report: bool = typer.Option(
+        False,
+        "--lalr-report",
+        help="Rewrite the grammar for Lark's LALR parser and report its conflicts, "
+        "the grammar is only written when Lark can build the parser",
+    ),
+    keywords: bool = typer.Option(
+        False,
+        "--keywords",
+        help="Emit keywords as named terminals for Lark's basic and contextual lexers",
+    ),
+    keyword_table: Optional[Path] = typer.Option(
+        None, "--keyword-table", help="Write the keywords and reserved words as JSON"
+    ),
+    profile: Optional[Path] = PROFILE_OPTION,
+    cprofile: Optional[Path] = CPROFILE_OPTION,
+    profile_top: int = PROFILE_TOP_OPTION,
+    profile_memory: bool = PROFILE_MEMORY_OPTION,
+):
+    _profile(ctx, profile, cprofile, profile_top, profile_memory)
+    roots = grammar or [str(DEFAULT_GRAMMAR)]
+    cache = _conversion_cache(use_cache, cache_dir)
+    with ModuleLoader(
+        search_path,
+        _parser_type(earley),
+        cache,
+        jobs,
+        parser_cache=_parser_cache(use_cache, cache_dir),
+    ) as loader:
+        for root in roots:
+            path = _find_grammar(loader, root)
+            target, table = output, keyword_table
+            if len(roots) > 1:
+                # the grammars they share are only parsed once
+                print(f"Converting {path.stem}.")
+                target = output / f"{path.stem}.{format.value}"
+                if keyword_table is not None:
+                    table = keyword_table / f"{path.stem}.json"
+            _convert_rules(
+                loader.rules(path),
+                loader.hidden(path),
+                target,
+                format,
+                optimize,
+                skip_pass,
+                pass_report,
+                lalr_report,
+                keywords,
+                table,
+            )
+
+
+def _find_grammar(loader: ModuleLoader, grammar: str) -> Path:
+    try:
+        return loader.find(grammar)
+    except FileNotFoundError as e:
+        raise typer.BadParameter(str(e), param_hint="--grammar")
+
+
+def _convert_rules(
+    rules: list[XTextRule],
+    hidden: list[str],
+    output: Path,
+    format: OutputFormat,
+    optimize: bool,
+    skip_pass: list[str],
+    pass_report: bool,
+    lalr: bool,
+    keywords: bool,
+    keyword_table: Optional[Path],
+):
+    """Process, optimize and emit the rules of a grammar."""
+    for path in (output, keyword_table):
+        if path is not None and not path.parent.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+    rules = process_rules(rules, hidden)
     if rules is None or len(rules) == 0:
         print("No rules found.")
         raise typer.Exit(code=1)
 
     print(f"Found {len(rules)} rules.")
 
-    file_content = ""
-    start_rule = rules[0]
-    file_content += f"start: {start_rule.name} \n\n"
-    for rule in rules:
-        file_content += f"{rule.name}: {str(rule.body)} \n\n"
+    if optimize or lalr:
+        manager = PassManager(*_pass_selection(optimize, lalr, skip_pass))
+        for report in manager.run(rules):
+            print(report)
+            if pass_report:
+                for change in report.changes:
+                    print(f"  {change}")
+        print(f"Emitting {len(rules)} rules.")
+
+    keyword_terminals = None
+    if keywords or keyword_table is not None:
+        keyword_terminals = collect_keywords(rules)
+        print(f"Emitting {len(keyword_terminals)} keyword terminals.")
+    if lalr and format is OutputFormat.LARK:
+        text = io.StringIO()
+        with stage("emit", format=format.value):
+            LarkEmitter(text, keyword_terminals).emit(rules)
+        if not _report_conflicts(text.getvalue(), rules):
+            print(f"Not writing {output}, Lark can't build a LALR parser from it.")
+            raise typer.Exit(code=1)
+        output.write_text(text.getvalue())
+    else:
+        emit_rules(rules, output, format, keyword_terminals)
+
+    predicates = find_predicates(rules)
+    if predicates and format is OutputFormat.LARK:
+        ignored = [predicate for predicate in predicates if not predicate.honored]
+        print(
+            f"Emitted {len(predicates) - len(ignored)} of {len(predicates)} "
+            "syntactic predicates as rule priorities."
+        )
+        for predicate in ignored:
+            print(f"  {predicate}")
 
-    with open(output, "w") as f:
-        f.write(file_content)
+    if keyword_table is not None:
+        if format is not OutputFormat.LARK:
+            raise typer.BadParameter(
+                "Reserved words are only found in Lark grammars",
+                param_hint="--keyword-table",
+            )
+        reserved = reserved_words(output.read_text(), keyword_terminals)
+        write_keyword_table(keyword_table, keyword_terminals, reserved)
+        for terminal, words in reserved.items():
+            print(f"{len(words)} keywords are reserved words of {terminal}.")
+
+
+def _report_conflicts(grammar: str, rules: RuleTable) -> bool:
+    """
+    Print the LALR conflicts of a grammar, returns whether Lark can build a
+    LALR parser from it. Lark resolves shift/reduce conflicts as shifts but
+    rejects the grammar on a reduce/reduce conflict.
+    """
+    conflicts = find_conflicts(grammar, rules)
+    if not conflicts:
+        print("The grammar is LALR(1).")
+        return True
+    print(f"{len(conflicts)} LALR conflicts left:")
+    for name, rule_conflicts in conflicts_by_rule(conflicts).items():
+        print(f"  {name}:")
+        for conflict in rule_conflicts:
+            print(f"    {conflict}")
+    return all(conflict.kind != REDUCE_REDUCE for conflict in conflicts)
 
 
 @app.command()
-def test(grammar: Path = typer.Argument(..., help="Converted grammar file path")):
+def test(
+    ctx: typer.Context,
+    grammar: Path = typer.Argument(..., help="Converted grammar file path"),
+    corpus: Optional[list[str]] = typer.Argument(
+        None, help="SysML files, directories or glob patterns, defaults to tests/"
+    ),
+    lalr: bool = typer.Option(
+        False, "--lalr", help="Load the grammar with the LALR parser"
+    ),
+    lexer: Optional[str] = typer.Option(
+        None, "--lexer", help="Lark lexer, e.g. basic or contextual"
+    ),
+    jobs: int = typer.Option(1, "--jobs", "-j", min=1, help="Worker processes"),
+    timeout: Optional[float] = typer.Option(
+        None, "--timeout", min=0, help="Seconds a single file may take to parse"
+    ),
+    json_report: Optional[Path] = typer.Option(
+        None, "--json", help="Write the results as JSON"
+    ),
+    junit_report: Optional[Path] = typer.Option(
+        None, "--junit", help="Write the results as JUnit XML"
+    ),
+    slowest: int = typer.Option(10, "--slowest", help="Number of slowest files listed"),
+    rule_stats: bool = typer.Option(
+        False, "--rule-stats", help="Count how often each grammar rule is used"
+    ),
+    rule_stats_json: Optional[Path] = typer.Option(
+        None, "--rule-stats-json", help="Write the rule usage as JSON"
+    ),
+    rule_stats_top: int = typer.Option(
+        20, "--rule-stats-top", min=0, help="Number of busiest rules listed"
+    ),
+    ambiguity: bool = typer.Option(
+        False,
+        "--ambiguity",
+        help="Keep Earley ambiguities and rank the rules by the work they cost",
+    ),
+    node_table: Optional[Path] = typer.Option(
+        None, "--node-table", help="Write the parse trees as a flat node table"
+    ),
+    use_cache: bool = typer.Option(
+        True, "--cache/--no-cache", help="Reuse parsers built by previous runs"
+    ),
+    cache_dir: Path = CACHE_DIR_OPTION,
+    profile: Optional[Path] = PROFILE_OPTION,
+    cprofile: Optional[Path] = CPROFILE_OPTION,
+    profile_top: int = PROFILE_TOP_OPTION,
+    profile_memory: bool = PROFILE_MEMORY_OPTION,
+):
     """
-    Test the conversion process by trying to load converted grammar into Lark.
+    Test the conversion process by trying to load converted grammar into Lark
+    and parsing a corpus of SysML files with it.
     """
+    _profile(ctx, profile, cprofile, profile_top, profile_memory)
     grammar_content = None
     with open(grammar, "r") as f:
         grammar_content = f.read()
 
-    from lark import Lark
+    from lark.exceptions import GrammarError
+
+    options = _lark_options(lalr, lexer)
+    if ambiguity:
+        if lalr:
+            raise typer.BadParameter(
+                "LALR parses are never ambiguous", param_hint="--ambiguity"
+            )
+        options.update(ambiguity="explicit", propagate_positions=True)
+    if node_table is not None:
+        options.update(propagate_positions=True)
+    parser_cache = _parser_cache(use_cache, cache_dir)
+    try:
+        with stage("lark-construction", **options):
+            parser = build_lark(grammar_content, parser_cache, **options)
+    except GrammarError as e:
+        if not lalr:
+            raise
+        # Lark lists every colliding rule, the first collision is enough
+        print(f"Grammar isn't LALR(1): {str(e).splitlines()[0]}")
+        print("Run convert with --lalr-report for a report of every conflict.")
+        raise typer.Exit(code=1)
+
+    test_files = collect_files(corpus or [str(TEST_DIRECTORY)])
+    if not test_files:
+        print("No SysML files found.")
+        raise typer.Exit(code=1)
+
+    start = time.perf_counter()
+    results = []
+    writer = NodeTableWriter()
+    instrument = rule_stats or rule_stats_json is not None or ambiguity
+    for result in iter_corpus(
+        grammar_content,
+        options,
+        test_files,
+        jobs,
+        timeout,
+        parser,
+        instrument,
+        parser_cache,
+        node_table is not None,
+    ):
+        if result.tree is not None:
+            writer.add(result.path, result.tree)
+            result.tree = None
+        results.append(result)
+        if result.status == PASSED:
+            print(f"Test passed for {result.path} ({result.seconds * 1000:.1f} ms)")
+        else:
+            print(f"Test {result.status} for {result.path}: {result.error}")
+    results.sort(key=lambda result: result.seconds, reverse=True)
+    report = CorpusReport(results, time.perf_counter() - start)
+
+    if slowest:
+        print("Slowest files:")
+        for result in report.results[:slowest]:
+            print(
+                f"  {result.seconds * 1000:9.1f} ms "
+                f"{result.bytes_per_second / 1024:9.1f} KiB/s  {result.path}"
+            )
+    print(report)
+
+    if instrument:
+        grammar_rules = lark_grammar_rules(parser)
+        stats = report.rule_stats
+        if rule_stats or not ambiguity:
+            for line in stats.report(grammar_rules, rule_stats_top):
+                print(line)
+        if ambiguity:
+            for line in stats.ambiguity_report(rule_stats_top):
+                print(line)
+        if rule_stats_json is not None:
+            stats.write_json(rule_stats_json, grammar_rules)
+
+    if node_table is not None:
+        writer.write(node_table)
+        print(
+            f"Wrote {len(writer)} nodes of {len(writer.roots)} files "
+            f"to {node_table}."
+        )
+    if json_report is not None:
+        write_json(report, json_report)
+    if junit_report is not None:
+        write_junit(report, junit_report)
+
+
+@app.command()
+def query(
+    grammar: Path = typer.Argument(..., help="Converted grammar file path"),
+    corpus: Optional[list[str]] = typer.Argument(
+        None, help="SysML files, directories or glob patterns, defaults to tests/"
+    ),
+    name: Optional[str] = typer.Option(
+        None, "--name", help="Elements with this name or short name"
+    ),
+    qualified_name: Optional[str] = typer.Option(
+        None, "--qualified-name", "-q", help="Element with this qualified name"
+    ),
+    kind: Optional[str] = typer.Option(
+        None, "--kind", help="Elements of this rule, e.g. part_definition"
+    ),
+    references_to: Optional[str] = typer.Option(
+        None, "--references-to", help="References to this qualified name"
+    ),
+    references_from: Optional[str] = typer.Option(
+        None, "--references-from", help="References of this qualified name"
+    ),
+    relation: Optional[str] = typer.Option(
+        None,
+        "--relation",
+        help=f"Only references of: {', '.join(sorted(set(REFERENCE_RULES.values())))}",
+    ),
+    lalr: bool = typer.Option(
+        False, "--lalr", help="Load the grammar with the LALR parser"
+    ),
+    lexer: Optional[str] = typer.Option(
+        None, "--lexer", help="Lark lexer, e.g. basic or contextual"
+    ),
+    jobs: int = typer.Option(1, "--jobs", "-j", min=1, help="Worker processes"),
+    use_cache: bool = typer.Option(
+        True, "--cache/--no-cache", help="Reuse parsers built by previous runs"
+    ),
+    cache_dir: Path = CACHE_DIR_OPTION,
+):
+    """
+    Index the definitions, usages and references of a SysML corpus by
+    qualified name and look elements up in it.
+    """
+    if relation is not None and relation not in REFERENCE_RULES.values():
+        raise typer.BadParameter(
+            f"Unknown relation: {relation}", param_hint="--relation"
+        )
+    with open(grammar, "r") as f:
+        grammar_content = f.read()
+    test_files = collect_files(corpus or [str(TEST_DIRECTORY)])
+    if not test_files:
+        print("No SysML files found.")
+        raise typer.Exit(code=1)
+
+    options = dict(_lark_options(lalr, lexer), propagate_positions=True)
+    parser_cache = _parser_cache(use_cache, cache_dir)
+    index = ModelIndex()
+    with stage("index-corpus", files=len(test_files)):
+        for result in iter_corpus(
+            grammar_content,
+            options,
+            test_files,
+            jobs,
+            parser_cache=parser_cache,
+            keep_trees=True,
+        ):
+            if result.status != PASSED:
+                print(f"Skipping {result.path}: {result.error.splitlines()[0]}")
+                continue
+            index.update(result.path, result.tree)
+    print(f"Indexed {len(index)} elements of {len(index.files)} files.")
+
+    symbols = None
+    for selected in (
+        None if name is None else index.find(name),
+        None if qualified_name is None else index.lookup(qualified_name),
+        None if kind is None else index.of_kind(kind),
+    ):
+        if selected is not None:
+            symbols = (
+                selected if symbols is None else [s for s in symbols if s in selected]
+            )
+    for symbol in symbols or ():
+        print(f"{symbol.qualified_name} {symbol.kind} {symbol.file}:{symbol.line}")
+
+    references = []
+    if references_to is not None:
+        references += index.references_to(references_to, relation)
+    if references_from is not None:
+        references += index.references_from(references_from, relation)
+    for reference in references:
+        target = index.resolve(reference) or f"{reference.target} (unresolved)"
+        print(
+            f"{reference.owner} {reference.relation} {target} "
+            f"{reference.file}:{reference.line}"
+        )
+
 
-    parser = Lark(grammar_content)
+@app.command()
+def bench(
+    grammar: Optional[Path] = typer.Option(
+        None, "--grammar", help="Generated grammar to load, defaults to a fresh one"
+    ),
+    corpus: Optional[list[str]] = typer.Option(
+        None, "--corpus", help="SysML files, directories or globs, defaults to tests/"
+    ),
+    stages: list[str] = typer.Option([], "--stage", help="Only run the given stages"),
+    repeat: int = typer.Option(5, "--repeat", min=1, help="Timed runs per stage"),
+    warmup: int = typer.Option(1, "--warmup", min=0, help="Untimed runs per stage"),
+    baseline: Optional[Path] = typer.Option(
+        None, "--baseline", help="Compare against a saved baseline"
+    ),
+    save: Optional[Path] = typer.Option(
+        None, "--save-baseline", help="Save the measurements as a baseline"
+    ),
+    threshold: float = typer.Option(
+        DEFAULT_THRESHOLD, "--threshold", help="Relative slowdown flagged as regression"
+    ),
+):
+    """
+    Time every stage of the conversion and of parsing SysML with its output.
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        available = build_stages(
+            grammar.read_text() if grammar is not None else None,
+            collect_files(corpus) if corpus else None,
+        )
+    unknown = set(stages) - {s.name for s in available}
+    if unknown:
+        raise typer.BadParameter(
+            f"Unknown stages: {', '.join(sorted(unknown))}", param_hint="--stage"
+        )
+
+    measurements = []
+    for selected in available:
+        if stages and selected.name not in stages:
+            continue
+        measurement = measure(selected, repeat, warmup)
+        measurements.append(measurement)
+        print(measurement)
+
+    if save is not None:
+        save_baseline(measurements, save)
+    if baseline is not None:
+        regressions = compare(measurements, load_baseline(baseline), threshold)
+        if regressions:
+            print(f"{len(regressions)} regressions against {baseline}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            raise typer.Exit(code=1)
+        print(f"No regressions against {baseline}.")
 
-    test_directory = Path(__file__).parent.parent.parent / "tests"
 
-    test_files = list(test_directory.glob("*.sysml"))
+@app.command()
+def watch(
+    output: Path = typer.Argument(..., help="Output file path"),
+    corpus: Optional[list[str]] = typer.Argument(
+        None, help="SysML files, directories or glob patterns, defaults to tests/"
+    ),
+    grammar: Path = GRAMMAR_OPTION,
+    search_path: list[Path] = SEARCH_PATH_OPTION,
+    use_cache: bool = CACHE_OPTION,
+    cache_dir: Path = CACHE_DIR_OPTION,
+    format: OutputFormat = typer.Option(
+        OutputFormat.LARK, "--format", help="Output backend"
+    ),
+    optimize: bool = typer.Option(
+        True,
+        "--optimize/--no-optimize",
+        help="Run the optimization passes, --no-optimize emits the rules unchanged",
+    ),
+    skip_pass: list[str] = typer.Option(
+        [], "--skip-pass", help=f"Disable a pass: {', '.join(PASSES)}"
+    ),
+    lalr: bool = typer.Option(
+        False,
+        "--lalr",
+        help="Rewrite the grammar for and load it with Lark's LALR parser",
+    ),
+    lexer: Optional[str] = typer.Option(
+        None, "--lexer", help="Lark lexer, e.g. basic or contextual"
+    ),
+    keywords: bool = typer.Option(
+        False, "--keywords", help="Emit keywords as named terminals"
+    ),
+    timeout: Optional[float] = typer.Option(
+        None, "--timeout", min=0, help="Seconds a single file may take to parse"
+    ),
+    interval: float = typer.Option(
+        DEFAULT_INTERVAL, "--interval", min=0.01, help="Seconds between file checks"
+    ),
+):
+    """
+    Convert and test on every change of the XText files or the SysML corpus,
+    keeping the parsers in memory between changes.
+    """
+    if not output.exists():
+        output.parent.mkdir(parents=True, exist_ok=True)
+    disabled, enabled = _pass_selection(optimize, lalr, skip_pass)
+    session = WatchSession(
+        output,
+        corpus or [str(TEST_DIRECTORY)],
+        _lark_options(lalr, lexer),
+        _conversion_cache(use_cache, cache_dir),
+        format,
+        optimize or lalr,
+        disabled,
+        enabled,
+        keywords,
+        timeout,
+        grammar,
+        search_path,
+        _parser_cache(use_cache, cache_dir),
+    )
+    print("Watching the XText files and the corpus, press Ctrl+C to stop.")
+    try:
+        session.watch(interval)
+    except KeyboardInterrupt:
+        pass
+
+
+def _parse_size(size: str, param_hint: str = "--size") -> int:
+    """Bytes of a size like 512, 64K, 1M or 1G."""
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    size = size.strip().upper().removesuffix("B")
+    try:
+        if size and size[-1] in units:
+            return int(float(size[:-1]) * units[size[-1]])
+        return int(size)
+    except ValueError:
+        raise typer.BadParameter(f"Invalid size: {size}", param_hint=param_hint)
+
+
+@app.command()
+def cache(
+    cache_dir: Path = CACHE_DIR_OPTION,
+    clear: bool = typer.Option(
+        False, "--clear", help="Remove the converted rules and every cached parser"
+    ),
+    max_size: Optional[str] = typer.Option(
+        None,
+        "--max-size",
+        help="Remove the least recently used parsers until the cache fits, e.g. 64M",
+    ),
+):
+    """
+    Show, trim or clear the conversion and parser caches.
+    """
+    parsers = ParserCache(cache_dir / "parsers")
+    if clear:
+        ConversionCache(cache_dir).clear()
+        print(f"Removed the converted rules and {parsers.clear()} parsers.")
+        return
+    if max_size is not None:
+        parsers.evict(_parse_size(max_size, "--max-size"))
+
+    conversion = ConversionCache(cache_dir)
+    size = conversion.path.stat().st_size if conversion.path.exists() else 0
+    print(f"Converted rules: {size / 1024:.1f} KiB in {conversion.path}")
+    entries = parsers.entries()
+    print(
+        f"Parsers: {len(entries)} taking {parsers.size / 1024:.1f} KiB "
+        f"of {parsers.max_size >> 20} MiB in {parsers.directory}"
+    )
+
+
+@app.command()
+def generate(
+    output: Path = typer.Argument(..., help="Output SysML file path"),
+    size: str = typer.Option("0", "--size", help="Approximate size, e.g. 64K or 10M"),
+    seed: int = typer.Option(0, "--seed", help="Seed of the random choices"),
+    parts: int = typer.Option(0, "--parts", min=0, help="Part definitions"),
+    attributes: int = typer.Option(
+        0, "--attributes", min=0, help="Attribute definitions"
+    ),
+    constraints: int = typer.Option(
+        0, "--constraints", min=0, help="Constraint definitions"
+    ),
+    max_depth: int = typer.Option(
+        24, "--max-depth", min=1, help="Rule calls below a top level element"
+    ),
+    max_nesting: int = typer.Option(
+        3, "--max-nesting", min=0, help="Nested { } blocks"
+    ),
+    expression_depth: int = typer.Option(
+        2, "--expression-depth", min=0, help="Nested expressions"
+    ),
+    cover: bool = typer.Option(
+        True, "--cover/--no-cover", help="Add elements for rules not generated yet"
+    ),
+    use_cache: bool = CACHE_OPTION,
+    cache_dir: Path = CACHE_DIR_OPTION,
+):
+    """
+    Generate a synthetic SysML model from the converted grammar.
+    """
+    rules = process_rules(
+        fparse(
+            "lalr",
+            _conversion_cache(use_cache, cache_dir),
+            parser_cache=_parser_cache(use_cache, cache_dir),
+        )
+    )
+    if rules is None or len(rules) == 0:
+        print("No rules found.")
+        raise typer.Exit(code=1)
+    PassManager().run(rules)
+
+    generator = SysMLGenerator(
+        rules,
+        GeneratorOptions(seed, max_depth, max_nesting, expression_depth),
+    )
+    counts = {"parts": parts, "attributes": attributes, "constraints": constraints}
+    if not output.exists():
+        output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w", buffering=BUFFER_SIZE) as f:
+        for chunk in generate_model(generator, _parse_size(size), counts, cover):
+            f.write(chunk)
 
-    for test_file in test_files:
-        print(f"Testing {test_file.name}...")
-        with open(test_file, "r") as f:
-            test_content = f.read()
-            try:
-                parser.parse(test_content)
-                print(f"Test passed for {test_file.name}")
-            except Exception as e:
-                print(f"Test failed for {test_file.name}: {e}")
+    covered, reachable = generator.coverage
+    print(f"Wrote {output.stat().st_size} bytes to {output}.")
+    print(f"Covered {covered} of {reachable} rules.")
+    missing = generator.missing_rules()
+    if cover and missing:
+        # out of reach within --max-depth, --max-nesting or --expression-depth
+        print(f"Never generated: {', '.join(missing)}")
 
 
 if __name__ == "__main__":
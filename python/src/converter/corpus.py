@@ -0,0 +1,257 @@
+import glob
+import json
+import signal
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, fields
+from pathlib import Path
+from typing import Iterator, Optional, Union
+from lark import Lark, Tree
+from .incremental import Document
+from .instrument import InstrumentedParser, RuleStats
+from .lark_cache import ParserCache, build_lark
+from .tracing import stage
+
+PASSED = "passed"
+FAILED = "failed"
+TIMEOUT = "timeout"
+
+
+@dataclass
+class FileResult:
+    """Outcome of parsing a single corpus file."""
+
+    path: str
+    size: int
+    seconds: float
+    status: str
+    error: Optional[str] = None
+    # rule usage of this file when parsed by an instrumented parser
+    rule_stats: Optional[RuleStats] = field(default=None, repr=False)
+    # parse tree, only kept when asked for
+    tree: Optional[Tree] = field(default=None, repr=False)
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.size / self.seconds if self.seconds else 0.0
+
+
+@dataclass
+class CorpusReport:
+    """Results of a corpus run, the slowest files first."""
+
+    results: list[FileResult] = field(default_factory=list)
+    # wall clock time of the whole run, parser construction excluded
+    seconds: float = 0.0
+
+    def count(self, status: str) -> int:
+        return sum(1 for result in self.results if result.status == status)
+
+    @property
+    def size(self) -> int:
+        return sum(result.size for result in self.results)
+
+    @property
+    def rule_stats(self) -> Optional[RuleStats]:
+        """Rule usage of the whole corpus, if it was instrumented."""
+        stats = None
+        for result in self.results:
+            if result.rule_stats is not None:
+                stats = stats if stats is not None else RuleStats()
+                stats.merge(result.rule_stats)
+        return stats
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.size / self.seconds if self.seconds else 0.0
+
+    @property
+    def files_per_second(self) -> float:
+        return len(self.results) / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return (
+            f"{len(self.results)} files, {self.count(PASSED)} passed, "
+            f"{self.count(FAILED)} failed, {self.count(TIMEOUT)} timed out "
+            f"in {self.seconds:.2f}s: {self.bytes_per_second / 1024:.1f} KiB/s, "
+            f"{self.files_per_second:.1f} files/s"
+        )
+
+
+class ParseTimeout(Exception):
+    pass
+
+
+def collect_files(paths: list[str], pattern: str = "*.sysml") -> list[Path]:
+    """
+    Expand the corpus arguments into files.
+
+    Directories are searched recursively for the pattern, other arguments
+    are files or glob patterns. Every file is listed once, in sorted order.
+    """
+    files: set[Path] = set()
+    for path in paths:
+        if Path(path).is_dir():
+            files.update(Path(path).rglob(pattern))
+        elif Path(path).is_file():
+            files.add(Path(path))
+        else:
+            files.update(Path(p) for p in glob.glob(path, recursive=True))
+    return sorted(file for file in files if file.is_file())
+
+
+def _raise_timeout(signum, frame):
+    raise ParseTimeout()
+
+
+def parse_file(
+    parser: Union[Lark, InstrumentedParser, Document],
+    path: Path,
+    timeout: Optional[float],
+    keep_tree: bool = False,
+) -> FileResult:
+    """
+    Parse a file and time it.
+
+    The timeout interrupts the parse with SIGALRM, it's ignored on
+    platforms without it and outside the main thread. An instrumented
+    parser counts the rule usage of the file alone, a document only
+    reparses what changed since its last parse. With keep_tree the parse
+    tree is returned with the result.
+    """
+    rule_stats = None
+    if isinstance(parser, InstrumentedParser):
+        rule_stats = parser.stats = RuleStats(file=str(path))
+    content = path.read_text()
+    size = len(content.encode("utf-8"))
+    use_alarm = bool(timeout) and hasattr(signal, "setitimer")
+    if use_alarm:
+        previous = signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    start = time.perf_counter()
+    tree = None
+    try:
+        with stage("parse-file", file=str(path), size=size):
+            tree = parser.parse(content)
+        status, error = PASSED, None
+    except ParseTimeout:
+        status, error = TIMEOUT, f"Parse took longer than {timeout}s"
+    except Exception as e:
+        status, error = FAILED, str(e)
+    finally:
+        seconds = time.perf_counter() - start
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+    tree = tree if keep_tree else None
+    return FileResult(str(path), size, seconds, status, error, rule_stats, tree)
+
+
+# Parser of a worker process, built once by _init_worker.
+_worker_parser: Union[Lark, InstrumentedParser, None] = None
+
+
+def _init_worker(
+    grammar: str,
+    options: dict,
+    instrument: bool,
+    parser_cache: Optional[ParserCache],
+):
+    global _worker_parser
+    _worker_parser = build_lark(grammar, parser_cache, **options)
+    if instrument:
+        _worker_parser = InstrumentedParser(_worker_parser)
+
+
+def _parse_file_task(args: tuple[Path, Optional[float], bool]) -> FileResult:
+    """Worker task: parse a file with the parser of the worker."""
+    path, timeout, keep_tree = args
+    return parse_file(_worker_parser, path, timeout, keep_tree)
+
+
+def iter_corpus(
+    grammar: str,
+    options: dict,
+    files: list[Path],
+    jobs: int = 1,
+    timeout: Optional[float] = None,
+    parser: Union[Lark, InstrumentedParser, None] = None,
+    instrument: bool = False,
+    parser_cache: Optional[ParserCache] = None,
+    keep_trees: bool = False,
+) -> Iterator[FileResult]:
+    """
+    Parse every file, yielding the results as the files are done.
+
+    Each worker builds the parser once and reuses it for all its files,
+    a single job reuses the given parser. With a parser cache the workers
+    load the parser instead of building it. With instrument the rule usage
+    of every file is counted, with keep_trees the parse trees are returned.
+    """
+    if jobs <= 1 or len(files) <= 1:
+        if parser is None:
+            parser = build_lark(grammar, parser_cache, **options)
+        if instrument and not isinstance(parser, InstrumentedParser):
+            parser = InstrumentedParser(parser)
+        for path in files:
+            yield parse_file(parser, path, timeout, keep_trees)
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=jobs,
+        initializer=_init_worker,
+        initargs=(grammar, options, instrument, parser_cache),
+    ) as pool:
+        tasks = [(path, timeout, keep_trees) for path in files]
+        yield from pool.map(_parse_file_task, tasks)
+
+
+def write_json(report: CorpusReport, output: Path):
+    summary = {
+        "files": len(report.results),
+        "passed": report.count(PASSED),
+        "failed": report.count(FAILED),
+        "timeout": report.count(TIMEOUT),
+        "seconds": report.seconds,
+        "bytes": report.size,
+        "bytes_per_second": report.bytes_per_second,
+        "files_per_second": report.files_per_second,
+        "results": [
+            {
+                f.name: getattr(result, f.name)
+                for f in fields(result)
+                if f.name not in ("rule_stats", "tree")
+            }
+            for result in report.results
+        ],
+    }
+    with open(output, "w") as f:
+        json.dump(summary, f, indent=2)
+        f.write("\n")
+
+
+def write_junit(report: CorpusReport, output: Path):
+    suite = ET.Element(
+        "testsuite",
+        name="sysml-corpus",
+        tests=str(len(report.results)),
+        failures=str(report.count(FAILED)),
+        errors=str(report.count(TIMEOUT)),
+        time=f"{report.seconds:.3f}",
+    )
+    for result in report.results:
+        case = ET.SubElement(
+            suite,
+            "testcase",
+            classname="corpus",
+            name=result.path,
+            time=f"{result.seconds:.3f}",
+        )
+        if result.status == FAILED:
+            message = (result.error.splitlines() or [""])[0]
+            failure = ET.SubElement(case, "failure", message=message)
+            failure.text = result.error
+        elif result.status == TIMEOUT:
+            ET.SubElement(case, "error", message=result.error)
+    ET.ElementTree(suite).write(output, encoding="utf-8", xml_declaration=True)
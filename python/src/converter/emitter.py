@@ -0,0 +1,348 @@
+import json
+from abc import ABC, abstractmethod
+from enum import Enum
+from pathlib import Path
+from typing import Optional, TextIO
+from .expression import (
+    Expression,
+    AtomicExpression,
+    RegularExpression,
+    RuleCallExpression,
+    LiteralExpression,
+    SequenceExpression,
+    OrExpression,
+    GroupExpression,
+    NameResolution,
+)
+from .keywords import KeywordTable, collect_keywords, terminal_priorities
+from .predicates import PREDICATE_PRIORITY, Predicate, find_predicates
+from .table import RuleTable
+from .tracing import stage
+from .utils import NonParsing, RegexBuilder
+
+# Size of the write buffer of emitted files.
+BUFFER_SIZE = 1 << 16
+
+
+class Precedence(Enum):
+    """Binding strength of the position an expression is written in."""
+
+    ALTERNATIVE = 0  # rule body, alternative or group contents
+    SEQUENCE = 1  # item of a sequence
+    ATOM = 2  # operand of a cardinality
+
+
+class OutputFormat(str, Enum):
+    LARK = "lark"
+    JSON = "json"
+
+
+class Emitter(ABC):
+    """
+    Streams a rule table to a text file.
+
+    Expressions are written piece by piece, no string is built for a subtree.
+    With a keyword table the literals of non-terminal rules are written
+    as named terminals.
+    """
+
+    def __init__(self, out: TextIO, keywords: Optional[KeywordTable] = None):
+        self.out = out
+        self.write = out.write
+        self.keywords = keywords
+
+    @abstractmethod
+    def emit(self, rules: RuleTable):
+        pass
+
+
+class LarkEmitter(Emitter):
+    """
+    Writes the rules as a Lark grammar.
+
+    Alternatives of literals in terminal rules are written as a single
+    regex that merges them into a prefix trie. Terminal rules are written
+    as uppercase Lark terminals with the priorities of terminal_priorities,
+    the terminals of the hidden() section are ignored, so the grammar also
+    works with Lark's basic and contextual lexers. Predicated elements are
+    written as the prioritized rules of find_predicates, after the rule
+    they're in.
+    """
+
+    # whether the rule being written is a terminal rule
+    in_terminal = False
+
+    def __init__(self, out: TextIO, keywords: Optional[KeywordTable] = None):
+        super().__init__(out, keywords)
+        self.regex = RegexBuilder()
+        # rule name -> Lark terminal name of the terminal rules
+        self.terminals: dict[str, str] = {}
+        # (rule name, predicated group) -> the rule it's written as
+        self.predicates: dict[tuple[str, GroupExpression], str] = {}
+        # name of the rule being written
+        self.rule_name: Optional[str] = None
+
+    def emit(self, rules: RuleTable):
+        self.terminals = {
+            rule.name: rule.name.upper() for rule in rules if rule.is_terminal
+        }
+        definitions = {}
+        for rule in rules:
+            if rule.is_terminal:
+                definitions[rule.name] = self.expression_text(rule.body, True)
+        keywords = (
+            self.keywords if self.keywords is not None else collect_keywords(rules)
+        )
+        priorities = terminal_priorities(
+            rules, definitions, (keyword.text for keyword in keywords)
+        )
+        helpers: dict[str, list[Predicate]] = {}
+        for predicate in find_predicates(rules):
+            if predicate.honored:
+                self.predicates[predicate.rule, predicate.group] = predicate.helper
+                helpers.setdefault(predicate.rule, []).append(predicate)
+
+        write = self.write
+        start_rule = rules.first()
+        write(f"start: {start_rule.name}\n\n")
+        for rule in rules:
+            if rule.is_terminal:
+                write(self.terminals[rule.name])
+                priority = priorities.get(rule.name)
+                if priority is not None:
+                    write(f".{priority}")
+                write(": ")
+                write(definitions[rule.name])
+            else:
+                self.in_terminal = False
+                self.rule_name = rule.name
+                write(rule.name)
+                write(": ")
+                self.write_expression(rule.body, Precedence.ALTERNATIVE)
+            write("\n\n")
+            for predicate in helpers.get(rule.name, ()):
+                write(f"{predicate.helper}.{PREDICATE_PRIORITY}: ")
+                self.write_expression(
+                    predicate.group.expression, Precedence.ALTERNATIVE
+                )
+                write("\n\n")
+        if self.keywords is not None:
+            # no priority, the same as the terminals matching identifiers
+            for keyword in self.keywords:
+                write(keyword.terminal)
+                write(": ")
+                write(keyword.literal)
+                write("\n")
+        if rules.hidden:
+            write("\n")
+        for name in rules.hidden:
+            write(f"%ignore {self.terminals[name]}\n")
+
+    def expression_text(self, expr: Expression, in_terminal: bool) -> str:
+        """The expression as it's written, for the rules that need it twice."""
+        parts: list[str] = []
+        write, self.write = self.write, parts.append
+        self.in_terminal = in_terminal
+        try:
+            self.write_expression(expr, Precedence.ALTERNATIVE)
+        finally:
+            self.write = write
+        return "".join(parts)
+
+    def write_expression(self, expr: Expression, precedence: Precedence):
+        write = self.write
+        if isinstance(expr, NameResolution):
+            self.write_expression(expr.rule_calls[0], precedence)
+
+        elif isinstance(expr, RegularExpression):
+            write("/")
+            write(expr.value)
+            write("/")
+
+        elif (
+            isinstance(expr, LiteralExpression)
+            and self.keywords is not None
+            and not self.in_terminal
+        ):
+            write(self.keywords.terminal(expr.value))
+
+        elif isinstance(expr, RuleCallExpression) and expr.value in self.terminals:
+            write(self.terminals[expr.value])
+
+        elif isinstance(expr, AtomicExpression):
+            write(expr.value)
+
+        elif isinstance(expr, SequenceExpression):
+            items = [e for e in expr.expressions if not isinstance(e, NonParsing)]
+            if len(items) == 1:
+                self.write_expression(items[0], precedence)
+                return
+            parenthesize = precedence is Precedence.ATOM
+            if parenthesize:
+                write("(")
+            for idx, item in enumerate(items):
+                if idx:
+                    write(" ")
+                self.write_expression(item, Precedence.SEQUENCE)
+            if parenthesize:
+                write(")")
+
+        elif (
+            isinstance(expr, OrExpression)
+            and self.in_terminal
+            and self.regex.words(expr) is not None
+        ):
+            write("/")
+            write(self.regex.pattern(expr))
+            write("/")
+
+        elif isinstance(expr, OrExpression):
+            parenthesize = precedence is not Precedence.ALTERNATIVE
+            if parenthesize:
+                write("(")
+            for idx, alternative in enumerate(expr.expressions):
+                if idx:
+                    write(" | ")
+                self.write_expression(alternative, Precedence.ALTERNATIVE)
+            if parenthesize:
+                write(")")
+
+        elif (
+            isinstance(expr, GroupExpression)
+            and expr.predicated
+            and (self.rule_name, expr) in self.predicates
+        ):
+            write(self.predicates[self.rule_name, expr])
+            if expr.cardinality_type is not None:
+                write(expr.cardinality_type.value)
+
+        elif isinstance(expr, GroupExpression):
+            if expr.negated:
+                write("!(")
+                self.write_expression(expr.expression, Precedence.ALTERNATIVE)
+                write(")")
+                if expr.cardinality_type is not None:
+                    write(expr.cardinality_type.value)
+            elif expr.cardinality_type is not None:
+                # a cardinality can't directly follow another one
+                parenthesize = precedence is Precedence.ATOM
+                if parenthesize:
+                    write("(")
+                self.write_expression(expr.expression, Precedence.ATOM)
+                write(expr.cardinality_type.value)
+                if parenthesize:
+                    write(")")
+            else:
+                # parentheses are only kept where the contents need them
+                self.write_expression(expr.expression, precedence)
+
+        elif expr is not None:
+            write(str(expr))
+
+
+class JsonEmitter(Emitter):
+    """
+    Writes the rules as a compact JSON IR.
+
+    Expressions are arrays tagged by their kind:
+    ["call", name], ["lit", value], ["re", pattern], ["seq", [...]],
+    ["or", [...]] and ["group", expression, cardinality, negated, predicated].
+    The terminals of the hidden() section are listed under "hidden". With
+    a keyword table the terminal name of every literal is listed under
+    "keywords".
+    """
+
+    def emit(self, rules: RuleTable):
+        write = self.write
+        write('{"start":')
+        write(json.dumps(rules.first().name))
+        write(',"rules":[')
+        for idx, rule in enumerate(rules):
+            if idx:
+                write(",")
+            write('{"name":')
+            write(json.dumps(rule.name))
+            flags = [
+                flag
+                for flag, is_set in (
+                    ("terminal", rule.is_terminal),
+                    ("fragment", rule.is_fragment),
+                    ("enum", rule.is_enum),
+                )
+                if is_set
+            ]
+            if flags:
+                write(',"flags":')
+                write(json.dumps(flags))
+            write(',"body":')
+            self.write_expression(rule.body)
+            write("}")
+        write("]")
+        if rules.hidden:
+            write(',"hidden":')
+            write(json.dumps(rules.hidden))
+        if self.keywords is not None:
+            write(',"keywords":')
+            write(json.dumps({k.text: k.terminal for k in self.keywords}))
+        write("}\n")
+
+    def write_expression(self, expr: Expression):
+        write = self.write
+        if isinstance(expr, NameResolution):
+            self.write_expression(expr.rule_calls[0])
+
+        elif isinstance(expr, AtomicExpression):
+            if isinstance(expr, RuleCallExpression):
+                write('["call",')
+            elif isinstance(expr, RegularExpression):
+                write('["re",')
+            elif isinstance(expr, LiteralExpression):
+                write('["lit",')
+            else:
+                write('["atom",')
+            write(json.dumps(expr.value))
+            write("]")
+
+        elif isinstance(expr, (SequenceExpression, OrExpression)):
+            if isinstance(expr, SequenceExpression):
+                write('["seq",[')
+                items = [e for e in expr.expressions if not isinstance(e, NonParsing)]
+            else:
+                write('["or",[')
+                items = expr.expressions
+            for idx, item in enumerate(items):
+                if idx:
+                    write(",")
+                self.write_expression(item)
+            write("]]")
+
+        elif isinstance(expr, GroupExpression):
+            write('["group",')
+            self.write_expression(expr.expression)
+            write(",")
+            cardinality = expr.cardinality_type
+            write("null" if cardinality is None else json.dumps(cardinality.value))
+            write(",true" if expr.negated else ",false")
+            write(",true]" if expr.predicated else ",false]")
+
+        else:
+            # non parsing elements match nothing
+            write('["seq",[]]')
+
+
+EMITTERS: dict[OutputFormat, type[Emitter]] = {
+    OutputFormat.LARK: LarkEmitter,
+    OutputFormat.JSON: JsonEmitter,
+}
+
+
+def emit_rules(
+    rules: RuleTable,
+    output: Path,
+    format: OutputFormat = OutputFormat.LARK,
+    keywords: Optional[KeywordTable] = None,
+):
+    """Stream the rules to the output file with the emitter of the given format."""
+    with stage("emit", format=format.value):
+        with open(output, "w", buffering=BUFFER_SIZE) as f:
+            EMITTERS[format](f, keywords).emit(rules)
@@ -1,7 +1,7 @@
 from dataclasses import dataclass
-from typing import List, Optional
+from typing import Optional, Tuple, TypeVar
 from enum import Enum
-from abc import ABC
+from abc import ABC, abstractmethod
 
 
 class CardinalityType(Enum):
@@ -10,89 +10,173 @@ class CardinalityType(Enum):
     ZERO_OR_MORE = "*"
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class DataType:
     namespace: str
-    qualified_name: list[str]
+    qualified_name: Tuple[str, ...]
 
 
 class Expression(ABC):
-    """Base expression class"""
+    """
+    Base expression class
+
+    Expressions are immutable, so their hash and rendered string are
+    computed once and cached. Subclasses are frozen slotted dataclasses
+    with eq=False, equality is structural and implemented here.
+    """
+
+    __slots__ = ("_hash", "_str")
+
+    def __hash__(self):
+        try:
+            return self._hash
+        except AttributeError:
+            fields = tuple(getattr(self, name) for name in self.__match_args__)
+            value = hash((type(self), fields))
+            object.__setattr__(self, "_hash", value)
+            return value
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if type(self) is not type(other) or hash(self) != hash(other):
+            return False
+        return all(
+            getattr(self, name) == getattr(other, name) for name in self.__match_args__
+        )
 
-    pass
-
-
-@dataclass
+    def __str__(self):
+        try:
+            return self._str
+        except AttributeError:
+            value = self._render()
+            object.__setattr__(self, "_str", value)
+            return value
+
+    @abstractmethod
+    def _render(self) -> str:
+        """The expression in Lark syntax."""
+
+
+E = TypeVar("E", bound=Expression)
+
+
+class ExpressionFactory:
+    """
+    Interns expressions so structurally equal subtrees share one object.
+
+    Build trees bottom up and intern every node, children are then already
+    shared and comparing a node to its interned twin is cheap.
+    """
+
+    def __init__(self):
+        self._nodes: dict[Expression, Expression] = {}
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def intern(self, expr: E) -> E:
+        return self._nodes.setdefault(expr, expr)
+
+    def intern_tree(self, expr):
+        """Intern a tree that was built elsewhere, e.g. unpickled."""
+        if isinstance(expr, (SequenceExpression, OrExpression)):
+            expr = type(expr)(tuple(self.intern_tree(e) for e in expr.expressions))
+        elif isinstance(expr, GroupExpression):
+            expr = GroupExpression(
+                self.intern_tree(expr.expression),
+                expr.negated,
+                expr.cardinality_type,
+                expr.predicated,
+            )
+        elif isinstance(expr, NameResolution):
+            expr = NameResolution(
+                tuple(self.intern_tree(e) for e in expr.rule_calls), expr.data_types
+            )
+        elif not isinstance(expr, Expression):
+            # sentinels such as NON_PARSING are singletons already
+            return expr
+        return self.intern(expr)
+
+
+@dataclass(frozen=True, slots=True, eq=False)
 class AtomicExpression(Expression):
     """Leaf node representing a basic expression"""
 
     value: str
 
-    def __str__(self):
+    def _render(self):
         return str(self.value)
 
 
-@dataclass
+@dataclass(frozen=True, slots=True, eq=False)
 class RegularExpression(AtomicExpression):
     """Represents a regular expression"""
 
-    def __str__(self):
+    def _render(self):
         return f"/{self.value}/"
 
 
-@dataclass
+@dataclass(frozen=True, slots=True, eq=False)
 class RuleCallExpression(AtomicExpression):
     """Represents a rule call expression"""
 
     pass
 
 
-@dataclass
+@dataclass(frozen=True, slots=True, eq=False)
 class LiteralExpression(AtomicExpression):
     """Represents a literal expression"""
 
     pass
 
 
-@dataclass
+@dataclass(frozen=True, slots=True, eq=False)
 class SequenceExpression(Expression):
     """Represents a sequence of expressions (AND)"""
 
-    expressions: List[Expression]
+    expressions: Tuple[Expression, ...]
 
-    def __str__(self):
+    def _render(self):
         return " ".join(str(expr) for expr in self.expressions)
 
 
-@dataclass
+@dataclass(frozen=True, slots=True, eq=False)
 class OrExpression(Expression):
     """Represents a disjunction of expressions (OR)"""
 
-    expressions: List[Expression]
+    expressions: Tuple[Expression, ...]
 
-    def __str__(self):
+    def _render(self):
         return " | ".join(str(expr) for expr in self.expressions)
 
 
-@dataclass
+@dataclass(frozen=True, slots=True, eq=False)
 class GroupExpression(Expression):
-    """Represents a group of expressions in parentheses"""
+    """
+    Represents a group of expressions in parentheses
+
+    A predicated group is the element after a syntactic predicate, => or
+    ->, the parser commits to it whenever it matches.
+    """
 
     expression: Expression
     negated: bool = False
     cardinality_type: Optional[CardinalityType] = None
+    predicated: bool = False
 
-    def __str__(self):
+    def _render(self):
+        # a predicate has no Lark syntax, the emitter writes its helper rule
         result = f"{'!' if self.negated else ''}({str(self.expression)})"
         if self.cardinality_type is not None:
             result += f"{self.cardinality_type.value}"
         return result
 
 
-@dataclass
+@dataclass(frozen=True, slots=True, eq=False)
 class NameResolution(Expression):
-    rule_calls: List[RuleCallExpression]
-    data_types: List[DataType]
+    rule_calls: Tuple[RuleCallExpression, ...]
+    data_types: Tuple[DataType, ...]
 
     def __post_init__(self):
         if len(self.data_types) > 1:
@@ -100,5 +184,5 @@ class NameResolution(Expression):
         if len(self.rule_calls) != 1:
             raise ValueError("Multiple or None rule calls found in name resolution.")
 
-    def __str__(self):
+    def _render(self):
         return str(self.rule_calls[0])
@@ -0,0 +1,431 @@
+import random
+import re
+from collections import Counter
+from dataclasses import dataclass
+from typing import Iterator, Optional
+from .expression import (
+    CardinalityType,
+    LiteralExpression,
+    RegularExpression,
+    RuleCallExpression,
+    SequenceExpression,
+    OrExpression,
+    GroupExpression,
+    NameResolution,
+)
+from .passes import called_rules
+from .table import RuleTable
+from .utils import literal_text
+
+INFINITY = float("inf")
+
+# Root of the KerML expression rules, nested calls make an expression complex.
+# OwnedExpression only calls ConditionalExpression and is inlined by the passes.
+EXPRESSION_RULES = ("owned_expression", "conditional_expression")
+
+# Rules the model is built from, by the option that sets how many are generated.
+DEFINITION_RULES = {
+    "parts": "part_definition",
+    "attributes": "attribute_definition",
+    "constraints": "constraint_definition",
+}
+
+# Element generated to fill the model up to the requested size.
+FILL_RULE = "package_body_element"
+
+# Elements generated to reach a rule that no element generated so far.
+COVER_ATTEMPTS = 3
+
+_CHAR_RANGE = re.compile(r"^\[(.)-(.)\]$")
+
+
+@dataclass
+class GeneratorOptions:
+    seed: int = 0
+    # rule calls below a top level element
+    max_depth: int = 16
+    # nested { } blocks
+    max_nesting: int = 3
+    # nested owned_expression calls
+    max_expression_depth: int = 2
+    # upper bound of the repetitions of x* and x+
+    max_repeat: int = 3
+    # tokens of a top level element after which it's finished the shortest way
+    max_element_tokens: int = 200
+
+
+class SysMLGenerator:
+    """
+    Generates syntactically valid SysML by walking the converted rules.
+
+    Every choice is made by a seeded random generator, so the same rules and
+    options always produce the same text. Alternatives are coverage guided,
+    the least taken alternative that fits into the remaining depth is picked.
+    Near the depth limit only alternatives with the shortest derivation fit,
+    at the nesting limit only those that can be written without a block.
+    With a target rule the alternatives and optional groups that can still
+    reach it within the remaining depth are taken first.
+    """
+
+    def __init__(self, rules: RuleTable, options: Optional[GeneratorOptions] = None):
+        self.rules = rules
+        self.options = options if options is not None else GeneratorOptions()
+        self.random = random.Random(self.options.seed)
+        self.rule_hits: Counter[str] = Counter()
+        self.alternative_hits: Counter[tuple] = Counter()
+        self._names = 0
+        self._nesting = 0
+        self._expression_depth = 0
+        self.expression_rule = next((n for n in EXPRESSION_RULES if n in rules), None)
+        self.heights = self._rule_heights()
+        self.flat = self._flat_rules()
+        # per expression, computed on first use
+        self._heights: dict = {}
+        self._flat: dict = {}
+        self._calls: dict = {}
+        self.target: Optional[str] = None
+        # rule -> rule calls from entering it to entering the target
+        self._distances: dict[str, int] = {}
+
+    def _rule_heights(self) -> dict[str, float]:
+        heights = {
+            rule.name: 1 if rule.is_terminal else INFINITY for rule in self.rules
+        }
+        changed = True
+        while changed:
+            changed = False
+            for rule in self.rules:
+                height = 1 + self._height(rule.body, heights)
+                if height < heights[rule.name]:
+                    heights[rule.name] = height
+                    changed = True
+        return heights
+
+    def _flat_rules(self) -> dict[str, bool]:
+        flat = {rule.name: rule.is_terminal for rule in self.rules}
+        changed = True
+        while changed:
+            changed = False
+            for rule in self.rules:
+                if not flat[rule.name] and self._is_flat(rule.body, flat):
+                    flat[rule.name] = True
+                    changed = True
+        return flat
+
+    def _height(self, expr, heights: Optional[dict] = None):
+        """Fewest nested rule calls needed to derive the expression."""
+        heights = heights if heights is not None else self.heights
+        if isinstance(expr, NameResolution):
+            expr = expr.rule_calls[0]
+        if isinstance(expr, RuleCallExpression):
+            return heights.get(expr.value, INFINITY)
+        if isinstance(expr, SequenceExpression):
+            return max((self._height(e, heights) for e in expr.expressions), default=0)
+        if isinstance(expr, OrExpression):
+            return min(self._height(e, heights) for e in expr.expressions)
+        if isinstance(expr, GroupExpression):
+            if expr.negated or self._is_optional(expr):
+                return 0
+            return self._height(expr.expression, heights)
+        return 0
+
+    def _is_flat(self, expr, flat: Optional[dict] = None) -> bool:
+        """Whether the expression can be derived without opening a block."""
+        flat = flat if flat is not None else self.flat
+        if isinstance(expr, NameResolution):
+            expr = expr.rule_calls[0]
+        if isinstance(expr, RuleCallExpression):
+            return flat.get(expr.value, False)
+        if isinstance(expr, LiteralExpression):
+            return literal_text(expr.value) != "{"
+        if isinstance(expr, SequenceExpression):
+            return all(self._is_flat(e, flat) for e in expr.expressions)
+        if isinstance(expr, OrExpression):
+            return any(self._is_flat(e, flat) for e in expr.expressions)
+        if isinstance(expr, GroupExpression):
+            return (
+                expr.negated
+                or self._is_optional(expr)
+                or self._is_flat(expr.expression, flat)
+            )
+        return True
+
+    @staticmethod
+    def _is_optional(expr: GroupExpression) -> bool:
+        return expr.cardinality_type in (
+            CardinalityType.OPTIONAL,
+            CardinalityType.ZERO_OR_MORE,
+        )
+
+    def _fits(self, expr, budget: int) -> bool:
+        height = self._heights.get(expr)
+        if height is None:
+            height = self._heights[expr] = self._height(expr)
+        if height > budget:
+            return False
+        if self._nesting < self.options.max_nesting:
+            return True
+        flat = self._flat.get(expr)
+        if flat is None:
+            flat = self._flat[expr] = self._is_flat(expr)
+        return flat
+
+    def _target_distances(self, target: str) -> dict[str, int]:
+        callers: dict[str, list[str]] = {}
+        for rule in self.rules:
+            for name in rule.called_rules:
+                callers.setdefault(name, []).append(rule.name)
+        distances = {target: 0}
+        level = [target]
+        while level:
+            following = []
+            for name in level:
+                for caller in callers.get(name, ()):
+                    if caller not in distances:
+                        distances[caller] = distances[name] + 1
+                        following.append(caller)
+            level = following
+        return distances
+
+    @property
+    def targeting(self) -> bool:
+        return self.target is not None and self.target not in self.rule_hits
+
+    def _target_distance(self, expr):
+        """Fewest nested rule calls from the expression to the target."""
+        calls = self._calls.get(expr)
+        if calls is None:
+            calls = self._calls[expr] = called_rules(expr)
+        return min(
+            (self._distances.get(name, INFINITY) for name in calls), default=INFINITY
+        )
+
+    def generate(self, name: str, target: Optional[str] = None) -> list[str]:
+        """Tokens of a random derivation of the rule, through target if given."""
+        tokens: list[str] = []
+        self.target = target
+        self._distances = self._target_distances(target) if target else {}
+        try:
+            self._rule(name, self.options.max_depth, tokens)
+        finally:
+            self.target = None
+        return tokens
+
+    def _rule(self, name: str, budget: int, tokens: list[str]):
+        rule = self.rules[name]
+        self.rule_hits[name] += 1
+        if rule.is_terminal:
+            tokens.append(self._terminal(name))
+            return
+        if len(tokens) >= self.options.max_element_tokens:
+            budget = 0
+        if name != self.expression_rule:
+            self._expression(rule.body, budget - 1, tokens)
+            return
+        self._expression_depth += 1
+        if self._expression_depth > self.options.max_expression_depth:
+            # only the simplest expression from here on
+            budget = 0
+        try:
+            self._expression(rule.body, budget - 1, tokens)
+        finally:
+            self._expression_depth -= 1
+
+    def _expression(self, expr, budget: int, tokens: list[str]):
+        if isinstance(expr, NameResolution):
+            expr = expr.rule_calls[0]
+        if isinstance(expr, RuleCallExpression):
+            self._rule(expr.value, budget, tokens)
+        elif isinstance(expr, LiteralExpression):
+            text = literal_text(expr.value)
+            if text == "{":
+                self._nesting += 1
+            elif text == "}":
+                self._nesting -= 1
+            tokens.append(text)
+        elif isinstance(expr, SequenceExpression):
+            for item in expr.expressions:
+                self._expression(item, budget, tokens)
+        elif isinstance(expr, OrExpression):
+            self._expression(self._choose(expr, budget), budget, tokens)
+        elif isinstance(expr, GroupExpression):
+            self._group(expr, budget, tokens)
+
+    def _choose(self, expr: OrExpression, budget: int):
+        """The least taken alternative that fits, ties are broken at random."""
+        alternatives = list(enumerate(expr.expressions))
+        fitting = [(i, e) for i, e in alternatives if self._fits(e, budget)]
+        if self.targeting and fitting:
+            # the shortest way to the target, if there is one within the budget
+            distances = {i: self._target_distance(e) for i, e in fitting}
+            closest = min(distances.values())
+            if closest <= budget:
+                fitting = [(i, e) for i, e in fitting if distances[i] == closest]
+        if not fitting:
+            # over the limit, take the way out with the fewest rule calls
+            fitting = sorted(
+                alternatives,
+                key=lambda a: (not self._is_flat(a[1]), self._height(a[1])),
+            )[:1]
+        fewest = min(self.alternative_hits[(expr, i)] for i, _ in fitting)
+        idx, alternative = self.random.choice(
+            [(i, e) for i, e in fitting if self.alternative_hits[(expr, i)] == fewest]
+        )
+        self.alternative_hits[(expr, idx)] += 1
+        return alternative
+
+    def _group(self, expr: GroupExpression, budget: int, tokens: list[str]):
+        if expr.negated:
+            return
+        cardinality = expr.cardinality_type
+        if cardinality is None:
+            self._expression(expr.expression, budget, tokens)
+            return
+        fits = self._fits(expr.expression, budget)
+        # fewer repetitions the deeper the group is, so elements stay finite
+        share = max(budget, 0) / self.options.max_depth
+        if self.targeting:
+            # only what leads to the target is added on the way there
+            targeted = fits and self._target_distance(expr.expression) <= budget
+            low = 1 if cardinality is CardinalityType.AT_LEAST_ONE else 0
+            count = 1 if targeted else low
+        elif cardinality is CardinalityType.OPTIONAL:
+            # groups never taken so far are always taken once
+            taken = (
+                self.alternative_hits[(expr, 0)] == 0 or self.random.random() < share
+            )
+            count = 1 if fits and taken else 0
+        else:
+            low = 1 if cardinality is CardinalityType.AT_LEAST_ONE else 0
+            high = max(low, round(self.options.max_repeat * share))
+            count = self.random.randint(low, high) if fits else low
+        if count:
+            self.alternative_hits[(expr, 0)] += 1
+        for _ in range(count):
+            self._expression(expr.expression, budget, tokens)
+
+    def _terminal(self, name: str) -> str:
+        sample = TERMINAL_SAMPLES.get(name)
+        if sample is not None:
+            return sample(self)
+        return "".join(self._terminal_text(self.rules[name].body))
+
+    def _terminal_text(self, expr) -> Iterator[str]:
+        """Text matched by an expression of a terminal rule, without samples."""
+        if isinstance(expr, RuleCallExpression):
+            yield self._terminal(expr.value)
+        elif isinstance(expr, RegularExpression):
+            match = _CHAR_RANGE.match(expr.value)
+            if match:
+                yield chr(self.random.randint(ord(match[1]), ord(match[2])))
+        elif isinstance(expr, LiteralExpression):
+            yield literal_text(expr.value)
+        elif isinstance(expr, SequenceExpression):
+            for item in expr.expressions:
+                yield from self._terminal_text(item)
+        elif isinstance(expr, OrExpression):
+            yield from self._terminal_text(self.random.choice(expr.expressions))
+        elif isinstance(expr, GroupExpression) and not expr.negated:
+            if expr.cardinality_type in (None, CardinalityType.AT_LEAST_ONE):
+                yield from self._terminal_text(expr.expression)
+
+    def name(self) -> str:
+        self._names += 1
+        return f"n{self._names}"
+
+    def reachable_rules(self) -> list[str]:
+        """Rules reachable from a package element, in table order."""
+        reachable = {FILL_RULE}
+        stack = [FILL_RULE]
+        while stack:
+            for name in self.rules[stack.pop()].called_rules:
+                if name not in reachable and name in self.rules:
+                    reachable.add(name)
+                    stack.append(name)
+        return [rule.name for rule in self.rules if rule.name in reachable]
+
+    def missing_rules(self) -> list[str]:
+        """Reachable rules that weren't generated yet."""
+        return [name for name in self.reachable_rules() if name not in self.rule_hits]
+
+    @property
+    def coverage(self) -> tuple[int, int]:
+        """Rules generated at least once and rules reachable from the package."""
+        reachable = self.reachable_rules()
+        return len(reachable) - len(self.missing_rules()), len(reachable)
+
+
+# Terminals whose XText definition doesn't convert into something to sample,
+# or that must not produce keywords.
+TERMINAL_SAMPLES = {
+    "ID": SysMLGenerator.name,
+    "UNRESTRICTED_NAME": lambda g: f"'{g.name()} name'",
+    "STRING_VALUE": lambda g: f'"{g.name()} text"',
+    "DECIMAL_VALUE": lambda g: str(g.random.randint(0, 999)),
+    "EXP_VALUE": lambda g: f"{g.random.randint(1, 9)}e{g.random.randint(0, 9)}",
+    "REGULAR_COMMENT": lambda g: f"/* {g.name()} comment */",
+    "ML_NOTE": lambda g: f"//* {g.name()} note */",
+    "SL_NOTE": lambda g: f"// {g.name()} note\n",
+}
+
+
+def format_tokens(tokens: list[str], indent: int = 0) -> Iterator[str]:
+    """Lay out tokens one statement per line, blocks indented."""
+    line: list[str] = []
+    for token in tokens:
+        if token == "}":
+            if line:
+                yield "    " * indent + " ".join(line) + "\n"
+                line = []
+            indent -= 1
+        line.append(token)
+        if token in ("{", "}", ";") or token.endswith("\n"):
+            yield "    " * indent + " ".join(line).rstrip("\n") + "\n"
+            line = []
+            if token == "{":
+                indent += 1
+    if line:
+        yield "    " * indent + " ".join(line) + "\n"
+
+
+def generate_model(
+    generator: SysMLGenerator,
+    size: int = 0,
+    counts: Optional[dict[str, int]] = None,
+    cover: bool = True,
+) -> Iterator[str]:
+    """
+    Stream a package of generated elements.
+
+    The definitions in counts, e.g. {"parts": 10}, are generated first,
+    then random package elements until about size bytes are written. With
+    cover every reachable rule that wasn't generated by then becomes the
+    target of up to COVER_ATTEMPTS more elements, the rules the depth and
+    nesting limits keep out of reach stay in missing_rules().
+    """
+    written = 0
+    header = f"package {generator.name()} {{\n"
+    yield header
+    written += len(header)
+
+    elements = [
+        DEFINITION_RULES[kind]
+        for kind, count in (counts or {}).items()
+        for _ in range(count)
+    ]
+    generator.random.shuffle(elements)
+    for element in elements:
+        for line in format_tokens(generator.generate(element), indent=1):
+            written += len(line)
+            yield line
+    while written < size:
+        for line in format_tokens(generator.generate(FILL_RULE), indent=1):
+            written += len(line)
+            yield line
+    for target in generator.missing_rules() if cover else []:
+        for _ in range(COVER_ATTEMPTS):
+            if target in generator.rule_hits:
+                break
+            tokens = generator.generate(FILL_RULE, target)
+            yield from format_tokens(tokens, indent=1)
+    yield "}\n"
@@ -0,0 +1,448 @@
+import re
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from typing import Optional, Union
+from lark import Lark, Token, Tree
+from lark.exceptions import UnexpectedInput
+from .tracing import stage
+
+Node = Union[Tree, Token]
+
+
+def root_rule(grammar: str) -> Optional[str]:
+    """The rule the start rule of a converted grammar derives, if any."""
+    match = re.search(r"^start: (\w+)\s*$", grammar, re.M)
+    return match.group(1) if match else None
+
+
+def block_rules(grammar: str) -> list[str]:
+    """Rules of a converted grammar that have a { } block, e.g. package_body."""
+    # with --keywords the brace is a named terminal
+    braces = re.findall(r'^([A-Z_][A-Z0-9_]*)(?:\.\d+)?: "\{"\s*$', grammar, re.M)
+    brace = re.compile("|".join([r'"\{"', *(rf"\b{name}\b" for name in braces)]))
+    return [
+        match.group(1)
+        for match in re.finditer(r"^([a-z]\w*)(?:\.\d+)?: (.*)$", grammar, re.M)
+        if brace.search(match.group(2))
+    ]
+
+
+def incremental_options(grammar: str, options: dict) -> dict:
+    """
+    Lark options of a parser for Document.
+
+    Positions are propagated to the trees, and the root rule, a sequence of
+    top level elements, and the rules with a { } block are added to the
+    start rules.
+    """
+    root = root_rule(grammar)
+    if root is None:
+        raise ValueError("The grammar has no start rule deriving a single rule")
+    start = options.get("start", "start")
+    starts = [start] if isinstance(start, str) else list(start)
+    for rule in [root, *block_rules(grammar)]:
+        if rule not in starts:
+            starts.append(rule)
+    return dict(options, start=starts, propagate_positions=True)
+
+
+def _positions(node: Node) -> tuple:
+    """Start offset, line and column and end offset, line and column."""
+    if isinstance(node, Token):
+        return (
+            node.start_pos,
+            node.line,
+            node.column,
+            node.end_pos,
+            node.end_line,
+            node.end_column,
+        )
+    meta = node.meta
+    return (
+        meta.start_pos,
+        meta.line,
+        meta.column,
+        meta.end_pos,
+        meta.end_line,
+        meta.end_column,
+    )
+
+
+def _shift(node: Node, offset: int, lines: int, line: int, columns: int):
+    """
+    Move the positions of a subtree by offset characters and lines.
+
+    Columns only change on the given line, the first line of the moved text.
+    """
+
+    def move(item):
+        if item.start_pos is None:
+            return
+        item.start_pos += offset
+        item.end_pos += offset
+        if item.line == line:
+            item.column += columns
+        if item.end_line == line:
+            item.end_column += columns
+        item.line += lines
+        item.end_line += lines
+
+    if isinstance(node, Token):
+        move(node)
+        return
+    for tree in node.iter_subtrees():
+        meta = tree.meta
+        if not meta.empty:
+            move(meta)
+        for child in tree.children:
+            if isinstance(child, Token):
+                move(child)
+
+
+@dataclass
+class Element:
+    """
+    A top level element of a document and where it is now.
+
+    The positions in the parse tree are those of the text it was parsed
+    from, they're only moved to where the element is now when the tree of
+    the document is built.
+    """
+
+    node: Node
+    start: int
+    line: int
+    column: int
+    # where the element was when its tree positions were last updated
+    parsed_start: int
+    parsed_line: int
+    parsed_column: int
+
+    @classmethod
+    def parsed(cls, node: Node) -> "Element":
+        start, line, column = _positions(node)[:3]
+        return cls(node, start, line, column, start, line, column)
+
+    @property
+    def end(self) -> int:
+        return _positions(self.node)[3] + self.start - self.parsed_start
+
+    @property
+    def end_position(self) -> tuple[int, int]:
+        """Line and column of the end of the element."""
+        end_line, end_column = _positions(self.node)[4:]
+        if end_line == self.parsed_line:
+            end_column += self.column - self.parsed_column
+        return end_line + self.line - self.parsed_line, end_column
+
+    def move(self, offset: int, lines: int, columns: int):
+        """Move the element, columns only change if it starts on a moved line."""
+        self.start += offset
+        self.line += lines
+        self.column += columns
+
+    def update_positions(self):
+        if self.start == self.parsed_start and self.line == self.parsed_line:
+            return
+        _shift(
+            self.node,
+            self.start - self.parsed_start,
+            self.line - self.parsed_line,
+            self.parsed_line,
+            self.column - self.parsed_column,
+        )
+        self.parsed_start, self.parsed_line = self.start, self.line
+        self.parsed_column = self.column
+
+
+def _common_prefix(a: str, b: str) -> int:
+    # a binary search over slice comparisons, the characters are compared in C
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[:middle] == b[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def _common_suffix(a: str, b: str, limit: int) -> int:
+    low, high = 0, min(len(a), len(b), limit)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[len(a) - middle :] == b[len(b) - middle :]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def changed_span(old: str, new: str) -> tuple[int, int, int]:
+    """Start of the changed text and its end in the old and in the new text."""
+    prefix = _common_prefix(old, new)
+    suffix = _common_suffix(old, new, min(len(old), len(new)) - prefix)
+    return prefix, len(old) - suffix, len(new) - suffix
+
+
+class Document:
+    """
+    A parsed SysML document that is reparsed incrementally as it's edited.
+
+    An edit inside a { } block, e.g. the body of a package or a definition,
+    only reparses the innermost block around it, from the rule the block
+    belongs to. Its text is delimited by the braces, so whatever that rule
+    derives from it fits into the rest of the tree unchanged. If the block
+    doesn't parse anymore, e.g. because the edit closed it, the enclosing
+    blocks are tried. The new block replaces the old one in the tree and
+    the positions after it are moved.
+
+    Other edits reparse the text between the unchanged top level elements
+    before and after it from the root rule, a sequence of independent top
+    level elements. If that text doesn't parse on its own, the region
+    grows by the neighbouring elements until it parses or spans the whole
+    document. The reparsed elements are spliced into the tree, the elements
+    after them are moved without being parsed.
+
+    The parser needs the options of incremental_options().
+    """
+
+    def __init__(self, parser: Lark, text: Optional[str] = None):
+        self.parser = parser
+        self.root = self._root_rule(parser)
+        self.blocks = self._block_rules(parser)
+        self.text = ""
+        self.elements: list[Element] = []
+        # characters parsed by the last parse or edit
+        self.reparsed = 0
+        self._tree: Optional[Tree] = None
+        # trees from the start rule down to the root rule
+        self._path: list[Tree] = []
+        if text is not None:
+            self.parse(text)
+
+    @staticmethod
+    def _root_rule(parser: Lark) -> str:
+        if not parser.options.propagate_positions:
+            raise ValueError("The parser doesn't propagate positions")
+        for rule in parser.rules:
+            if rule.origin.name == "start" and len(rule.expansion) == 1:
+                root = rule.expansion[0].name
+                if root in parser.options.start:
+                    return root
+        raise ValueError("The parser can't start with the root rule of its grammar")
+
+    @staticmethod
+    def _block_rules(parser: Lark) -> set[str]:
+        braces = {
+            terminal.name
+            for terminal in parser.terminals
+            if terminal.pattern.type == "str" and terminal.pattern.value == "{"
+        }
+        return {
+            rule.origin.name
+            for rule in parser.rules
+            if rule.origin.name in parser.options.start
+            and any(symbol.name in braces for symbol in rule.expansion)
+        }
+
+    @property
+    def tree(self) -> Optional[Tree]:
+        """The parse tree of the whole document, with current positions."""
+        if self._tree is None:
+            return None
+        for element in self.elements:
+            element.update_positions()
+        self._path[-1].children = [element.node for element in self.elements]
+        if self.elements:
+            first, last = self.elements[0], self.elements[-1]
+            end_line, end_column = last.end_position
+            for tree in self._path:
+                meta = tree.meta
+                meta.empty = False
+                meta.start_pos, meta.line, meta.column = (
+                    first.start,
+                    first.line,
+                    first.column,
+                )
+                meta.end_pos, meta.end_line, meta.end_column = (
+                    last.end,
+                    end_line,
+                    end_column,
+                )
+        return self._tree
+
+    def parse(self, text: str) -> Tree:
+        """Parse the text, only reparsing what changed since the last parse."""
+        self.update(text)
+        return self.tree
+
+    def update(self, text: str) -> list[Element]:
+        """Update the document to the text, returns the reparsed elements."""
+        if self._tree is None:
+            return self._parse_all(text)
+        if text == self.text:
+            self.reparsed = 0
+            return []
+        start, old_end, new_end = changed_span(self.text, text)
+        return self.edit(start, old_end, text[start:new_end])
+
+    def _parse_all(self, text: str) -> list[Element]:
+        with stage("parse-document", size=len(text)):
+            tree = self.parser.parse(text, start="start")
+        path = [tree]
+        while path[-1].data != self.root:
+            children = [child for child in path[-1].children if isinstance(child, Tree)]
+            if len(children) != 1:
+                raise ValueError(f"The tree has no {self.root} below its start rule")
+            path.append(children[0])
+        self._tree, self._path = tree, path
+        self.elements = [Element.parsed(child) for child in path[-1].children]
+        self.text = text
+        self.reparsed = len(text)
+        return list(self.elements)
+
+    def edit(self, start: int, end: int, replacement: str) -> list[Element]:
+        """
+        Replace the text from start to end and reparse what it touched.
+
+        Returns the reparsed elements. If even the whole document doesn't
+        parse, the parse error is raised and the document stays unchanged.
+        """
+        if self._tree is None:
+            raise ValueError("The document has to be parsed before it's edited")
+        if not 0 <= start <= end <= len(self.text):
+            raise ValueError(
+                f"Invalid edit of {start}:{end}, the text has {len(self.text)} characters"
+            )
+        text = self.text[:start] + replacement + self.text[end:]
+        offset = len(replacement) - (end - start)
+        reparsed = self._edit_block(start, end, text, offset)
+        if reparsed is not None:
+            return reparsed
+        elements = self.elements
+        # the elements touching the edit, an edit right at the end of an
+        # element can extend it
+        low = bisect_left([element.end for element in elements], start)
+        high = bisect_right([element.start for element in elements], end)
+        while True:
+            region_start = elements[low - 1].end if low > 0 else 0
+            old_region_end = elements[high].start if high < len(elements) else None
+            region_end = (
+                len(text) if old_region_end is None else old_region_end + offset
+            )
+            region = text[region_start:region_end]
+            try:
+                with stage("reparse", size=len(region)):
+                    tree = self.parser.parse(region, start=self.root)
+                break
+            except UnexpectedInput:
+                if low == 0 and high == len(elements):
+                    raise
+                width = max(high - low, 1)
+                low, high = max(low - width, 0), min(high + width, len(elements))
+
+        if low > 0:
+            line, column = elements[low - 1].end_position
+        else:
+            line, column = 1, 1
+        reparsed = []
+        for node in tree.children:
+            _shift(node, region_start, line - 1, 1, column - 1)
+            reparsed.append(Element.parsed(node))
+
+        following = elements[high:]
+        if following:
+            # where the text after the region starts, before and after the edit
+            old_line, old_column = following[0].line, following[0].column
+            newlines = region.count("\n")
+            if newlines:
+                new_column = len(region) - region.rfind("\n")
+            else:
+                new_column = column + len(region)
+            lines = line + newlines - old_line
+            columns = new_column - old_column
+            for element in following:
+                element.move(offset, lines, columns if element.line == old_line else 0)
+
+        self.elements = elements[:low] + reparsed + following
+        self.text = text
+        self.reparsed = len(region)
+        return reparsed
+
+    def _edit_block(
+        self, start: int, end: int, text: str, offset: int
+    ) -> Optional[list[Element]]:
+        """
+        Reparse the innermost block around an edit, returns the element
+        holding it or None if the edit isn't inside a block that parses.
+        """
+        idx = bisect_right([element.start for element in self.elements], start) - 1
+        if idx < 0 or not self.blocks:
+            return None
+        element = self.elements[idx]
+        if not isinstance(element.node, Tree) or end >= element.end:
+            return None
+        element.update_positions()
+
+        # the trees from the element down to the innermost one around the
+        # edit, with the index of the next one among their children
+        path: list[tuple[Tree, int]] = []
+        node = element.node
+        while True:
+            child = next(
+                (
+                    idx
+                    for idx, child in enumerate(node.children)
+                    if isinstance(child, Tree)
+                    and not child.meta.empty
+                    and child.meta.start_pos <= start
+                    and end <= child.meta.end_pos
+                ),
+                None,
+            )
+            path.append((node, child))
+            if child is None:
+                break
+            node = node.children[child]
+
+        for depth in reversed(range(len(path))):
+            block = path[depth][0]
+            meta = block.meta
+            # the braces have to be outside of the edit
+            if block.data not in self.blocks or not (
+                meta.start_pos < start and end < meta.end_pos
+            ):
+                continue
+            region = text[meta.start_pos : meta.end_pos + offset]
+            try:
+                with stage("reparse", size=len(region), rule=block.data):
+                    tree = self.parser.parse(region, start=block.data)
+            except UnexpectedInput:
+                continue
+            _shift(tree, meta.start_pos, meta.line - 1, 1, meta.column - 1)
+
+            # the text after the block moves by the lines and columns it grew
+            line = meta.end_line
+            lines = tree.meta.end_line - line
+            columns = tree.meta.end_column - meta.end_column
+            for ancestor, child in path[:depth]:
+                ancestor_meta = ancestor.meta
+                ancestor_meta.end_pos += offset
+                if ancestor_meta.end_line == line:
+                    ancestor_meta.end_column += columns
+                ancestor_meta.end_line += lines
+                for following in ancestor.children[child + 1 :]:
+                    _shift(following, offset, lines, line, columns)
+            if depth:
+                parent, child = path[depth - 1]
+                parent.children[child] = tree
+            else:
+                element.node = tree
+            for following in self.elements[idx + 1 :]:
+                following.move(offset, lines, columns if following.line == line else 0)
+
+            self.text = text
+            self.reparsed = len(region)
+            return [element]
+        return None
@@ -0,0 +1,242 @@
+import json
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterator, Optional
+from lark import Lark, Tree
+from lark.parsers.lalr_parser import LALR_Parser
+from .lalr import generated_rule
+from .table import RuleTable
+
+# Locations kept of the ambiguities of every rule.
+LOCATIONS = 5
+
+
+def xtext_rule_name(name: str, rules: Optional[RuleTable] = None) -> str:
+    """
+    The XText rule a rule of the generated grammar was converted from.
+
+    Without the rule table the snake case conversion is reversed, which
+    gives the XText name for everything but names with acronyms.
+    """
+    rule = rules.get(name) if rules is not None else None
+    if rule is not None and rule.xtext_name:
+        return rule.xtext_name
+    if name.isupper():
+        return name
+    return "".join(part.capitalize() for part in name.split("_"))
+
+
+def lark_grammar_rules(parser: Lark) -> set[str]:
+    """The rules of the grammar of a parser, without Lark's helper rules."""
+    return {generated_rule(str(rule.origin.name)) for rule in parser.rules}
+
+
+@dataclass
+class RuleStats:
+    """
+    How often the rules of a generated grammar are used to parse a corpus.
+
+    Completions count the nodes of every successful parse tree, work counts
+    the Earley items or the LALR reductions, of failed parses as well.
+    EBNF helper rules Lark creates count for the rule they belong to.
+
+    Trees of Earley parses with explicit ambiguity have an _ambig node
+    wherever the text has several derivations. Each one counts for the
+    rule derived, with the tree nodes of its derivations beyond the
+    smallest one as the extra work resolving the ambiguity throws away.
+    """
+
+    completions: Counter[str] = field(default_factory=Counter)
+    work: Counter[str] = field(default_factory=Counter)
+    files: int = 0
+    ambiguities: Counter[str] = field(default_factory=Counter)
+    derivations: Counter[str] = field(default_factory=Counter)
+    extra: Counter[str] = field(default_factory=Counter)
+    # "file:line:column" of the first ambiguities of every rule
+    locations: dict[str, list[str]] = field(default_factory=dict)
+    # file the stats of a single parse are about
+    file: str = ""
+
+    def merge(self, other: "RuleStats"):
+        self.completions.update(other.completions)
+        self.work.update(other.work)
+        self.files += other.files
+        self.ambiguities.update(other.ambiguities)
+        self.derivations.update(other.derivations)
+        self.extra.update(other.extra)
+        for rule, locations in other.locations.items():
+            kept = self.locations.setdefault(rule, [])
+            kept.extend(locations[: LOCATIONS - len(kept)])
+
+    def count_tree(self, tree: Tree):
+        ambiguous = False
+        for subtree in tree.iter_subtrees():
+            if subtree.data == "_ambig":
+                ambiguous = True
+            else:
+                self.completions[generated_rule(str(subtree.data))] += 1
+        if ambiguous:
+            self.count_ambiguities(tree)
+
+    def count_ambiguities(self, tree: Tree):
+        # nodes of every subtree, of the smallest derivation of an ambiguity,
+        # counted bottom up without recursion as the trees are deep
+        sizes: dict[int, int] = {}
+        stack = [(tree, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if id(node) in sizes:
+                continue
+            children = [child for child in node.children if isinstance(child, Tree)]
+            if not expanded:
+                stack.append((node, True))
+                stack.extend((child, False) for child in children)
+                continue
+            child_sizes = [sizes[id(child)] for child in children]
+            tokens = len(node.children) - len(children)
+            if node.data != "_ambig" or not children:
+                sizes[id(node)] = 1 + tokens + sum(child_sizes)
+                continue
+            smallest = min(child_sizes)
+            sizes[id(node)] = smallest
+            rule = generated_rule(str(children[0].data))
+            self.ambiguities[rule] += 1
+            self.derivations[rule] += len(children)
+            self.extra[rule] += sum(child_sizes) - smallest
+            # an ambiguity nested in another one is repeated in its derivations
+            locations = self.locations.setdefault(rule, [])
+            meta = children[0].meta
+            if len(locations) < LOCATIONS and not meta.empty:
+                location = f"{self.file}:{meta.line}:{meta.column}"
+                if location not in locations:
+                    locations.append(location)
+
+    def unused(self, grammar_rules: set[str]) -> list[str]:
+        """Rules of the grammar no parse ever completed."""
+        return sorted(grammar_rules - set(self.completions))
+
+    def report(
+        self,
+        grammar_rules: set[str],
+        top: int = 20,
+        rules: Optional[RuleTable] = None,
+    ) -> Iterator[str]:
+        total = sum(self.work.values()) or 1
+        yield f"{'rule':<40} {'xtext rule':<40} {'completed':>10} {'work':>10}"
+        for name, work in self.work.most_common(top):
+            yield (
+                f"{name:<40} {xtext_rule_name(name, rules):<40} "
+                f"{self.completions[name]:>10} {work:>10} {work / total:6.1%}"
+            )
+        unused = self.unused(grammar_rules)
+        yield f"{len(grammar_rules) - len(unused)} of {len(grammar_rules)} rules hit."
+
+    def ambiguity_report(
+        self, top: int = 20, rules: Optional[RuleTable] = None
+    ) -> Iterator[str]:
+        """The ambiguous rules, the most extra work first."""
+        if not self.ambiguities:
+            yield "No ambiguities."
+            return
+        total = sum(self.extra.values()) or 1
+        yield (
+            f"{'rule':<40} {'xtext rule':<40} {'ambiguities':>11} "
+            f"{'derivations':>11} {'extra':>10}"
+        )
+        for name, extra in self.extra.most_common(top):
+            yield (
+                f"{name:<40} {xtext_rule_name(name, rules):<40} "
+                f"{self.ambiguities[name]:>11} {self.derivations[name]:>11} "
+                f"{extra:>10} {extra / total:6.1%}"
+            )
+            for location in self.locations.get(name, [])[:1]:
+                yield f"  first at {location}"
+        yield (
+            f"{sum(self.ambiguities.values())} ambiguities in "
+            f"{len(self.ambiguities)} rules."
+        )
+
+    def write_json(
+        self, output: Path, grammar_rules: set[str], rules: Optional[RuleTable] = None
+    ):
+        names = sorted(grammar_rules | set(self.work) | set(self.completions))
+        data = {
+            "files": self.files,
+            "rules": [
+                {
+                    "rule": name,
+                    "xtext_rule": xtext_rule_name(name, rules),
+                    "completions": self.completions[name],
+                    "work": self.work[name],
+                }
+                for name in sorted(names, key=lambda n: -self.work[n])
+            ],
+            "unused": self.unused(grammar_rules),
+        }
+        if self.ambiguities:
+            data["ambiguities"] = [
+                {
+                    "rule": name,
+                    "xtext_rule": xtext_rule_name(name, rules),
+                    "ambiguities": self.ambiguities[name],
+                    "derivations": self.derivations[name],
+                    "extra": extra,
+                    "locations": self.locations.get(name, []),
+                }
+                for name, extra in self.extra.most_common()
+            ]
+        with open(output, "w") as f:
+            json.dump(data, f, indent=2)
+            f.write("\n")
+
+
+class InstrumentedParser:
+    """
+    Wraps a Lark parser to count the rule usage of every parse.
+
+    LALR reductions are counted by wrapping the reduce callbacks, Earley
+    items by looking at the item sets once a parse is done. The wrapped
+    parser is changed in place and shouldn't be used on its own anymore.
+    """
+
+    def __init__(self, parser: Lark, stats: Optional[RuleStats] = None):
+        self.lark = parser
+        self.stats = stats if stats is not None else RuleStats()
+        inner = parser.parser.parser
+        if isinstance(inner, LALR_Parser):
+            callbacks = inner.parser.callbacks
+            for rule, callback in list(callbacks.items()):
+                if not isinstance(rule, str):
+                    callbacks[rule] = self._count_reduction(rule, callback)
+        else:
+            self._count_items(inner)
+
+    def _count_reduction(self, rule, callback):
+        name = generated_rule(str(rule.origin.name))
+
+        def counted(children):
+            self.stats.work[name] += 1
+            return callback(children)
+
+        return counted
+
+    def _count_items(self, earley):
+        parse_columns = earley._parse
+
+        def counted(lexer, columns, to_scan, start_symbol=None):
+            try:
+                return parse_columns(lexer, columns, to_scan, start_symbol)
+            finally:
+                work = self.stats.work
+                for column in columns:
+                    for item in column:
+                        work[generated_rule(str(item.rule.origin.name))] += 1
+
+        earley._parse = counted
+
+    def parse(self, text: str, **kwargs) -> Tree:
+        self.stats.files += 1
+        tree = self.lark.parse(text, **kwargs)
+        self.stats.count_tree(tree)
+        return tree
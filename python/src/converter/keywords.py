@@ -0,0 +1,200 @@
+import json
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+from lark.load_grammar import load_grammar, _TERMINAL_NAMES
+from lark.lexer import PatternRE
+from .expression import (
+    LiteralExpression,
+    SequenceExpression,
+    OrExpression,
+    GroupExpression,
+)
+from .table import RuleTable
+from .utils import literal_text
+
+_WORD = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+@dataclass(frozen=True)
+class Keyword:
+    """A literal of the grammar emitted as a named terminal."""
+
+    # the literal as it's written in the grammar, quotes included
+    literal: str
+    # the text it matches
+    text: str
+    terminal: str
+
+    @property
+    def is_word(self) -> bool:
+        return _WORD.match(self.text) is not None
+
+
+class KeywordTable:
+    """
+    The literals of the non-terminal rules and their terminal names.
+
+    Words are named after themselves, "part" is PART, operators after their
+    characters, "::>" is COLON_COLON_MORETHAN. Names that are taken by a
+    terminal rule or another keyword get a suffix.
+    """
+
+    def __init__(self, taken: Optional[set[str]] = None):
+        self._taken = set(taken or ())
+        self._keywords: dict[str, Keyword] = {}
+
+    def __len__(self) -> int:
+        return len(self._keywords)
+
+    def __iter__(self) -> Iterator[Keyword]:
+        return iter(self._keywords.values())
+
+    def __contains__(self, literal: str) -> bool:
+        return literal in self._keywords
+
+    def terminal(self, literal: str) -> str:
+        return self._keywords[literal].terminal
+
+    def add(self, literal: str) -> Keyword:
+        keyword = self._keywords.get(literal)
+        if keyword is None:
+            text = literal_text(literal)
+            terminal = self._unique(self._terminal_name(text))
+            keyword = self._keywords[literal] = Keyword(literal, text, terminal)
+        return keyword
+
+    @staticmethod
+    def _terminal_name(text: str) -> str:
+        if _WORD.match(text):
+            return text.upper().lstrip("_") or "UNDERSCORE"
+        names = [_TERMINAL_NAMES.get(char) for char in text]
+        if text and all(names):
+            return "_".join(names)
+        return "KEYWORD"
+
+    def _unique(self, name: str) -> str:
+        if name in self._taken:
+            name = f"{name}_KW"
+        unique, idx = name, 1
+        while unique in self._taken:
+            unique = f"{name}_{idx}"
+            idx += 1
+        self._taken.add(unique)
+        return unique
+
+
+def collect_keywords(rules: RuleTable) -> KeywordTable:
+    """
+    Collect the literals of every non-terminal rule in order of appearance.
+
+    Literals inside terminal rules are parts of a token, e.g. the "e" of
+    EXP_VALUE, and stay inline.
+    """
+    keywords = KeywordTable({rule.name.upper() for rule in rules if rule.is_terminal})
+    for rule in rules:
+        if rule.is_terminal:
+            continue
+        stack = [rule.body]
+        while stack:
+            expr = stack.pop()
+            if isinstance(expr, LiteralExpression):
+                keywords.add(expr.value)
+            elif isinstance(expr, (SequenceExpression, OrExpression)):
+                stack.extend(reversed(expr.expressions))
+            elif isinstance(expr, GroupExpression):
+                stack.append(expr.expression)
+    return keywords
+
+
+def reserved_words(
+    grammar: str, keywords: KeywordTable, start: str = "start"
+) -> dict[str, list[str]]:
+    """
+    Map every regex terminal of a grammar to the keywords it also matches.
+
+    Keywords are emitted with the same priority as these terminals, so Lark's
+    basic and contextual lexers match the terminal and then retype the token
+    if its text is one of the reserved words: "part" is PART, "partition"
+    stays an ID, in a single scan without backtracking.
+    """
+    lark_grammar, _ = load_grammar(grammar, "<converted>", [], False)
+    terminals, _, _ = lark_grammar.compile([start], set())
+    reserved: dict[str, list[str]] = {}
+    for terminal in terminals:
+        if not isinstance(terminal.pattern, PatternRE):
+            continue
+        pattern = re.compile(terminal.pattern.to_regexp())
+        words = [k.text for k in keywords if pattern.fullmatch(k.text)]
+        if words:
+            reserved[terminal.name] = words
+    return reserved
+
+
+def terminal_priorities(
+    rules: RuleTable, definitions: dict[str, str], keywords: Iterable[str]
+) -> dict[str, int]:
+    """
+    Lark priorities of the terminal rules, by their emitted definitions.
+
+    The XText lexer tries terminals in definition order, Lark in priority
+    order, so earlier terminals get higher priorities, ML_NOTE before
+    SL_NOTE. A terminal that calls another one, EXP_VALUE calling
+    DECIMAL_VALUE, is tried before it as it matches longer tokens.
+    Terminals that match a keyword, like ID, keep the default priority of
+    the keywords, or Lark's lexers couldn't retype them to the keyword.
+    """
+    terminals = [rule for rule in rules if rule.is_terminal]
+    names = {rule.name: rule.name.upper() for rule in terminals}
+    grammar = "".join(
+        f"{names[rule.name]}: {definitions[rule.name]}\n" for rule in terminals
+    )
+    # unused terminals aren't compiled
+    start = " | ".join(names.values())
+    lark_grammar, _ = load_grammar(
+        f"start: {start}\n{grammar}", "<terminals>", [], False
+    )
+    patterns = {
+        terminal.name: re.compile(terminal.pattern.to_regexp())
+        for terminal in lark_grammar.compile(["start"], set())[0]
+    }
+
+    # callers first, otherwise in definition order
+    order: list[str] = []
+    visiting: set[str] = set()
+
+    def visit(rule):
+        if rule.name in visiting or rule.name in order:
+            return
+        visiting.add(rule.name)
+        for caller in terminals:
+            if rule.name in caller.called_rules:
+                visit(caller)
+        order.append(rule.name)
+
+    for rule in terminals:
+        visit(rule)
+
+    texts = list(keywords)
+    priorities = {}
+    for idx, name in enumerate(order):
+        pattern = patterns.get(names[name])
+        if pattern is None or any(pattern.fullmatch(text) for text in texts):
+            continue
+        priorities[name] = len(order) - idx
+    return priorities
+
+
+def write_keyword_table(
+    output: Path, keywords: KeywordTable, reserved: dict[str, list[str]]
+):
+    """Write the keyword terminals and the reserved words as JSON."""
+    table = {
+        "keywords": {k.text: k.terminal for k in keywords if k.is_word},
+        "operators": {k.text: k.terminal for k in keywords if not k.is_word},
+        "reserved": reserved,
+    }
+    with open(output, "w") as f:
+        json.dump(table, f, indent=2)
+        f.write("\n")
@@ -0,0 +1,118 @@
+import re
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Optional
+from lark.common import ParserConf
+from lark.load_grammar import load_grammar
+from lark.parsers.lalr_analysis import LALR_Analyzer
+from .passes import EliminateEmptyPass, LeftFactorPass
+from .table import RuleTable
+from .tracing import stage
+
+# Helper rules Lark generates for EBNF operators, e.g. __body_star_3 or
+# __body_repeat_a1_b2_opt_0, named after the rule they were expanded in,
+# and the rules of predicated elements, e.g. _body_predicate_1.
+_HELPER_RULE = re.compile(
+    r"^_*(?P<rule>.+?)_(?:star|plus|repeat_\w+?|opt|predicate)_\d+$"
+)
+
+# Passes that are only run when converting for the LALR parser.
+LALR_PASSES = {EliminateEmptyPass.name, LeftFactorPass.name}
+
+SHIFT_REDUCE = "shift/reduce"
+REDUCE_REDUCE = "reduce/reduce"
+
+
+@dataclass
+class Conflict:
+    """A LALR(1) conflict of the generated grammar."""
+
+    kind: str
+    # rules of the generated grammar that can be reduced
+    rules: list[str]
+    # the XText rules they were converted from
+    xtext_rules: list[str]
+    # lookahead terminals the conflict occurs on
+    terminals: list[str] = field(default_factory=list)
+
+    def __str__(self):
+        return (
+            f"{self.kind} conflict in {', '.join(self.xtext_rules)}"
+            f" on {', '.join(self.terminals)}"
+        )
+
+
+class _ConflictCollector(LALR_Analyzer):
+    """Builds the LALR(1) states, collecting conflicts instead of raising."""
+
+    def compute_lalr1_states(self):
+        self.conflicts: list[tuple[str, str, list[str]]] = []
+        for itemset in self.lr0_itemsets:
+            for la, rules in itemset.lookaheads.items():
+                if len(rules) > 1:
+                    # resolved by priority the same way Lark does
+                    priorities = sorted(
+                        (r.options.priority or 0 for r in rules), reverse=True
+                    )
+                    if priorities[0] == priorities[1]:
+                        names = sorted({str(r.origin.name) for r in rules})
+                        self.conflicts.append((REDUCE_REDUCE, la.name, names))
+                    continue
+                if la in itemset.transitions:
+                    (rule,) = rules
+                    name = str(rule.origin.name)
+                    self.conflicts.append((SHIFT_REDUCE, la.name, [name]))
+
+
+def generated_rule(name: str) -> str:
+    """Name of the emitted rule a rule of the compiled Lark grammar belongs to."""
+    # EBNF operators of a predicate rule have helpers of their own
+    match = _HELPER_RULE.match(name)
+    while match:
+        name = match.group("rule")
+        match = _HELPER_RULE.match(name)
+    return name
+
+
+def find_conflicts(
+    grammar: str, rules: Optional[RuleTable] = None, start: str = "start"
+) -> list[Conflict]:
+    """
+    List the LALR(1) conflicts of a Lark grammar.
+
+    Lark itself stops at the first reduce/reduce conflict and silently resolves
+    shift/reduce conflicts as shifts, this reports all of them. With the rule
+    table the grammar was emitted from, conflicts are mapped to XText rule names.
+    """
+    with stage("lalr-analysis"):
+        lark_grammar, _ = load_grammar(grammar, "<converted>", [], False)
+        terminals, compiled_rules, _ = lark_grammar.compile([start], set())
+        analyzer = _ConflictCollector(ParserConf(compiled_rules, None, [start]))
+        analyzer.compute_lalr()
+
+    # one conflict per set of rules, with every terminal it occurs on
+    conflicts: dict[tuple, Conflict] = {}
+    for kind, terminal, names in analyzer.conflicts:
+        generated = sorted({generated_rule(name) for name in names})
+        key = (kind, tuple(generated))
+        conflict = conflicts.get(key)
+        if conflict is None:
+            xtext_rules = []
+            for name in generated:
+                rule = rules.get(name) if rules is not None else None
+                xtext_rules.append(
+                    rule.xtext_name if rule and rule.xtext_name else name
+                )
+            conflict = conflicts[key] = Conflict(kind, generated, xtext_rules)
+        if terminal not in conflict.terminals:
+            conflict.terminals.append(terminal)
+    return list(conflicts.values())
+
+
+def conflicts_by_rule(conflicts: list[Conflict]) -> dict[str, list[Conflict]]:
+    """Group conflicts by XText rule, rules with the most conflicts first."""
+    grouped: dict[str, list[Conflict]] = defaultdict(list)
+    for conflict in conflicts:
+        for name in dict.fromkeys(conflict.xtext_rules):
+            grouped[name].append(conflict)
+    return dict(sorted(grouped.items(), key=lambda item: (-len(item[1]), item[0])))
@@ -0,0 +1,179 @@
+import hashlib
+import importlib
+import inspect
+import io
+import os
+import pickle
+import sys
+import types
+from pathlib import Path
+from typing import Optional
+import lark
+from lark import Lark
+from .cache import DEFAULT_CACHE_DIRECTORY
+from .tracing import stage
+
+# Default bound of the bytes of all cached parsers.
+DEFAULT_MAX_SIZE = 64 << 20
+
+_SUFFIX = ".parser.pickle"
+
+
+class _ParserPickler(pickle.Pickler):
+    """Pickles Lark parsers, which refer to modules like re, by module name."""
+
+    def reducer_override(self, obj):
+        if isinstance(obj, types.ModuleType):
+            return importlib.import_module, (obj.__name__,)
+        return NotImplemented
+
+
+def serialize_parser(parser: Lark) -> bytes:
+    """Pickle a constructed parser, pickle.loads restores it."""
+    out = io.BytesIO()
+    _ParserPickler(out, protocol=pickle.HIGHEST_PROTOCOL).dump(parser)
+    return out.getvalue()
+
+
+def _option_key(value) -> str:
+    if value is None or isinstance(value, (str, int, float, bool, list, tuple)):
+        return repr(value)
+    # a transformer is keyed by its class and the source defining it, the
+    # callbacks of the parser are looked up by the method names it had
+    cls = type(value)
+    source = inspect.getsourcefile(cls)
+    digest = hashlib.sha256(Path(source).read_bytes()).hexdigest() if source else ""
+    return f"{cls.__module__}.{cls.__qualname__}:{digest}"
+
+
+class ParserCache:
+    """
+    Persistent cache of constructed Lark parsers.
+
+    Earley parsers are pickled with their grammar analysis, LALR parsers
+    are saved with their parse tables by Lark's own cache. Both are keyed
+    by the hash of the grammar, the Lark and Python versions and the
+    parser options. A warm load skips grammar loading and analysis
+    entirely. Once the cache grows beyond max_size bytes the least
+    recently used parsers are removed.
+    """
+
+    def __init__(
+        self,
+        directory: Path = DEFAULT_CACHE_DIRECTORY / "parsers",
+        max_size: int = DEFAULT_MAX_SIZE,
+    ):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(grammar: str, options: dict) -> str:
+        digest = hashlib.sha256(grammar.encode("utf-8"))
+        digest.update(f"{lark.__version__}:{sys.version_info[:2]}".encode("utf-8"))
+        for name in sorted(options):
+            digest.update(f"\0{name}={_option_key(options[name])}".encode("utf-8"))
+        return digest.hexdigest()
+
+    def path(self, key: str) -> Path:
+        return self.directory / f"{key}{_SUFFIX}"
+
+    def entries(self) -> list[Path]:
+        """Cached parsers, the least recently used first."""
+        if not self.directory.exists():
+            return []
+        entries = []
+        for path in self.directory.glob(f"*{_SUFFIX}"):
+            try:
+                entries.append((path.stat().st_mtime, path))
+            except FileNotFoundError:
+                pass
+        return [path for _, path in sorted(entries)]
+
+    @property
+    def size(self) -> int:
+        return sum(path.stat().st_size for path in self.entries())
+
+    def get(self, key: str) -> Optional[Lark]:
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                parser = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            print(f"Warning: Ignoring unreadable parser cache '{path}'.")
+            path.unlink(missing_ok=True)
+            return None
+        # the modification time orders the entries for eviction
+        os.utime(path)
+        return parser
+
+    def put(self, key: str, parser: Lark):
+        data = serialize_parser(parser)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.path(key)
+        temp_path = path.with_suffix(".tmp")
+        temp_path.write_bytes(data)
+        os.replace(temp_path, path)
+        self.evict(keep=path)
+
+    def evict(self, max_size: Optional[int] = None, keep: Optional[Path] = None):
+        """Remove the least recently used parsers until the cache fits."""
+        max_size = self.max_size if max_size is None else max_size
+        entries = [(path, path.stat().st_size) for path in self.entries()]
+        size = sum(entry_size for _, entry_size in entries)
+        for path, entry_size in entries:
+            if size <= max_size:
+                break
+            if path == keep:
+                continue
+            path.unlink(missing_ok=True)
+            size -= entry_size
+
+    def clear(self) -> int:
+        """Remove every cached parser, returns how many were removed."""
+        entries = self.entries()
+        for path in entries:
+            path.unlink(missing_ok=True)
+        return len(entries)
+
+    def lark(self, grammar: str, **options) -> Lark:
+        """A parser for the grammar, loaded from the cache or constructed."""
+        key = self.key(grammar, options)
+        if options.get("parser") == "lalr":
+            return self._lalr(key, grammar, options)
+        with stage("parser-cache-load"):
+            parser = self.get(key)
+        if parser is not None:
+            self.hits += 1
+            return parser
+        self.misses += 1
+        parser = Lark(grammar, **options)
+        with stage("parser-cache-save"):
+            self.put(key, parser)
+        return parser
+
+    def _lalr(self, key: str, grammar: str, options: dict) -> Lark:
+        # Lark caches LALR parsers itself and builds the callbacks of the
+        # transformer again on load, they can't be pickled
+        path = self.path(key)
+        hit = path.exists()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with stage("parser-cache-load" if hit else "parser-cache-save"):
+            parser = Lark(grammar, cache=str(path), **options)
+        if hit:
+            self.hits += 1
+            os.utime(path)
+        else:
+            self.misses += 1
+            self.evict(keep=path)
+        return parser
+
+
+def build_lark(grammar: str, cache: Optional[ParserCache] = None, **options) -> Lark:
+    """Construct a Lark parser, through the cache if there is one."""
+    if cache is None:
+        return Lark(grammar, **options)
+    return cache.lark(grammar, **options)
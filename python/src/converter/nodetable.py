@@ -0,0 +1,274 @@
+import mmap
+import struct
+import sys
+from array import array
+from bisect import bisect_right
+from pathlib import Path
+from typing import Iterator, Optional, Union
+from lark import Token, Tree
+
+MAGIC = b"SYSMLNT\0"
+VERSION = 1
+
+# Columns of the node table, an int32 array each, -1 where there's nothing.
+# kind and value are string ids, value is the text of a token and -1 for
+# trees, start and end are character offsets into the file of the node.
+COLUMNS = (
+    "kind",
+    "parent",
+    "first_child",
+    "next_sibling",
+    "start",
+    "end",
+    "line",
+    "value",
+)
+
+# magic, version, nodes, files, strings, bytes of the strings, reserved
+_HEADER = struct.Struct("<8sIIIIII")
+
+
+def _span(node: Union[Tree, Token]) -> tuple[int, int, int]:
+    if isinstance(node, Token):
+        start, end, line = node.start_pos, node.end_pos, node.line
+        # tokens of Earley's dynamic lexer have no end
+        if end is None and start is not None:
+            end = start + len(node)
+    else:
+        meta = node.meta
+        if meta.empty:
+            return -1, -1, -1
+        start, end, line = meta.start_pos, meta.end_pos, meta.line
+    return (
+        -1 if start is None else start,
+        -1 if end is None else end,
+        -1 if line is None else line,
+    )
+
+
+class NodeTableWriter:
+    """
+    Flattens parse trees into the columns of a node table.
+
+    The nodes of every tree are numbered in preorder, so the nodes of a
+    file and of every subtree are contiguous. Rule names, token types and
+    texts and file paths are interned into a single string table.
+    """
+
+    def __init__(self):
+        self.columns = {name: array("i") for name in COLUMNS}
+        self.file_paths = array("i")
+        self.roots = array("i")
+        self.strings: dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.columns["kind"])
+
+    def intern(self, text: str) -> int:
+        index = self.strings.get(text)
+        if index is None:
+            index = self.strings[text] = len(self.strings)
+        return index
+
+    def add(self, path: str, tree: Tree) -> int:
+        """Add the tree of a file, returns the index of its root node."""
+        kind, parent_column = self.columns["kind"], self.columns["parent"]
+        first_child = self.columns["first_child"]
+        next_sibling = self.columns["next_sibling"]
+        start_column, end_column = self.columns["start"], self.columns["end"]
+        line_column, value = self.columns["line"], self.columns["value"]
+        intern = self.intern
+
+        root = len(kind)
+        self.file_paths.append(intern(path))
+        self.roots.append(root)
+        # parent index -> index of its last child added so far
+        last_child: dict[int, int] = {}
+        stack: list[tuple[Union[Tree, Token], int]] = [(tree, -1)]
+        while stack:
+            node, parent = stack.pop()
+            index = len(kind)
+            start, end, line = _span(node)
+            if isinstance(node, Token):
+                kind.append(intern(node.type))
+                value.append(intern(str(node)))
+            else:
+                kind.append(intern(str(node.data)))
+                value.append(-1)
+                stack.extend(
+                    (child, index)
+                    for child in reversed(node.children)
+                    if child is not None
+                )
+            parent_column.append(parent)
+            first_child.append(-1)
+            next_sibling.append(-1)
+            start_column.append(start)
+            end_column.append(end)
+            line_column.append(line)
+            if parent >= 0:
+                previous = last_child.get(parent)
+                if previous is None:
+                    first_child[parent] = index
+                else:
+                    next_sibling[previous] = index
+                last_child[parent] = index
+        return root
+
+    def to_bytes(self) -> bytes:
+        encoded = [text.encode("utf-8") for text in self.strings]
+        offsets = array("i", [0])
+        for data in encoded:
+            offsets.append(offsets[-1] + len(data))
+        arrays = [
+            *(self.columns[name] for name in COLUMNS),
+            self.file_paths,
+            self.roots,
+            offsets,
+        ]
+        if sys.byteorder != "little":
+            arrays = [array("i", values) for values in arrays]
+            for values in arrays:
+                values.byteswap()
+        header = _HEADER.pack(
+            MAGIC,
+            VERSION,
+            len(self),
+            len(self.roots),
+            len(self.strings),
+            offsets[-1],
+            0,
+        )
+        return b"".join([header, *(values.tobytes() for values in arrays), *encoded])
+
+    def write(self, output: Path):
+        """Write the table with a single write."""
+        data = self.to_bytes()
+        with open(output, "wb") as f:
+            f.write(data)
+
+
+class NodeTable:
+    """
+    A node table file, memory mapped.
+
+    The columns are int32 views of the mapping, nothing is copied when the
+    table is opened and strings are only decoded when they're looked up.
+    """
+
+    def __init__(self, path: Path):
+        if sys.byteorder != "little":
+            raise ValueError("Node tables can only be mapped on little endian machines")
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, nodes, files, strings, blob_size, _ = _HEADER.unpack_from(
+            self._mmap
+        )
+        if magic != MAGIC or version != VERSION:
+            self._mmap.close()
+            raise ValueError(f"'{path}' isn't a node table of version {VERSION}")
+
+        self._buffer = memoryview(self._mmap)
+        self._views = [self._buffer]
+        offset = _HEADER.size
+
+        def view(count: int) -> memoryview:
+            nonlocal offset
+            values = self._buffer[offset : offset + 4 * count].cast("i")
+            self._views.append(values)
+            offset += 4 * count
+            return values
+
+        for name in COLUMNS:
+            setattr(self, name, view(nodes))
+        self.file_paths = view(files)
+        self.roots = view(files)
+        self._offsets = view(strings + 1)
+        self._blob = self._buffer[offset : offset + blob_size]
+        self._views.append(self._blob)
+        self._strings: dict[int, str] = {}
+        self._ids: Optional[dict[str, int]] = None
+
+    def close(self):
+        for values in reversed(self._views):
+            values.release()
+        self._mmap.close()
+
+    def __enter__(self) -> "NodeTable":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.kind)
+
+    def string(self, index: int) -> str:
+        text = self._strings.get(index)
+        if text is None:
+            data = self._blob[self._offsets[index] : self._offsets[index + 1]]
+            text = self._strings[index] = str(data, "utf-8")
+        return text
+
+    def string_id(self, text: str) -> Optional[int]:
+        """Id of an interned string, None if no node refers to it."""
+        if self._ids is None:
+            self._ids = {self.string(i): i for i in range(len(self._offsets) - 1)}
+        return self._ids.get(text)
+
+    @property
+    def files(self) -> list[str]:
+        return [self.string(index) for index in self.file_paths]
+
+    def file_of(self, node: int) -> str:
+        return self.string(self.file_paths[bisect_right(self.roots, node) - 1])
+
+    def kind_name(self, node: int) -> str:
+        return self.string(self.kind[node])
+
+    def is_token(self, node: int) -> bool:
+        return self.value[node] >= 0
+
+    def text(self, node: int) -> Optional[str]:
+        """Text of a token, None for a tree."""
+        value = self.value[node]
+        return self.string(value) if value >= 0 else None
+
+    def children(self, node: int) -> Iterator[int]:
+        child = self.first_child[node]
+        while child >= 0:
+            yield child
+            child = self.next_sibling[child]
+
+    def find(self, kind: str) -> Iterator[int]:
+        """Nodes of a rule or token type, in file order."""
+        index = self.string_id(kind)
+        if index is None:
+            return
+        for node, node_kind in enumerate(self.kind):
+            if node_kind == index:
+                yield node
+
+    def tree(self, node: int) -> Union[Tree, Token]:
+        """Rebuild the Lark tree of a node, without positions."""
+        if self.is_token(node):
+            return Token(self.kind_name(node), self.text(node))
+        # the subtree is contiguous, built bottom up from its last node
+        built: dict[int, Union[Tree, Token]] = {}
+        for index in range(self.subtree_end(node) - 1, node - 1, -1):
+            if self.is_token(index):
+                built[index] = Token(self.kind_name(index), self.text(index))
+            else:
+                children = [built.pop(child) for child in self.children(index)]
+                built[index] = Tree(self.kind_name(index), children)
+        return built[node]
+
+    def subtree_end(self, node: int) -> int:
+        """Index after the last node of the subtree of a node."""
+        while self.parent[node] >= 0:
+            sibling = self.next_sibling[node]
+            if sibling >= 0:
+                return sibling
+            node = self.parent[node]
+        file = bisect_right(self.roots, node)
+        return self.roots[file] if file < len(self.roots) else len(self)
@@ -1,78 +1,461 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, replace
 from pathlib import Path
-from lark import Lark
+from lark import Lark, Tree
 from rich import print
-from .visitor import XTextVisitor, XTextRuleVisitor
-from .rule import XTextRule
-from typing import Optional
+from .visitor import XTextRuleBuilder
+from .expression import ExpressionFactory
+from .rule import XTextGrammar, XTextRule
+from .cache import ConversionCache, content_hash, fingerprint, split_rule_statements
+from .lark_cache import ParserCache, build_lark
+from .table import RuleTable
+from .utils import pascal_to_snake_case
+from .tracing import stage
+from typing import Optional, Union
 
 
-def parse():
-    this_file = Path(__file__)
-    meta_grammar_file = this_file.parent / "lark" / "meta.lark"
+XTEXT_DIRECTORY = Path(__file__).parent / "xtext"
 
-    parser = None
-    with open(meta_grammar_file, "r") as f:
-        parser = Lark(f)  # lalr parser not working, stick with the slow version
+# Grammar converted unless another one is asked for.
+DEFAULT_GRAMMAR = XTEXT_DIRECTORY / "SysML.xtext"
 
-    kerml_expressions_file = this_file.parent / "xtext" / "KerMLExpressions.xtext"
-    sysml_file = this_file.parent / "xtext" / "SysML.xtext"
 
-    kerml_expressions_content = None
-    with open(kerml_expressions_file, "r") as f:
-        kerml_expressions_content = f.read()
+def build_meta_parser(
+    parser: str = "lalr", inline: bool = True, cache: Optional[ParserCache] = None
+) -> Lark:
+    """
+    Build the Lark parser for the XText meta grammar.
 
-    sysml_content = None
-    with open(sysml_file, "r") as f:
-        sysml_content = f.read()
+    meta.lark is LALR(1) compatible, "earley" is kept as a fallback
+    for debugging grammar changes. Besides a whole file the parser
+    can also parse a single rule statement with start="rule_statement".
+    The LALR parser builds the rules while parsing unless inline is off,
+    then it returns the parse tree like the Earley parser does.
+    With a cache the constructed parser is loaded from disk.
+    """
+    meta_grammar_file = Path(__file__).parent / "lark" / "meta.lark"
+    start = ["start", "rule_statement"]
 
-    kerml_tree = parser.parse(kerml_expressions_content)
-    sysml_tree = parser.parse(sysml_content)
+    with stage("meta-parser", parser=parser):
+        grammar = meta_grammar_file.read_text()
+        if parser == "lalr":
+            transformer = XTextRuleBuilder() if inline else None
+            return build_lark(
+                grammar,
+                cache,
+                parser="lalr",
+                lexer="contextual",
+                start=start,
+                transformer=transformer,
+            )
+        elif parser == "earley":
+            return build_lark(grammar, cache, parser="earley", start=start)
+        else:
+            raise ValueError(f"Unknown parser type: {parser}")
 
-    visitor = XTextVisitor()
-    visitor.visit_topdown(sysml_tree)
-    visitor.visit_topdown(kerml_tree)
 
-    rules: list[XTextRule] = []
-    for idx, rule in enumerate(visitor.rules):
-        rule_visitor = XTextRuleVisitor()
-        rule_visitor.visit_topdown(rule)
-        rules.append(rule_visitor.rule)
+def build_rules(
+    tree: Tree, factory: Optional[ExpressionFactory] = None
+) -> Union[XTextGrammar, XTextRule]:
+    """Build the grammar of a parse tree of a file, or the rule of a rule_statement."""
+    return XTextRuleBuilder(factory).transform(tree)
 
-    return rules
 
+def parse_grammar(
+    parser: Lark,
+    content: str,
+    start: str = "start",
+    factory: Optional[ExpressionFactory] = None,
+) -> XTextGrammar:
+    """
+    Parse XText source into its declaration, imports and rules.
 
-def _remove_overriden_rules(full_ruleset: list[XTextRule], rule: XTextRule):
-    """Remove rules that are overridden by the given rule."""
-    indexes_to_remove = []
-    for idx, existing_rule in enumerate(full_ruleset):
-        if existing_rule.name == rule.name:
-            indexes_to_remove.append(idx)
-    # Remove items in reverse order to avoid index shifting problems
-    for idx in sorted(indexes_to_remove, reverse=True):
-        full_ruleset.pop(idx)
+    A single rule_statement becomes a grammar of just that rule.
+    """
+    factory = factory if factory is not None else ExpressionFactory()
+    builder = parser.options.transformer
+    if isinstance(builder, XTextRuleBuilder):
+        builder.reset(factory)
+        with stage("xtext-parse", start=start, inline=True):
+            result = parser.parse(content, start=start)
+    else:
+        with stage("xtext-parse", start=start):
+            tree = parser.parse(content, start=start)
+        with stage("transform"):
+            result = build_rules(tree, factory)
+    return XTextGrammar(rules=[result]) if start == "rule_statement" else result
+
+
+def parse_content(
+    parser: Lark,
+    content: str,
+    start: str = "start",
+    factory: Optional[ExpressionFactory] = None,
+) -> list[XTextRule]:
+    """Parse XText source and build the rules in order of appearance."""
+    return parse_grammar(parser, content, start, factory).rules
+
+
+# Meta parser of a worker process, built once by _init_worker.
+_worker_parser: Optional[Lark] = None
+
+
+def _init_worker(parser_type: str, parser_cache: Optional[ParserCache]):
+    global _worker_parser
+    _worker_parser = build_meta_parser(parser_type, cache=parser_cache)
+
+
+def _parse_segment_batch(segments: list[tuple[str, str]]) -> list[XTextGrammar]:
+    """Worker task: parse and build the rules for a batch of rule statements."""
+    factory = ExpressionFactory()
+    return [
+        parse_grammar(_worker_parser, text, start, factory) for text, start in segments
+    ]
+
+
+def _batches(items: list, jobs: int) -> list[list]:
+    """Split items into contiguous batches, a few per job to balance the load."""
+    batch_size = max(1, -(-len(items) // (jobs * 4)))
+    return [items[idx : idx + batch_size] for idx in range(0, len(items), batch_size)]
+
+
+@dataclass
+class GrammarModule:
+    """A loaded XText file with the files of the grammars it depends on."""
+
+    path: Path
+    grammar: XTextGrammar
+    content_hash: str
+    # used grammars first, then imported grammars
+    dependencies: list[Path] = field(default_factory=list)
+
+
+class ModuleLoader:
+    """
+    Loads an XText grammar together with every grammar it depends on.
+
+    The grammars named by "grammar A with B" and imports of .xtext files
+    are looked up next to the file that names them, then on the search path.
+    org.omg.B is found as org/omg/B.xtext or as B.xtext. Other imports name
+    metamodels and are only kept on the grammar.
+
+    Every file is parsed once per loader and again only when its content
+    changed, grammars that share a base parse it once. With a cache, files
+    and rule statements unchanged since an earlier run aren't parsed at all.
+    With more than one job the rule statements of the files are parsed
+    concurrently, a grammar with a single file in every level included.
+    Equal subtrees are shared between the rules of all loaded grammars.
+    """
+
+    def __init__(
+        self,
+        search_path: Optional[list[Path]] = None,
+        parser_type: str = "lalr",
+        cache: Optional[ConversionCache] = None,
+        jobs: int = 1,
+        meta_parser: Optional[Lark] = None,
+        parser_cache: Optional[ParserCache] = None,
+    ):
+        self.search_path = [*(search_path or []), XTEXT_DIRECTORY]
+        self.parser_type = parser_type
+        self.cache = cache
+        self.jobs = jobs
+        self.factory = ExpressionFactory()
+        self.modules: dict[Path, GrammarModule] = {}
+        self._parser = meta_parser
+        self.parser_cache = parser_cache
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def __enter__(self) -> "ModuleLoader":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def find(self, name: str, referrer: Optional[Path] = None) -> Path:
+        """The file of a grammar name, an imported .xtext URL or a file path."""
+        if Path(name).is_file():
+            return Path(name).resolve()
+        if name.endswith(".xtext"):
+            # platform:/resource/a/b.xtext, classpath:/a/b.xtext or a/b.xtext
+            relative = name.split(":", 1)[-1].lstrip("/")
+            candidates = [relative, relative.rsplit("/", 1)[-1]]
+        else:
+            candidates = [
+                name.replace(".", "/") + ".xtext",
+                name.split(".")[-1] + ".xtext",
+            ]
+        directories = [referrer.parent] if referrer is not None else []
+        for directory in directories + self.search_path:
+            for candidate in candidates:
+                path = directory / candidate
+                if path.is_file():
+                    return path.resolve()
+        searched = ", ".join(str(directory) for directory in self.search_path)
+        raise FileNotFoundError(
+            f"Grammar '{name}' isn't on the search path: {searched}"
+        )
+
+    def load(self, grammar: Union[str, Path] = DEFAULT_GRAMMAR) -> list[GrammarModule]:
+        """
+        The grammar and every grammar it depends on, in the order rules are
+        collected: the grammar first, then its dependencies depth first.
+        Later grammars can't override rules of earlier ones.
+        """
+        if self.cache is not None:
+            current = fingerprint(self.parser_type)
+            if self.cache.fingerprint != current:
+                with stage("cache-load"):
+                    self.cache.load(current)
+
+        # files are read level by level, so a pool parses a level concurrently
+        root = self.find(str(grammar))
+        loaded: dict[Path, GrammarModule] = {}
+        level = [root]
+        parsed = False
+        while level:
+            modules, level_parsed = self._read(level)
+            parsed = parsed or level_parsed
+            loaded.update((module.path, module) for module in modules)
+            level = list(
+                dict.fromkeys(
+                    path
+                    for module in modules
+                    for path in module.dependencies
+                    if path not in loaded
+                )
+            )
+
+        if self.cache is not None and parsed:
+            with stage("cache-save"):
+                self.cache.save()
+
+        order: list[GrammarModule] = []
+        seen: set[Path] = set()
+        stack = [root]
+        while stack:
+            path = stack.pop()
+            if path in seen:
+                continue
+            seen.add(path)
+            order.append(loaded[path])
+            stack.extend(reversed(loaded[path].dependencies))
+        return order
+
+    def rules(self, grammar: Union[str, Path] = DEFAULT_GRAMMAR) -> list[XTextRule]:
+        """The rules of the grammar and every grammar it depends on."""
+        return [rule for module in self.load(grammar) for rule in module.grammar.rules]
+
+    def hidden(self, grammar: Union[str, Path] = DEFAULT_GRAMMAR) -> list[str]:
+        """
+        Rule names of the terminals the grammar skips between tokens.
+
+        A grammar without a hidden() section inherits the one of the first
+        grammar it uses that has one, as in XText.
+        """
+        modules = {module.path: module for module in self.load(grammar)}
+        path = self.find(str(grammar))
+        seen: set[Path] = set()
+        while path not in seen:
+            seen.add(path)
+            module = modules[path]
+            if module.grammar.hidden is not None:
+                return [pascal_to_snake_case(name) for name in module.grammar.hidden]
+            used = module.dependencies[: len(module.grammar.used_grammars)]
+            if not used:
+                break
+            path = used[0]
+        return []
+
+    def _read(self, paths: list[Path]) -> tuple[list[GrammarModule], bool]:
+        """Load the files, parsing the new and changed ones."""
+        stale = []
+        for path in paths:
+            content = path.read_text()
+            module = self.modules.get(path)
+            if module is None or module.content_hash != content_hash(content):
+                stale.append((path, content))
+        for (path, content), grammar in zip(stale, self._parse_files(stale)):
+            self.modules[path] = GrammarModule(
+                path,
+                grammar,
+                content_hash(content),
+                self._dependencies(path, grammar),
+            )
+        return [self.modules[path] for path in paths], bool(stale)
+
+    def _dependencies(self, path: Path, grammar: XTextGrammar) -> list[Path]:
+        names = grammar.used_grammars + [
+            i.url for i in grammar.imports if i.url.endswith(".xtext")
+        ]
+        return [self.find(name, path) for name in names]
+
+    def _parse_files(self, files: list[tuple[Path, str]]) -> list[XTextGrammar]:
+        if not files:
+            return []
+        if self.cache is not None:
+            grammars = []
+            for path, content in files:
+                with stage("parse-file", file=path.name):
+                    grammars.append(
+                        self.cache.parse_file(str(path), content, self._parse_segments)
+                    )
+        elif self.jobs <= 1:
+            grammars = []
+            for path, content in files:
+                with stage("parse-file", file=path.name):
+                    grammars.append(
+                        parse_grammar(
+                            self._meta_parser(), content, factory=self.factory
+                        )
+                    )
+            return grammars
+        else:
+            # only the time spent waiting on the workers is recorded
+            with stage("xtext-parse", jobs=self.jobs):
+                grammars = self._parse_statements([content for _, content in files])
+
+        # rules built elsewhere only share subtrees within their own batch
+        with stage("intern"):
+            for grammar in grammars:
+                for rule in grammar.rules:
+                    rule.body = self.factory.intern_tree(rule.body)
+        return grammars
+
+    def _parse_statements(self, contents: list[str]) -> list[XTextGrammar]:
+        """
+        Parse files split into rule statements, the statements of all files
+        are spread over the pool together. A file that doesn't split is
+        parsed whole, so the parser reports its error.
+        """
+        splits = [split_rule_statements(content) for content in contents]
+        segments = []
+        for content, split in zip(contents, splits):
+            if split is None:
+                segments.append((content, "start"))
+            else:
+                segments.append((split[0], "start"))
+                segments.extend((segment, "rule_statement") for segment in split[1:])
+        parsed = iter(self._parse_segments(segments))
+        grammars = []
+        for split in splits:
+            grammar = next(parsed)
+            if split is not None:
+                rules = list(grammar.rules)
+                rules.extend(rule for _ in split[1:] for rule in next(parsed).rules)
+                grammar = replace(grammar, rules=rules)
+            grammars.append(grammar)
+        return grammars
+
+    def _parse_segments(self, segments: list[tuple[str, str]]) -> list[XTextGrammar]:
+        if self.jobs <= 1 or len(segments) <= 1:
+            return [
+                parse_grammar(self._meta_parser(), text, start, self.factory)
+                for text, start in segments
+            ]
+        parsed = self._get_pool().map(
+            _parse_segment_batch, _batches(segments, self.jobs)
+        )
+        return [grammar for batch in parsed for grammar in batch]
+
+    def _meta_parser(self) -> Lark:
+        if self._parser is None:
+            self._parser = build_meta_parser(self.parser_type, cache=self.parser_cache)
+        return self._parser
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.jobs,
+                initializer=_init_worker,
+                initargs=(self.parser_type, self.parser_cache),
+            )
+        return self._pool
+
+
+def parse(
+    parser_type: str = "lalr",
+    cache: Optional[ConversionCache] = None,
+    jobs: int = 1,
+    grammar: Union[str, Path] = DEFAULT_GRAMMAR,
+    search_path: Optional[list[Path]] = None,
+    parser_cache: Optional[ParserCache] = None,
+) -> list[XTextRule]:
+    """
+    Parse an XText grammar and the grammars it depends on into rules.
+
+    With a cache only the rule statements that changed since the last
+    run are parsed, the meta parser isn't even built on a full hit.
+    With more than one job the rule statements are parsed concurrently and
+    the rules are built in worker processes, the order of the rules is unchanged.
+    Equal subtrees are shared between all returned rules. With a parser
+    cache the meta parser is loaded from disk instead of constructed.
+    """
+    with ModuleLoader(
+        search_path, parser_type, cache, jobs, parser_cache=parser_cache
+    ) as loader:
+        return loader.rules(grammar)
+
+
+def compare_parsers() -> bool:
+    """
+    Parse the XText files with both the LALR and the Earley meta parser
+    and check that they produce identical rules.
+    """
+    lalr_rules = parse("lalr")
+    earley_rules = parse("earley")
+
+    if len(lalr_rules) != len(earley_rules):
+        print(
+            f"Rule count differs: lalr={len(lalr_rules)} earley={len(earley_rules)}"
+        )
+        return False
+
+    identical = True
+    for lalr_rule, earley_rule in zip(lalr_rules, earley_rules):
+        if lalr_rule != earley_rule:
+            print(f"Rule '{lalr_rule.name}' differs between lalr and earley.")
+            identical = False
+    return identical
 
 
 """
 Need to handle the following cases:
 empty expressions give us rules like this
 empty_feature:
-
-
-hidden section of grammar
 """
 
 
 def process_rules(
     rules: list[XTextRule],
-) -> Optional[list[XTextRule]]:
+    hidden: Optional[list[str]] = None,
+) -> Optional[RuleTable]:
+    """
+    Resolve final and override rules into a table of the rules to emit.
+
+    A final or override rule replaces every earlier definition of its name
+    and later ones are dropped with a warning. Of a name defined twice
+    without either, the first definition is kept with a warning, Lark
+    rejects a grammar that defines a rule twice.
+    """
     if len(rules) == 0:
         print("No rules found.")
         return
 
-    full_ruleset: list[XTextRule] = []
+    with stage("process-rules"):
+        return _build_table(rules, hidden)
+
+
+def _build_table(
+    rules: list[XTextRule], hidden: Optional[list[str]] = None
+) -> Optional[RuleTable]:
+    table = RuleTable()
 
-    defined_rule_names = set()
-    used_rule_names = set()
     overriden_rule_names: set[str] = set()
     finalized_rule_names: set[str] = set()
     for rule in rules:
@@ -90,20 +473,27 @@ def process_rules(
 
         if rule.is_final:
             finalized_rule_names.add(rule.name)
-            _remove_overriden_rules(full_ruleset, rule)
-
         if rule.is_override:
             overriden_rule_names.add(rule.name)
-            _remove_overriden_rules(full_ruleset, rule)
 
-        defined_rule_names.add(rule.name)
-        used_rule_names.update(rule.called_rules)
-        full_ruleset.append(rule)
+        if rule.is_final or rule.is_override:
+            # replaces every earlier definition
+            table.replace(rule)
+        elif rule.name in table:
+            print(f"Warning: Rule '{rule.name}' is defined twice, keeping the first.")
+        else:
+            table.add(rule)
 
-    undefined_rule_names = used_rule_names - defined_rule_names
+    undefined_rule_names = table.undefined_names
     if undefined_rule_names:
         print("Warning: Some rules are used but not defined.")
         print(f"Undefined Rules: {undefined_rule_names}")
         return
 
-    return full_ruleset
+    for name in hidden or []:
+        rule = table.get(name)
+        if rule is None or not rule.is_terminal:
+            print(f"Warning: Hidden '{name}' isn't a terminal rule, it isn't skipped.")
+        else:
+            table.hidden.append(name)
+    return table
@@ -0,0 +1,580 @@
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field, replace
+from typing import ClassVar, Optional
+from .expression import (
+    CardinalityType,
+    Expression,
+    ExpressionFactory,
+    RuleCallExpression,
+    SequenceExpression,
+    OrExpression,
+    GroupExpression,
+    NameResolution,
+)
+from .rule import XTextRule
+from .table import RuleTable
+from .tracing import stage
+from .utils import NonParsing
+
+
+def called_rules(expr) -> set[str]:
+    """Collect the names of all rules called in an expression."""
+    names: set[str] = set()
+    stack = [expr]
+    while stack:
+        expr = stack.pop()
+        if isinstance(expr, RuleCallExpression):
+            names.add(expr.value)
+        elif isinstance(expr, (SequenceExpression, OrExpression)):
+            stack.extend(expr.expressions)
+        elif isinstance(expr, GroupExpression):
+            stack.append(expr.expression)
+        elif isinstance(expr, NameResolution):
+            stack.extend(expr.rule_calls)
+    return names
+
+
+@dataclass
+class PassReport:
+    """What a single pass changed in the rule table."""
+
+    name: str
+    changes: list[str] = field(default_factory=list)
+
+    def __str__(self):
+        return f"{self.name}: {len(self.changes)} changes"
+
+
+class Pass(ABC):
+    """A transformation of the rule table run before emission."""
+
+    name: ClassVar[str]
+    # whether the pass runs unless it's asked for explicitly
+    default: ClassVar[bool] = True
+
+    def __init__(self, factory: ExpressionFactory):
+        self.factory = factory
+
+    @abstractmethod
+    def run(self, table: RuleTable, start: str, report: PassReport):
+        pass
+
+    def rewrite_bodies(self, table: RuleTable, report: PassReport, rewrite):
+        """Replace every rule body that the rewrite function changes."""
+        for rule in list(table):
+            body = rewrite(rule.body)
+            if body is not rule.body:
+                report.changes.append(f"rewrote '{rule.name}'")
+                table.update(replace(rule, body=body, called_rules=called_rules(body)))
+
+
+class FlattenPass(Pass):
+    """
+    Flatten nested sequences and alternatives.
+
+    Sequences inside sequences and alternatives inside alternatives are merged,
+    plain groups and single element sequences are unwrapped and non parsing
+    elements are dropped. Predicated groups are kept.
+    """
+
+    name = "flatten"
+
+    def run(self, table: RuleTable, start: str, report: PassReport):
+        self.rewrite_bodies(table, report, self.flatten)
+
+    def flatten(self, expr):
+        intern = self.factory.intern
+        if isinstance(expr, (SequenceExpression, OrExpression)):
+            kind = type(expr)
+            items = []
+            for item in expr.expressions:
+                item = self.flatten(item)
+                if isinstance(item, kind):
+                    items.extend(item.expressions)
+                elif kind is SequenceExpression and isinstance(item, NonParsing):
+                    continue
+                else:
+                    items.append(item)
+            if len(items) == 1:
+                return items[0]
+            if tuple(items) == expr.expressions:
+                return expr
+            return intern(kind(tuple(items)))
+
+        if isinstance(expr, GroupExpression):
+            inner = self.flatten(expr.expression)
+            plain = not expr.negated and not expr.predicated
+            if plain and expr.cardinality_type is None:
+                return inner
+            if (
+                isinstance(inner, GroupExpression)
+                and not inner.negated
+                and not inner.predicated
+                and inner.cardinality_type is None
+            ):
+                inner = inner.expression
+            if inner is expr.expression:
+                return expr
+            return intern(
+                GroupExpression(
+                    inner, expr.negated, expr.cardinality_type, expr.predicated
+                )
+            )
+
+        return expr
+
+
+class InlineTrivialRulesPass(Pass):
+    """
+    Inline rules whose body is nothing but a call of another rule.
+
+    Hidden terminals are kept, the %ignore of the grammar names them.
+    """
+
+    name = "inline-trivial"
+
+    def run(self, table: RuleTable, start: str, report: PassReport):
+        targets: dict[str, str] = {}
+        for rule in table:
+            if rule.name == start or rule.name in table.hidden:
+                continue
+            target = self._passthrough_target(rule)
+            if target is not None:
+                targets[rule.name] = target
+
+        # follow chains of passthrough rules, leaving cycles alone
+        resolved: dict[str, str] = {}
+        for name in targets:
+            seen = {name}
+            target = targets[name]
+            while target in targets and target not in seen:
+                seen.add(target)
+                target = targets[target]
+            if target not in seen and target in table:
+                resolved[name] = target
+
+        if not resolved:
+            return
+
+        calls = {
+            name: self.factory.intern(RuleCallExpression(target))
+            for name, target in resolved.items()
+        }
+
+        def substitute(expr):
+            if isinstance(expr, RuleCallExpression):
+                return calls.get(expr.value, expr)
+            if isinstance(expr, NameResolution):
+                call = expr.rule_calls[0]
+                return calls.get(call.value, expr)
+            if isinstance(expr, (SequenceExpression, OrExpression)):
+                items = tuple(substitute(e) for e in expr.expressions)
+                if all(a is b for a, b in zip(items, expr.expressions)):
+                    return expr
+                return self.factory.intern(type(expr)(items))
+            if isinstance(expr, GroupExpression):
+                inner = substitute(expr.expression)
+                if inner is expr.expression:
+                    return expr
+                return self.factory.intern(
+                    GroupExpression(
+                        inner, expr.negated, expr.cardinality_type, expr.predicated
+                    )
+                )
+            return expr
+
+        for name in resolved:
+            table.remove(name)
+            report.changes.append(f"inlined '{name}' as '{resolved[name]}'")
+        for rule in list(table):
+            if rule.called_rules & resolved.keys():
+                body = substitute(rule.body)
+                table.update(replace(rule, body=body, called_rules=called_rules(body)))
+
+    @staticmethod
+    def _passthrough_target(rule: XTextRule) -> Optional[str]:
+        body = rule.body
+        if isinstance(body, NameResolution):
+            body = body.rule_calls[0]
+        if isinstance(body, RuleCallExpression) and body.value != rule.name:
+            return body.value
+        return None
+
+
+class DuplicateAlternativesPass(Pass):
+    """Remove alternatives that repeat an earlier alternative."""
+
+    name = "dedupe-alternatives"
+
+    def run(self, table: RuleTable, start: str, report: PassReport):
+        self.rewrite_bodies(table, report, self.dedupe)
+
+    def dedupe(self, expr):
+        intern = self.factory.intern
+        if isinstance(expr, (SequenceExpression, OrExpression)):
+            items = [self.dedupe(e) for e in expr.expressions]
+            if isinstance(expr, OrExpression):
+                # interned alternatives make this a cheap identity check
+                items = list(dict.fromkeys(items))
+                if len(items) == 1:
+                    return items[0]
+            if tuple(items) == expr.expressions:
+                return expr
+            return intern(type(expr)(tuple(items)))
+        if isinstance(expr, GroupExpression):
+            inner = self.dedupe(expr.expression)
+            if inner is expr.expression:
+                return expr
+            return intern(
+                GroupExpression(
+                    inner, expr.negated, expr.cardinality_type, expr.predicated
+                )
+            )
+        return expr
+
+
+class EliminateEmptyPass(Pass):
+    """
+    Make rules that can match nothing match only non-empty input.
+
+    Two rules that both match nothing at the same position are a reduce/reduce
+    conflict for a LALR parser, XText's backtracking hides those. A nullable
+    rule r is rewritten to the non-empty part of its language and every call
+    becomes r?, so the parser never has to reduce an empty rule.
+    The start rule and terminals are left alone.
+    """
+
+    name = "eliminate-empty"
+    default = False
+
+    def run(self, table: RuleTable, start: str, report: PassReport):
+        self.nullable = self._nullable_rules(table)
+        self.rewritten = {
+            rule.name
+            for rule in table
+            if rule.name in self.nullable and rule.name != start
+        }
+        # rules like EmptyUsage that match nothing at all
+        self.empty = self.rewritten - self._matching_rules(table)
+
+        for rule in list(table):
+            if rule.is_terminal:
+                continue
+            if rule.name in self.rewritten:
+                body = self.non_empty(rule.body)
+                report.changes.append(f"made '{rule.name}' non-empty")
+            else:
+                body = self.rewrite(rule.body)
+            if body is None:
+                # only matches nothing, every call of it is dropped
+                body = self.factory.intern(SequenceExpression(()))
+            if body is not rule.body:
+                table.update(replace(rule, body=body, called_rules=called_rules(body)))
+
+    def _nullable_rules(self, table: RuleTable) -> set[str]:
+        nullable: set[str] = set()
+        changed = True
+        while changed:
+            changed = False
+            for rule in table:
+                if rule.is_terminal or rule.name in nullable:
+                    continue
+                if self._is_nullable(rule.body, nullable):
+                    nullable.add(rule.name)
+                    changed = True
+        return nullable
+
+    def _matching_rules(self, table: RuleTable) -> set[str]:
+        """Rules that can match some non-empty input."""
+        matching = {rule.name for rule in table if rule.is_terminal}
+        changed = True
+        while changed:
+            changed = False
+            for rule in table:
+                if rule.name not in matching and self._can_match(rule.body, matching):
+                    matching.add(rule.name)
+                    changed = True
+        return matching
+
+    def _can_match(self, expr, matching: set[str]) -> bool:
+        if isinstance(expr, NameResolution):
+            expr = expr.rule_calls[0]
+        if isinstance(expr, RuleCallExpression):
+            return expr.value in matching
+        if isinstance(expr, (SequenceExpression, OrExpression)):
+            return any(self._can_match(e, matching) for e in expr.expressions)
+        if isinstance(expr, GroupExpression):
+            return expr.negated or self._can_match(expr.expression, matching)
+        return isinstance(expr, Expression)
+
+    def _is_nullable(self, expr, nullable: set[str]) -> bool:
+        if isinstance(expr, NameResolution):
+            expr = expr.rule_calls[0]
+        if isinstance(expr, RuleCallExpression):
+            return expr.value in nullable
+        if isinstance(expr, SequenceExpression):
+            return all(self._is_nullable(e, nullable) for e in expr.expressions)
+        if isinstance(expr, OrExpression):
+            return any(self._is_nullable(e, nullable) for e in expr.expressions)
+        if isinstance(expr, GroupExpression):
+            if expr.cardinality_type in (
+                CardinalityType.OPTIONAL,
+                CardinalityType.ZERO_OR_MORE,
+            ):
+                return True
+            return not expr.negated and self._is_nullable(expr.expression, nullable)
+        return isinstance(expr, NonParsing)
+
+    def _sequence(self, items: list):
+        items = [item for item in items if item is not None]
+        if len(items) == 1:
+            return items[0]
+        return self.factory.intern(SequenceExpression(tuple(items)))
+
+    def _alternatives(self, alternatives: list):
+        alternatives = list(dict.fromkeys(a for a in alternatives if a is not None))
+        if not alternatives:
+            return None
+        if len(alternatives) == 1:
+            return alternatives[0]
+        return self.factory.intern(OrExpression(tuple(alternatives)))
+
+    def _group(self, expr, cardinality: Optional[CardinalityType]):
+        return self.factory.intern(GroupExpression(expr, False, cardinality))
+
+    def _predicated(self, group: GroupExpression, inner):
+        """Keep the predicate of a group whose contents were rewritten."""
+        if inner is None or not group.predicated:
+            return inner
+        return self.factory.intern(GroupExpression(inner, predicated=True))
+
+    def rewrite(self, expr):
+        """
+        The same language as expr with calls of rewritten rules made optional.
+
+        None stands for an expression that only matches nothing.
+        """
+        if isinstance(expr, (NameResolution, RuleCallExpression)):
+            call = expr.rule_calls[0] if isinstance(expr, NameResolution) else expr
+            if call.value in self.empty:
+                return None
+            if call.value in self.rewritten:
+                return self._group(call, CardinalityType.OPTIONAL)
+            return expr
+        if isinstance(expr, SequenceExpression):
+            items = [self.rewrite(e) for e in expr.expressions]
+            if all(a is b for a, b in zip(items, expr.expressions)):
+                return expr
+            return self._sequence(items) if any(items) else None
+        if isinstance(expr, OrExpression):
+            if not self._is_nullable(expr, self.nullable):
+                return self._alternatives([self.rewrite(e) for e in expr.expressions])
+            # one optional group instead of an alternative matching nothing
+            inner = self.non_empty(expr)
+            return (
+                None if inner is None else self._group(inner, CardinalityType.OPTIONAL)
+            )
+        if isinstance(expr, GroupExpression):
+            if expr.negated:
+                return expr
+            if expr.cardinality_type is None:
+                inner = self.rewrite(expr.expression)
+                if expr.predicated and inner is expr.expression:
+                    return expr
+                return self._predicated(expr, inner)
+            # x?, x* and x+ only need the non-empty matches of x
+            inner = self.non_empty(expr.expression)
+            if inner is None:
+                return None
+            cardinality = expr.cardinality_type
+            if cardinality is CardinalityType.AT_LEAST_ONE and self._is_nullable(
+                expr.expression, self.nullable
+            ):
+                # x+ with a nullable x also matches nothing
+                cardinality = CardinalityType.ZERO_OR_MORE
+            if inner is expr.expression and cardinality is expr.cardinality_type:
+                return expr
+            return self._group(inner, cardinality)
+        if isinstance(expr, NonParsing):
+            return None
+        return expr
+
+    def non_empty(self, expr):
+        """The non-empty matches of expr, None if it only matches nothing."""
+        if not self._is_nullable(expr, self.nullable):
+            return self.rewrite(expr)
+        if isinstance(expr, NameResolution):
+            expr = expr.rule_calls[0]
+        if isinstance(expr, RuleCallExpression):
+            # rewritten rules only match non-empty input now
+            if expr.value in self.rewritten and expr.value not in self.empty:
+                return expr
+            return None
+        if isinstance(expr, SequenceExpression):
+            # the first non-empty element decides, everything before it is empty
+            alternatives = []
+            items = expr.expressions
+            for idx, item in enumerate(items):
+                head = self.non_empty(item)
+                if head is not None:
+                    rest = [self.rewrite(e) for e in items[idx + 1 :]]
+                    alternatives.append(self._sequence([head] + rest))
+            return self._alternatives(alternatives)
+        if isinstance(expr, OrExpression):
+            return self._alternatives([self.non_empty(e) for e in expr.expressions])
+        if isinstance(expr, GroupExpression):
+            inner = self.non_empty(expr.expression)
+            if inner is None or expr.cardinality_type in (
+                None,
+                CardinalityType.OPTIONAL,
+            ):
+                return self._predicated(expr, inner)
+            # x* and x+ without the empty match are one or more non-empty x
+            return self._group(inner, CardinalityType.AT_LEAST_ONE)
+        return None
+
+
+class LeftFactorPass(Pass):
+    """
+    Factor common leading elements out of alternatives.
+
+    a b | a c becomes a (b | c) and a | a b becomes a (b)?, so a LALR parser
+    doesn't have to pick an alternative before their prefixes diverge.
+    """
+
+    name = "left-factor"
+    default = False
+
+    def run(self, table: RuleTable, start: str, report: PassReport):
+        self.rewrite_bodies(table, report, self.factor)
+
+    @staticmethod
+    def _split(expr) -> tuple:
+        """Split an alternative into its first element and the rest."""
+        if isinstance(expr, SequenceExpression) and expr.expressions:
+            return expr.expressions[0], expr.expressions[1:]
+        return expr, ()
+
+    def _join(self, items: tuple):
+        if len(items) == 1:
+            return items[0]
+        return self.factory.intern(SequenceExpression(items))
+
+    def factor(self, expr):
+        intern = self.factory.intern
+        if isinstance(expr, SequenceExpression):
+            items = tuple(self.factor(e) for e in expr.expressions)
+            if items == expr.expressions:
+                return expr
+            return intern(SequenceExpression(items))
+        if isinstance(expr, GroupExpression):
+            inner = self.factor(expr.expression)
+            if inner is expr.expression:
+                return expr
+            return intern(
+                GroupExpression(
+                    inner, expr.negated, expr.cardinality_type, expr.predicated
+                )
+            )
+        if not isinstance(expr, OrExpression):
+            return expr
+
+        # alternatives by their first element, in order of first appearance
+        by_head: dict = {}
+        for alternative in expr.expressions:
+            head, rest = self._split(self.factor(alternative))
+            by_head.setdefault(head, []).append(rest)
+
+        alternatives = []
+        for head, rests in by_head.items():
+            if len(rests) == 1:
+                alternatives.append(self._join((head,) + rests[0]))
+                continue
+            tails = [self._join(rest) for rest in rests if rest]
+            tails = list(dict.fromkeys(tails))
+            if not tails:
+                alternatives.append(head)
+                continue
+            tail = tails[0] if len(tails) == 1 else intern(OrExpression(tuple(tails)))
+            tail = self.factor(tail)
+            optional = any(not rest for rest in rests)
+            cardinality = CardinalityType.OPTIONAL if optional else None
+            alternatives.append(
+                self._join((head, intern(GroupExpression(tail, False, cardinality))))
+            )
+
+        if len(alternatives) == 1:
+            return alternatives[0]
+        if tuple(alternatives) == expr.expressions:
+            return expr
+        return intern(OrExpression(tuple(alternatives)))
+
+
+class UnreachableRulesPass(Pass):
+    """
+    Remove rules that can't be reached from the start rule.
+
+    Terminals are kept, hidden terminals like WS are only referenced
+    from the hidden() section of the grammar.
+    """
+
+    name = "unreachable"
+
+    def run(self, table: RuleTable, start: str, report: PassReport):
+        reachable = {start}
+        stack = [start]
+        while stack:
+            rule = table.get(stack.pop())
+            if rule is None:
+                continue
+            for name in rule.called_rules:
+                if name not in reachable:
+                    reachable.add(name)
+                    stack.append(name)
+
+        for rule in list(table):
+            if rule.name not in reachable and not rule.is_terminal:
+                table.remove(rule.name)
+                report.changes.append(f"removed '{rule.name}'")
+
+
+PASSES: dict[str, type[Pass]] = {
+    FlattenPass.name: FlattenPass,
+    InlineTrivialRulesPass.name: InlineTrivialRulesPass,
+    EliminateEmptyPass.name: EliminateEmptyPass,
+    LeftFactorPass.name: LeftFactorPass,
+    DuplicateAlternativesPass.name: DuplicateAlternativesPass,
+    UnreachableRulesPass.name: UnreachableRulesPass,
+}
+
+
+class PassManager:
+    """Runs the enabled passes over a rule table in pipeline order."""
+
+    def __init__(
+        self,
+        disabled: Optional[set[str]] = None,
+        enabled: Optional[set[str]] = None,
+        factory: Optional[ExpressionFactory] = None,
+    ):
+        disabled = disabled or set()
+        enabled = enabled or set()
+        unknown = (disabled | enabled) - PASSES.keys()
+        if unknown:
+            raise ValueError(f"Unknown passes: {', '.join(sorted(unknown))}")
+        self.factory = factory if factory is not None else ExpressionFactory()
+        self.passes = [
+            pass_type(self.factory)
+            for name, pass_type in PASSES.items()
+            if (pass_type.default or name in enabled) and name not in disabled
+        ]
+
+    def run(self, table: RuleTable) -> list[PassReport]:
+        start = table.first().name
+        reports = []
+        for optimization in self.passes:
+            report = PassReport(optimization.name)
+            with stage(optimization.name):
+                optimization.run(table, start, report)
+            reports.append(report)
+        return reports
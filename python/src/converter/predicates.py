@@ -0,0 +1,90 @@
+from dataclasses import dataclass
+from typing import Optional
+from .expression import GroupExpression, OrExpression, SequenceExpression
+from .table import RuleTable
+from .utils import NonParsing
+
+# Priority of the rules predicated elements are emitted as, Earley prefers
+# the derivations using the most of them and LALR reduces them first.
+PREDICATE_PRIORITY = 1
+
+# Predicates are honored unless there is one of these reasons.
+IN_TERMINAL = "terminal rules have no rule priorities"
+NOTHING_TO_MATCH = "the predicated element matches nothing"
+
+
+@dataclass(frozen=True)
+class Predicate:
+    """A syntactic predicate of a rule and the rule it's emitted as."""
+
+    rule: str
+    xtext_rule: str
+    group: GroupExpression
+    # inlined rule with a priority matching the predicated element
+    helper: Optional[str] = None
+    # why the predicate isn't honored, None if it is
+    reason: Optional[str] = None
+
+    @property
+    def honored(self) -> bool:
+        return self.reason is None
+
+    def __str__(self):
+        text = f"{self.xtext_rule}: => {self.group}"
+        if self.reason is not None:
+            return f"{text} ({self.reason})"
+        return f"{text} as {self.helper}"
+
+
+def find_predicates(rules: RuleTable) -> list[Predicate]:
+    """
+    The predicated groups of every rule, in order of appearance.
+
+    XText commits to the element after => or -> when it matches instead of
+    trying the alternatives. Lark can't commit, each predicated element of
+    a rule becomes an inlined rule _<rule>_predicate_<n> with a priority,
+    so of the derivations of an ambiguous text Earley picks the ones taking
+    the predicated elements. A predicated element is one rule, the
+    predicate of a repetition is on each of its elements, so a repetition
+    taking more of them is preferred, like XText's greedy loops. The parse
+    trees are the same as without predicates.
+    """
+    predicates: list[Predicate] = []
+    for rule in rules:
+        xtext_rule = rule.xtext_name or rule.name
+        seen: set[GroupExpression] = set()
+        helpers = 0
+        stack = [rule.body]
+        while stack:
+            expr = stack.pop()
+            if isinstance(expr, (SequenceExpression, OrExpression)):
+                stack.extend(reversed(expr.expressions))
+                continue
+            if not isinstance(expr, GroupExpression):
+                continue
+            stack.append(expr.expression)
+            if not expr.predicated or expr in seen:
+                continue
+            seen.add(expr)
+            if rule.is_terminal:
+                predicates.append(
+                    Predicate(rule.name, xtext_rule, expr, None, IN_TERMINAL)
+                )
+            elif _matches_nothing(expr.expression):
+                predicates.append(
+                    Predicate(rule.name, xtext_rule, expr, None, NOTHING_TO_MATCH)
+                )
+            else:
+                helpers += 1
+                helper = f"_{rule.name}_predicate_{helpers}"
+                predicates.append(Predicate(rule.name, xtext_rule, expr, helper))
+    return predicates
+
+
+def _matches_nothing(expr) -> bool:
+    """Whether an expression only holds non parsing elements."""
+    if isinstance(expr, (SequenceExpression, OrExpression)):
+        return all(_matches_nothing(e) for e in expr.expressions)
+    if isinstance(expr, GroupExpression):
+        return _matches_nothing(expr.expression)
+    return isinstance(expr, NonParsing)
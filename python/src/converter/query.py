@@ -0,0 +1,295 @@
+from dataclasses import dataclass
+from typing import Iterable, Optional, Union
+from lark import Token, Tree
+
+# Rules holding the names an element refers to, by the relation it's in.
+REFERENCE_RULES = {
+    "subclassification_part": "specializes",
+    "owned_feature_typing": "typed_by",
+    "conjugated_qualified_name": "typed_by",
+    "owned_subsetting": "subsets",
+    "owned_reference_subsetting": "references",
+    "owned_redefinition": "redefines",
+    "imported_namespace": "imports",
+    "imported_membership": "imports_member",
+}
+
+# Rules of the packages, the definitions and usages end with these.
+PACKAGE_RULES = ("package", "library_package")
+ELEMENT_SUFFIXES = ("_definition", "_usage")
+
+
+def is_element(rule: str) -> bool:
+    return rule in PACKAGE_RULES or rule.endswith(ELEMENT_SUFFIXES)
+
+
+@dataclass(frozen=True)
+class Symbol:
+    """A named package, definition or usage."""
+
+    qualified_name: str
+    name: str
+    kind: str
+    file: str
+    line: int
+    short_name: Optional[str] = None
+
+    @property
+    def namespace(self) -> str:
+        return self.qualified_name.rpartition("::")[0]
+
+
+@dataclass(frozen=True)
+class Reference:
+    """A name an element refers to, as it's written."""
+
+    owner: str
+    relation: str
+    target: str
+    file: str
+    line: int
+
+    @property
+    def head(self) -> str:
+        """The target, of a feature chain only its first feature."""
+        return self.target.partition(".")[0]
+
+    @property
+    def target_name(self) -> str:
+        """The last name of the head, references are indexed by it."""
+        return self.head.rpartition("::")[2]
+
+
+def _line(node: Union[Tree, Token]) -> int:
+    # without propagated positions trees have no line
+    line = node.line if isinstance(node, Token) else getattr(node.meta, "line", None)
+    return -1 if line is None else line
+
+
+def _name(node: Tree) -> str:
+    text = str(node.children[0])
+    if len(text) >= 2 and text[0] == text[-1] == "'":
+        return text[1:-1]
+    return text
+
+
+def _names(node: Tree) -> list[str]:
+    """The names of a qualified name, in order."""
+    names = []
+    for child in node.children:
+        if isinstance(child, Tree):
+            if child.data == "name":
+                names.append(_name(child))
+            else:
+                names.extend(_names(child))
+    return names
+
+
+def _reference_targets(node: Tree) -> Iterable[str]:
+    if node.data in ("qualified_name", "conjugated_qualified_name"):
+        yield "::".join(_names(node))
+        return
+    for child in node.children:
+        if not isinstance(child, Tree):
+            continue
+        if child.data == "qualified_name":
+            yield "::".join(_names(child))
+        elif child.data == "feature_chain":
+            yield ".".join(
+                "::".join(_names(part))
+                for part in child.children
+                if isinstance(part, Tree)
+            )
+
+
+def _declared_name(element: Tree) -> tuple[Optional[str], Optional[str]]:
+    """Name and short name of an element, from its own declaration."""
+    queue = list(element.children)
+    while queue:
+        node = queue.pop(0)
+        if not isinstance(node, Tree):
+            continue
+        if node.data == "identification":
+            names = [_name(child) for child in node.children if isinstance(child, Tree)]
+            # <short name> name, a single name is the name
+            if len(names) == 2:
+                return names[1], names[0]
+            return (names[0], None) if names else (None, None)
+        # names below the body or another element aren't this element's
+        if (
+            is_element(str(node.data))
+            or str(node.data) in REFERENCE_RULES
+            or str(node.data).endswith("body")
+        ):
+            continue
+        queue.extend(node.children)
+    return None, None
+
+
+def extract(file: str, tree: Tree) -> tuple[list[Symbol], list[Reference]]:
+    """The named elements of a parse tree and the names they refer to."""
+    symbols: list[Symbol] = []
+    references: list[Reference] = []
+    stack: list[tuple[Union[Tree, Token], tuple[str, ...]]] = [(tree, ())]
+    while stack:
+        node, scope = stack.pop()
+        if not isinstance(node, Tree) or node.data == "identification":
+            continue
+        rule = str(node.data)
+        relation = REFERENCE_RULES.get(rule)
+        if relation is not None:
+            owner = "::".join(scope)
+            for target in _reference_targets(node):
+                references.append(Reference(owner, relation, target, file, _line(node)))
+            continue
+        if is_element(rule):
+            name, short_name = _declared_name(node)
+            if name is not None:
+                scope = (*scope, name)
+                symbols.append(
+                    Symbol("::".join(scope), name, rule, file, _line(node), short_name)
+                )
+        stack.extend((child, scope) for child in reversed(node.children))
+    return symbols, references
+
+
+def _add(index: dict, key: str, value):
+    index.setdefault(key, set()).add(value)
+
+
+def _remove(index: dict, key: str, value):
+    values = index.get(key)
+    if values is not None:
+        values.discard(value)
+        if not values:
+            del index[key]
+
+
+def _sorted(values: Iterable) -> list:
+    return sorted(values, key=lambda value: (value.file, value.line))
+
+
+class ModelIndex:
+    """
+    Qualified name index of parsed SysML models.
+
+    Symbols are indexed by qualified name, name and kind, references by
+    the element they're in and by the last name of their target, so every
+    lookup is a dictionary lookup plus the resolution of its candidates.
+    Names are resolved like SysML does, in the namespace of the referring
+    element and its enclosing namespaces and through their imports.
+    Every file is indexed on its own: updating a file only removes and
+    adds its own entries.
+    """
+
+    def __init__(self):
+        self.files: dict[str, tuple[list[Symbol], list[Reference]]] = {}
+        self.by_qualified_name: dict[str, set[Symbol]] = {}
+        self.by_name: dict[str, set[Symbol]] = {}
+        self.by_kind: dict[str, set[Symbol]] = {}
+        self.by_owner: dict[str, set[Reference]] = {}
+        self.by_target_name: dict[str, set[Reference]] = {}
+
+    def __len__(self) -> int:
+        return sum(len(symbols) for symbols, _ in self.files.values())
+
+    def update(self, file: str, tree: Tree):
+        """Index the tree of a file, replacing what was indexed for it."""
+        self.remove(file)
+        symbols, references = extract(file, tree)
+        self.files[file] = (symbols, references)
+        for symbol in symbols:
+            _add(self.by_qualified_name, symbol.qualified_name, symbol)
+            _add(self.by_name, symbol.name, symbol)
+            if symbol.short_name is not None:
+                _add(self.by_name, symbol.short_name, symbol)
+            _add(self.by_kind, symbol.kind, symbol)
+        for reference in references:
+            _add(self.by_owner, reference.owner, reference)
+            _add(self.by_target_name, reference.target_name, reference)
+
+    def remove(self, file: str):
+        symbols, references = self.files.pop(file, ([], []))
+        for symbol in symbols:
+            _remove(self.by_qualified_name, symbol.qualified_name, symbol)
+            _remove(self.by_name, symbol.name, symbol)
+            if symbol.short_name is not None:
+                _remove(self.by_name, symbol.short_name, symbol)
+            _remove(self.by_kind, symbol.kind, symbol)
+        for reference in references:
+            _remove(self.by_owner, reference.owner, reference)
+            _remove(self.by_target_name, reference.target_name, reference)
+
+    def lookup(self, qualified_name: str) -> list[Symbol]:
+        return _sorted(self.by_qualified_name.get(qualified_name, ()))
+
+    def find(self, name: str) -> list[Symbol]:
+        """Symbols with the name or short name."""
+        return _sorted(self.by_name.get(name, ()))
+
+    def of_kind(self, kind: str) -> list[Symbol]:
+        return _sorted(self.by_kind.get(kind, ()))
+
+    def references_from(
+        self, qualified_name: str, relation: Optional[str] = None
+    ) -> list[Reference]:
+        return _sorted(
+            reference
+            for reference in self.by_owner.get(qualified_name, ())
+            if relation is None or reference.relation == relation
+        )
+
+    def references_to(
+        self, qualified_name: str, relation: Optional[str] = None
+    ) -> list[Reference]:
+        """References resolving to the qualified name, e.g. its specializations."""
+        name = qualified_name.rpartition("::")[2]
+        return _sorted(
+            reference
+            for reference in self.by_target_name.get(name, ())
+            if (relation is None or reference.relation == relation)
+            and self.resolve(reference) == qualified_name
+        )
+
+    def resolve(self, reference: Reference) -> Optional[str]:
+        """
+        Qualified name of the target of a reference, if it's indexed.
+
+        Of a feature chain only the first feature is resolved, the others
+        are features of its type.
+        """
+        return self.resolve_name(reference.head, reference.owner)
+
+    def resolve_name(
+        self, name: str, scope: str, seen: Optional[set] = None
+    ) -> Optional[str]:
+        """Resolve a name seen in a namespace, outwards to the root."""
+        # every import is followed once, imports can refer to each other
+        seen = set() if seen is None else seen
+        first, _, rest = name.partition("::")
+        while True:
+            candidate = f"{scope}::{name}" if scope else name
+            if candidate in self.by_qualified_name:
+                return candidate
+            for imported in self.by_owner.get(scope, ()):
+                if not imported.relation.startswith("imports") or imported in seen:
+                    continue
+                if imported.relation == "imports_member":
+                    if imported.target_name != first:
+                        continue
+                    seen.add(imported)
+                    member = self.resolve_name(imported.target, scope, seen)
+                    if member is None:
+                        continue
+                    candidate = f"{member}::{rest}" if rest else member
+                else:
+                    seen.add(imported)
+                    namespace = self.resolve_name(imported.target, scope, seen)
+                    if namespace is None:
+                        continue
+                    candidate = f"{namespace}::{name}"
+                if candidate in self.by_qualified_name:
+                    return candidate
+            if not scope:
+                return None
+            scope = scope.rpartition("::")[0]
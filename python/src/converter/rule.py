@@ -1,5 +1,5 @@
-from dataclasses import dataclass, field
-from typing import ClassVar
+from dataclasses import dataclass, field, replace
+from typing import ClassVar, Optional
 from .utils import REQUIRED, DEFAULT_RETURN_TYPE, DefaultReturnType
 from .expression import Expression
 
@@ -19,6 +19,8 @@ class XTextRule:
     is_fragment: bool = False
 
     name: str = field(default=REQUIRED)
+    # name in the XText source, before it's converted to snake case
+    xtext_name: Optional[str] = None
     called_rules: set[str] = field(default_factory=set)
 
     body: Expression = field(default=REQUIRED)
@@ -54,3 +56,29 @@ class XTextRule:
             getattr(self, field_name) is not None
             for field_name in self._required_fields
         )
+
+
+@dataclass(frozen=True)
+class GrammarImport:
+    """An import of an XText grammar, usually of a metamodel by its URI."""
+
+    url: str
+    alias: Optional[str] = None
+
+
+@dataclass
+class XTextGrammar:
+    """An XText file, the declaration and imports in front of its rules."""
+
+    # qualified name, e.g. org.omg.sysml.xtext.SysML
+    name: Optional[str] = None
+    # grammars named by "with", their rules are inherited
+    used_grammars: list[str] = field(default_factory=list)
+    # terminals skipped between tokens, None inherits them from the used grammar
+    hidden: Optional[list[str]] = None
+    imports: list[GrammarImport] = field(default_factory=list)
+    rules: list[XTextRule] = field(default_factory=list)
+
+    def header(self) -> "XTextGrammar":
+        """The grammar without its rules."""
+        return replace(self, rules=[])
@@ -0,0 +1,99 @@
+from collections import Counter
+from typing import Iterator, Optional
+from .rule import XTextRule
+
+
+class RuleTable:
+    """
+    Ordered, name indexed collection of rules.
+
+    Rules live in slots in definition order, removing a rule only leaves a
+    tombstone behind so lookups, replacements and removals are all O(1).
+    The names used but not defined are kept up to date on every change.
+    hidden names the terminals skipped between tokens, from the hidden()
+    section of the grammar.
+    """
+
+    def __init__(
+        self,
+        rules: Optional[list[XTextRule]] = None,
+        hidden: Optional[list[str]] = None,
+    ):
+        self._slots: list[Optional[XTextRule]] = []
+        self._index: dict[str, int] = {}
+        self._used: Counter[str] = Counter()
+        self._tombstones = 0
+        self.hidden: list[str] = list(hidden or [])
+        for rule in rules or []:
+            self.add(rule)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __iter__(self) -> Iterator[XTextRule]:
+        return (rule for rule in self._slots if rule is not None)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._index
+
+    def __getitem__(self, name: str) -> XTextRule:
+        return self._slots[self._index[name]]
+
+    def get(self, name: str) -> Optional[XTextRule]:
+        idx = self._index.get(name)
+        return None if idx is None else self._slots[idx]
+
+    def first(self) -> Optional[XTextRule]:
+        return next(iter(self), None)
+
+    @property
+    def undefined_names(self) -> set[str]:
+        return {name for name in self._used if name not in self._index}
+
+    def add(self, rule: XTextRule):
+        """Append a rule, its name must not be defined yet."""
+        if rule.name in self._index:
+            raise KeyError(f"Rule '{rule.name}' is already defined")
+        self._index[rule.name] = len(self._slots)
+        self._slots.append(rule)
+        self._used.update(rule.called_rules)
+
+    def replace(self, rule: XTextRule):
+        """Redefine a rule, the new definition moves to the end of the table."""
+        if rule.name in self._index:
+            self.remove(rule.name)
+        self.add(rule)
+
+    def update(self, rule: XTextRule):
+        """Swap the definition of a rule in place, keeping its position."""
+        idx = self._index[rule.name]
+        self._release(self._slots[idx].called_rules)
+        self._used.update(rule.called_rules)
+        self._slots[idx] = rule
+
+    def remove(self, name: str) -> XTextRule:
+        """Remove a rule, leaving a tombstone in its slot."""
+        idx = self._index.pop(name)
+        rule = self._slots[idx]
+        self._slots[idx] = None
+        self._tombstones += 1
+        self._release(rule.called_rules)
+
+        if self._tombstones > len(self._index):
+            self._compact()
+        return rule
+
+    def _release(self, names: set[str]):
+        """Forget one use of each name, dropping names no rule calls anymore."""
+        for name in names:
+            count = self._used[name] - 1
+            if count:
+                self._used[name] = count
+            else:
+                del self._used[name]
+
+    def _compact(self):
+        """Drop the tombstones once they outnumber the rules."""
+        self._slots = [rule for rule in self._slots if rule is not None]
+        self._index = {rule.name: idx for idx, rule in enumerate(self._slots)}
+        self._tombstones = 0
@@ -0,0 +1,183 @@
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterator, Optional
+
+# Profiler the pipeline reports to, stages are free when it's None.
+_active: Optional["Profiler"] = None
+
+
+@dataclass
+class StageRecord:
+    """A finished stage, nested stages are children of the enclosing one."""
+
+    name: str
+    # microseconds since the profiler started
+    start: float
+    duration: float = 0.0
+    # net number of memory blocks allocated by the stage
+    blocks: int = 0
+    # bytes still allocated after the stage and peak bytes traced while it ran
+    memory: int = 0
+    peak: int = 0
+    args: dict = field(default_factory=dict)
+    children: list["StageRecord"] = field(default_factory=list)
+
+
+class Profiler:
+    """
+    Records nested stage timings, allocations and per rule transform cost.
+
+    Stages are opened with the module level stage() by the pipeline itself,
+    they only cost something while a profiler is active. Allocations are
+    only traced with trace_memory, tracemalloc slows down the run it
+    measures several times, so its timings are inflated.
+    """
+
+    def __init__(self, trace_memory: bool = False, cprofile: bool = False):
+        self.trace_memory = trace_memory
+        self.root = StageRecord("total", 0.0)
+        self._stack = [self.root]
+        self._origin = time.perf_counter()
+        self.rule_costs: Counter[str] = Counter()
+        self.cprofile = cProfile.Profile() if cprofile else None
+
+    def _now(self) -> float:
+        return (time.perf_counter() - self._origin) * 1e6
+
+    @contextmanager
+    def stage(self, name: str, **args) -> Iterator[StageRecord]:
+        parent = self._stack[-1]
+        record = StageRecord(name, self._now(), args=args)
+        parent.children.append(record)
+        self._stack.append(record)
+        memory = 0
+        if self.trace_memory:
+            # the peak is reset for the stage, the enclosing stage keeps its own
+            memory, peak = tracemalloc.get_traced_memory()
+            parent.peak = max(parent.peak, peak)
+            tracemalloc.reset_peak()
+        blocks = sys.getallocatedblocks()
+        try:
+            yield record
+        finally:
+            record.duration = self._now() - record.start
+            record.blocks = sys.getallocatedblocks() - blocks
+            if self.trace_memory:
+                current, peak = tracemalloc.get_traced_memory()
+                record.memory = current - memory
+                record.peak = max(record.peak, peak)
+            self._stack.pop()
+
+    def add_rule_cost(self, rule: str, seconds: float):
+        self.rule_costs[rule] += seconds
+
+    def start(self):
+        global _active
+        _active = self
+        if self.trace_memory:
+            tracemalloc.start()
+        if self.cprofile is not None:
+            self.cprofile.enable()
+
+    def stop(self):
+        global _active
+        if self.cprofile is not None:
+            self.cprofile.disable()
+        if self.trace_memory:
+            tracemalloc.stop()
+        self.root.duration = self._now()
+        _active = None
+
+    def __enter__(self) -> "Profiler":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def summary(self, top: int = 10) -> Iterator[str]:
+        """Lines of the stage tree and the most expensive rules."""
+
+        def lines(record: StageRecord, depth: int) -> Iterator[str]:
+            label = "  " * depth + record.name
+            line = f"{label:<40} {record.duration / 1000:10.2f} ms"
+            if record is not self.root:
+                line += f" {record.blocks:+10d} blocks"
+                if self.trace_memory:
+                    line += f" {record.memory / 1024:+10.1f} KiB"
+            yield line
+            # repeated stages, e.g. one per rule, are merged into one line
+            merged: dict[str, StageRecord] = {}
+            for child in record.children:
+                if child.name not in merged:
+                    merged[child.name] = StageRecord(child.name, child.start)
+                total = merged[child.name]
+                total.duration += child.duration
+                total.blocks += child.blocks
+                total.memory += child.memory
+                total.children.extend(child.children)
+            for child in merged.values():
+                yield from lines(child, depth + 1)
+
+        yield from lines(self.root, 0)
+        if self.rule_costs and top:
+            yield "Most expensive rules to build:"
+            for rule, seconds in self.rule_costs.most_common(top):
+                yield f"  {rule:<38} {seconds * 1000:10.3f} ms"
+
+    def write_trace(self, output: Path):
+        """Write the stages in the Chrome trace event format."""
+        pid, tid = os.getpid(), threading.get_ident()
+        events = []
+        stack = list(self.root.children)
+        while stack:
+            record = stack.pop()
+            stack.extend(record.children)
+            args = dict(record.args, blocks=record.blocks)
+            if self.trace_memory:
+                args.update(memory=record.memory, peak=record.peak)
+            events.append(
+                {
+                    "name": record.name,
+                    "ph": "X",
+                    "ts": record.start,
+                    "dur": record.duration,
+                    "pid": pid,
+                    "tid": tid,
+                    "args": args,
+                }
+            )
+        events.sort(key=lambda event: event["ts"])
+        trace = {
+            "traceEvents": events,
+            "ruleCosts": {
+                rule: seconds * 1e6 for rule, seconds in self.rule_costs.most_common()
+            },
+        }
+        with open(output, "w") as f:
+            json.dump(trace, f)
+
+    def write_cprofile(self, output: Path):
+        if self.cprofile is None:
+            raise ValueError("The profiler wasn't started with cprofile=True")
+        self.cprofile.dump_stats(output)
+
+
+def stage(name: str, **args):
+    """Record a stage with the active profiler, a no-op without one."""
+    if _active is None:
+        return nullcontext()
+    return _active.stage(name, **args)
+
+
+def active() -> Optional[Profiler]:
+    return _active
@@ -1,4 +1,9 @@
+import ast
+import itertools
+import os
 import re
+from functools import lru_cache
+from typing import Optional
 from .expression import (
     Expression,
     SequenceExpression,
@@ -11,7 +16,9 @@ from .expression import (
 
 
 class XTextCurrent:
-    pass
+    def __reduce__(self):
+        # unpickle to the module level singleton
+        return "XTEXT_CURRENT"
 
 
 XTEXT_CURRENT = XTextCurrent()
@@ -20,11 +27,13 @@ XTEXT_CURRENT = XTextCurrent()
 class NonParsing:
     """Sentinel class to mark non-parsing elements."""
 
-    pass
-
     def __str__(self):
         return ""
 
+    def __reduce__(self):
+        # unpickle to the module level singleton
+        return "NON_PARSING"
+
 
 NON_PARSING = NonParsing()
 
@@ -41,7 +50,9 @@ REQUIRED = Required()
 class DefaultReturnType:
     """Sentinel class to mark rules that don't have a return type."""
 
-    pass
+    def __reduce__(self):
+        # unpickle to the module level singleton
+        return "DEFAULT_RETURN_TYPE"
 
 
 DEFAULT_RETURN_TYPE = DefaultReturnType()
@@ -200,104 +211,247 @@ def until_regex(start: str, end: str) -> str:
         end: The ending literal
 
     Returns:
-        A string representing a regular expression in Lark
+        A string representing a regular expression in Lark, matching the start,
+        then anything up to the first end
 
     Example:
-        character_range_regex("a", "z") returns "/[a.*z]/"
+        until_regex("/*", "*/") matches "/*", anything and the first "*/"
     """
     start = escape_regex_chars(strip_double_quotes(start))
     end = escape_regex_chars(strip_double_quotes(end))
 
-    # Create the regex pattern
-    return f"[{start}.*{end}]"
+    # [\s\S] also matches line breaks, the lazy repetition stops at the first end
+    return f"{start}[\\s\\S]*?{end}"
 
 
-# Check if the expression is negated and contains only LiteralExpressions or RegularExpressions
-def contains_only_literals(expr: Expression):
-    if isinstance(expr, LiteralExpression) or isinstance(expr, RegularExpression):
-        return True
-    elif isinstance(expr, SequenceExpression) or isinstance(expr, OrExpression):
-        return all(contains_only_literals(e) for e in expr.expressions)
-    elif isinstance(expr, GroupExpression):
-        return contains_only_literals(expr.expression)
-    else:
-        return False
+@lru_cache(maxsize=None)
+def literal_text(literal: str) -> str:
+    """The text a double quoted grammar literal matches."""
+    try:
+        return ast.literal_eval(literal)
+    except (ValueError, SyntaxError):
+        return strip_double_quotes(literal)
 
 
-def expression_to_regex(expr: Expression) -> re.Pattern:
-    """
-    Converts an Expression object to a Python re pattern object.
-    Only works for expressions where all atomic expressions are literals or regular expressions.
+_CONTROL_ESCAPES = {"\n": r"\n", "\r": r"\r", "\t": r"\t", "\f": r"\f", "\v": r"\v"}
 
-    Args:
-        expr: An Expression object to convert
 
-    Returns:
-        A compiled regular expression pattern object
+def _escape_char(char: str) -> str:
+    if char in _CONTROL_ESCAPES:
+        return _CONTROL_ESCAPES[char]
+    if char == "/":
+        # ends the regex in a Lark grammar
+        return r"\/"
+    if not char.isprintable():
+        return f"\\x{ord(char):02x}" if ord(char) < 0x100 else f"\\u{ord(char):04x}"
+    return re.escape(char)
 
-    Raises:
-        ValueError: If the expression contains atomic expressions that are not literals or regular expressions
-    """
-    if not contains_only_literals(expr):
-        raise ValueError(
-            "Expression must only contain literals and regular expressions"
-        )
 
-    pattern_str = _build_regex_pattern(expr)
-    return re.compile(pattern_str)
+def escape_regex_text(text: str) -> str:
+    """Escape text for a regex that is written between slashes into a grammar."""
+    return "".join(_escape_char(char) for char in text)
 
 
-def _build_regex_pattern(expr: Expression) -> str:
+def literal_alternation(words) -> tuple[str, bool]:
     """
-    Recursively builds a regex pattern string from an Expression.
-
-    Args:
-        expr: The Expression to convert
+    Regex of an alternation of literal texts, merged into a prefix trie.
+
+    Words are grouped by their first character and common prefixes and
+    suffixes are factored out, so the regex engine never backtracks into
+    a sibling alternative: "part" | "port" | "portion" is p(?:art|ort(?:ion)?).
+    Single characters become a character class. A shorter word that is the
+    prefix of a longer one becomes an optional tail, the longest word wins.
+    Returns the pattern and whether a quantifier can follow it directly,
+    which an optional or empty pattern never allows:
+
+    >>> literal_alternation(["part", "port", "portion"])
+    ('p(?:art|ort(?:ion)?)', False)
+    >>> literal_alternation(["", "a", "b"])
+    ('[ab]?', False)
+    """
+    words = set(words)
+    optional = "" in words
+    words.discard("")
+    if not words:
+        return "", False
+    pattern, atomic = _trie_branches(sorted(words))
+    if optional:
+        return (pattern if atomic else f"(?:{pattern})") + "?", False
+    return pattern, atomic
+
+
+def _trie_branches(words: list[str]) -> tuple[str, bool]:
+    if len(words) > 1:
+        suffix = os.path.commonprefix([word[::-1] for word in words])[::-1]
+        if suffix:
+            head, _ = literal_alternation(word[: -len(suffix)] for word in words)
+            return head + escape_regex_text(suffix), False
+
+    chars: list[str] = []
+    branches: list[str] = []
+    for first, group in itertools.groupby(words, key=lambda word: word[0]):
+        group = list(group)
+        if group == [first]:
+            chars.append(first)
+            continue
+        prefix = os.path.commonprefix(group)
+        tail, _ = literal_alternation(word[len(prefix) :] for word in group)
+        branches.append(escape_regex_text(prefix) + tail)
+    if len(chars) > 1:
+        branches.append("[" + "".join(_escape_char(char) for char in chars) + "]")
+    elif chars:
+        branches.append(_escape_char(chars[0]))
+
+    if len(branches) > 1:
+        return f"(?:{'|'.join(branches)})", True
+    # branches of a single word have more than one character
+    return branches[0], len(chars) > 0
+
+
+class RegexBuilder:
+    """
+    Builds regular expressions for expressions of literals and regexes.
 
-    Returns:
-        A string representation of a regular expression
+    Every interned subtree is converted once, expressions that call rules
+    are remembered as None, so checking whether an expression can become a
+    regex and building it is a single traversal. Alternatives of literals
+    are merged with literal_alternation.
     """
-    if isinstance(expr, LiteralExpression):
-        # Escape any regex special characters in the literal
-        return re.escape(strip_double_quotes(expr.value))
-
-    elif isinstance(expr, RegularExpression):
-        # Regular expressions are assumed to already be valid regex patterns
-        # Remove any leading/trailing slashes if present (common in some regex formats)
-        pattern = expr.value
-        if pattern.startswith("/") and pattern.endswith("/"):
-            pattern = pattern[1:-1]
-        return pattern
-
-    elif isinstance(expr, SequenceExpression):
-        # Join all subexpressions with no delimiter (AND operation)
-        return "".join(_build_regex_pattern(e) for e in expr.expressions)
-
-    elif isinstance(expr, OrExpression):
-        # Join all subexpressions with | (OR operation)
-        return "|".join(f"(?:{_build_regex_pattern(e)})" for e in expr.expressions)
-
-    elif isinstance(expr, GroupExpression):
-        # Handle groups with their cardinality and negation
-        inner_pattern = _build_regex_pattern(expr.expression)
-
-        # Handle negation if present
+
+    def __init__(self):
+        # expression -> (pattern, atomic), None if it isn't convertible
+        self._patterns: dict[Expression, Optional[tuple[str, bool]]] = {}
+        # expression -> the literal texts it matches, None if it's no literal
+        self._words: dict[Expression, Optional[frozenset[str]]] = {}
+
+    def pattern(self, expr: Expression) -> Optional[str]:
+        """The regex of the expression, None if it doesn't only hold literals."""
+        result = self._pattern(expr)
+        return result[0] if result is not None else None
+
+    def negation(self, expr: Expression) -> Optional[str]:
+        """The regex of a single character that doesn't start the expression."""
+        words = self.words(expr)
+        if words and all(len(word) == 1 for word in words):
+            return "[^" + "".join(_escape_char(char) for char in sorted(words)) + "]"
+        result = self._pattern(expr)
+        if result is None:
+            return None
+        return rf"(?:(?!{result[0]})[\s\S])"
+
+    def words(self, expr: Expression) -> Optional[frozenset[str]]:
+        """The texts an expression of literals matches, None for anything else."""
+        if expr in self._words:
+            return self._words[expr]
+        words = None
+        if isinstance(expr, LiteralExpression):
+            words = frozenset((literal_text(expr.value),))
+        elif isinstance(expr, OrExpression):
+            alternatives = [self.words(e) for e in expr.expressions]
+            if all(w is not None for w in alternatives):
+                words = frozenset().union(*alternatives)
+        elif isinstance(expr, SequenceExpression):
+            parts = [self.words(e) for e in expr.expressions]
+            if all(w is not None and len(w) == 1 for w in parts):
+                words = frozenset(("".join(next(iter(w)) for w in parts),))
+        elif (
+            isinstance(expr, GroupExpression)
+            and not expr.negated
+            and expr.cardinality_type in (None, CardinalityType.OPTIONAL)
+        ):
+            words = self.words(expr.expression)
+            if words is not None and expr.cardinality_type is not None:
+                words = words | {""}
+        self._words[expr] = words
+        return words
+
+    def _pattern(self, expr: Expression) -> Optional[tuple[str, bool]]:
+        if expr in self._patterns:
+            return self._patterns[expr]
+        result = None
+        words = self.words(expr)
+        if words is not None:
+            result = literal_alternation(words)
+        elif isinstance(expr, RegularExpression):
+            pattern = expr.value
+            if pattern.startswith("/") and pattern.endswith("/"):
+                pattern = pattern[1:-1]
+            result = (pattern, _is_atom(pattern))
+        elif isinstance(expr, SequenceExpression):
+            parts = [self._pattern(e) for e in expr.expressions]
+            if all(part is not None for part in parts):
+                atomic = parts[0][1] if len(parts) == 1 else False
+                result = "".join(part[0] for part in parts), atomic
+        elif isinstance(expr, OrExpression):
+            result = self._alternation(expr)
+        elif isinstance(expr, GroupExpression):
+            result = self._group(expr)
+        self._patterns[expr] = result
+        return result
+
+    def _alternation(self, expr: OrExpression) -> Optional[tuple[str, bool]]:
+        """Literal alternatives are merged where the first of them was."""
+        branches: list[Optional[str]] = []
+        words: set[str] = set()
+        for alternative in expr.expressions:
+            alternative_words = self.words(alternative)
+            if alternative_words is not None:
+                if not words:
+                    branches.append(None)
+                words |= alternative_words
+                continue
+            result = self._pattern(alternative)
+            if result is None:
+                return None
+            branches.append(result[0])
+        trie = literal_alternation(words)[0] if words else None
+        patterns = [trie if branch is None else branch for branch in branches]
+        if len(patterns) == 1:
+            return patterns[0], False
+        return f"(?:{'|'.join(patterns)})", True
+
+    def _group(self, expr: GroupExpression) -> Optional[tuple[str, bool]]:
         if expr.negated:
-            # Negative lookahead to ensure the pattern doesn't match
-            pattern = f"(?!{inner_pattern})"
+            pattern = self.negation(expr.expression)
+            if pattern is None:
+                return None
+            atomic = True
         else:
-            # Group the pattern
-            pattern = f"(?:{inner_pattern})"
-
-        # Apply cardinality if specified
-        if expr.cardinality_type is not None:
-            if expr.cardinality_type == CardinalityType.OPTIONAL:
-                pattern += "?"
-            elif expr.cardinality_type == CardinalityType.AT_LEAST_ONE:
-                pattern += "+"
-            elif expr.cardinality_type == CardinalityType.ZERO_OR_MORE:
-                pattern += "*"
-
-        return pattern
-    else:
-        raise ValueError(f"Unsupported expression type: {type(expr)}")
+            result = self._pattern(expr.expression)
+            if result is None:
+                return None
+            pattern, atomic = result
+        if expr.cardinality_type is None:
+            return pattern, atomic
+        if not atomic:
+            pattern = f"(?:{pattern})"
+        return pattern + expr.cardinality_type.value, False
+
+
+def _is_atom(pattern: str) -> bool:
+    """Whether a quantifier applies to the whole pattern."""
+    if len(pattern) == 1 or (len(pattern) == 2 and pattern[0] == "\\"):
+        return True
+    if pattern[:1] not in ("[", "("):
+        return False
+    # the bracket opened first has to be closed by the last character
+    depth = 0
+    in_class = escaped = False
+    for idx, char in enumerate(pattern):
+        if escaped:
+            escaped = False
+            continue
+        if char == "\\":
+            escaped = True
+        elif in_class:
+            if char == "]":
+                in_class = False
+                depth -= 1
+        elif char in "[(":
+            in_class = char == "["
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        if depth == 0 and not escaped:
+            return idx == len(pattern) - 1
+    return False
@@ -1,6 +1,10 @@
-from lark import Visitor, Tree, Token, Transformer, v_args
-from .rule import XTextRule
+import time
+from typing import Optional
+from lark import Token, Transformer, v_args
+from .rule import GrammarImport, XTextGrammar, XTextRule
+from .tracing import active
 from .expression import (
+    Expression,
     SequenceExpression,
     OrExpression,
     CardinalityType,
@@ -10,6 +14,7 @@ from .expression import (
     GroupExpression,
     DataType,
     NameResolution,
+    ExpressionFactory,
 )
 from .utils import (
     XTEXT_CURRENT,
@@ -19,106 +24,22 @@ from .utils import (
     until_regex,
     wildcard_regex,
     character_range_regex,
-    contains_only_literals,
-    expression_to_regex,
+    RegexBuilder,
 )
 
 
-class XTextVisitor(Visitor):
-    """
-    TODO: Handle grammar and import statements. Only handle rule statements for now.
-    """
-
-    def __init__(self):
-        super().__init__()
-        self.rules: list[Tree] = []
-
-    def rule_statement(self, tree: Tree):
-        """
-        Will collect all the rule statements made in the xtext tree.
-        """
-        self.rules.append(tree)
-
-
-class XTextRuleVisitor(Visitor):
-    """
-    Visit a single rule in the XText Tree
-    """
-
-    def __init__(self):
-        super().__init__()
-        self.rule: XTextRule = XTextRule()
-
-    def override_dec(self, tree: Tree):
-        self.rule.is_override = True
-
-    def final_dec(self, tree: Tree):
-        self.rule.is_final = True
-
-    def deprecated_dec(self, tree: Tree):
-        self.rule.is_deprecated = True
-
-    def exported_dec(self, tree: Tree):
-        self.rule.is_exported = True
-
-    def terminal_mod(self, tree: Tree):
-        self.rule.is_terminal = True
-
-    def enum_mod(self, tree: Tree):
-        self.rule.is_enum = True
-
-    def fragment_mod(self, tree: Tree):
-        self.rule.is_fragment = True
-
-    def rule_name(self, tree: Tree):
-        rule_name_token: Token = tree.children[0].children[0]
-        self.rule.name = pascal_to_snake_case(rule_name_token.value)
-
-    def return_type(self, tree: Tree):
-        transformer: Transformer = ReturnTypeTransformer()
-        self.rule.return_type = transformer.transform(tree)
-
-    def rule_body(self, tree: Tree):
-        """
-        Will enter on the rule body for the rule statement.
-        """
-        transformer: Transformer = RuleBodyTransformer(visit_tokens=True)
-        self.rule.body = transformer.transform(tree)
-        self.rule.called_rules = transformer.called_rules
-
-
-@v_args(inline=True)
-class ReturnTypeTransformer(Transformer):
-    """
-    Visit a single rule in the XText Tree
-    """
-
-    def name(self, *args):
-        token: Token = args[0]
-        return token.value
-
-    def qualified_name(self, *args):
-        qname = [str(arg) for arg in args]
-        return qname
-
-    def data_type(self, *args):
-        dtype = DataType(namespace=args[0], qualified_name=args[1])
-        return dtype
-
-    def return_type(self, *args):
-        # If there's only one name, return it directly
-        return args[0]
-
-
 @v_args(inline=True)
 class RuleBodyTransformer(Transformer):
     """Transforms Lark parse trees into dataclass objects."""
 
     called_rules: set[str]
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, factory: Optional[ExpressionFactory] = None, **kwargs):
         super().__init__(*args, **kwargs)
         self.called_rules = set()
+        # every expression built is interned so equal subtrees are shared
+        self.factory = factory if factory is not None else ExpressionFactory()
+        self.regex = RegexBuilder()
 
     def passthru(self, passthru):
         # Just pass through the item
@@ -141,21 +62,21 @@ class RuleBodyTransformer(Transformer):
         if len(args) == 1:
             return args[0]
         # Otherwise, create an OrExpression
-        return OrExpression(expressions=list(args))
+        return self.factory.intern(OrExpression(expressions=tuple(args)))
 
     def sequence(self, *args):
         # If there's only one item, return it directly
         if len(args) == 1:
             return args[0]
         # Otherwise, create a SequenceExpression
-        expr = SequenceExpression(expressions=list(args))
-        return expr
+        expr = SequenceExpression(expressions=tuple(args))
+        return self.factory.intern(expr)
 
     def rule_call(self, name):
         # Return the name of the rule being called
         rule_name = pascal_to_snake_case(name)
         self.called_rules.add(rule_name)
-        return RuleCallExpression(rule_name)
+        return self.factory.intern(RuleCallExpression(rule_name))
 
     def group(self, *args):
         if len(args) == 1:
@@ -170,18 +91,19 @@ class RuleBodyTransformer(Transformer):
                 cardinality_type = arg
             else:
                 expression = arg
-        if negated and contains_only_literals(expression):
-            # Lark only support Regex in this case
-            # We need to convert the expression to a regex
-            pattern = expression_to_regex(expression)
-            expr = RegularExpression(pattern.pattern)
-        else:
-            expr = GroupExpression(
-                negated=negated,
-                expression=expression,
-                cardinality_type=cardinality_type,
-            )
-        return expr
+        # Lark has no negation, a negated group of literals becomes a regex
+        pattern = self.regex.negation(expression) if negated else None
+        if pattern is not None:
+            expression = self.factory.intern(RegularExpression(pattern))
+            if cardinality_type is None:
+                return expression
+            negated = False
+        expr = GroupExpression(
+            negated=negated,
+            expression=expression,
+            cardinality_type=cardinality_type,
+        )
+        return self.factory.intern(expr)
 
     def optional(self):
         # Optional cardinality
@@ -200,28 +122,51 @@ class RuleBodyTransformer(Transformer):
         return True
 
     def predicate(self, *args):
-        # Handle predicates
-        return args[0]
+        # the predicate of a repetition commits to every repeated element
+        element = args[0]
+        if not isinstance(element, Expression):
+            # non parsing elements like actions match nothing to commit to
+            return element
+        if (
+            isinstance(element, GroupExpression)
+            and element.cardinality_type is not None
+            and not element.negated
+        ):
+            return self.factory.intern(
+                GroupExpression(
+                    self.predicate(element.expression),
+                    cardinality_type=element.cardinality_type,
+                )
+            )
+        return self.factory.intern(GroupExpression(element, predicated=True))
 
     def literal(self, lit: Token):
         # Process literals
-        return LiteralExpression(single_to_double_quotes(lit.value))
+        return self.factory.intern(
+            LiteralExpression(single_to_double_quotes(lit.value))
+        )
 
     def char_range(self, start: LiteralExpression, end: LiteralExpression):
-        return RegularExpression(character_range_regex(start.value, end.value))
+        return self.factory.intern(
+            RegularExpression(character_range_regex(start.value, end.value))
+        )
 
     def wildcard(self, prefix: LiteralExpression, suffix: LiteralExpression):
-        return RegularExpression(wildcard_regex(prefix.value, suffix.value))
+        return self.factory.intern(
+            RegularExpression(wildcard_regex(prefix.value, suffix.value))
+        )
 
     def until(self, start: LiteralExpression, end: LiteralExpression):
-        return RegularExpression(until_regex(start.value, end.value))
+        return self.factory.intern(
+            RegularExpression(until_regex(start.value, end.value))
+        )
 
     def name(self, *args):
         token: Token = args[0]
         return token.value
 
     def qualified_name(self, *args):
-        qname = [str(arg) for arg in args]
+        qname = tuple(str(arg) for arg in args)
         return qname
 
     def data_type(self, *args):
@@ -239,7 +184,9 @@ class RuleBodyTransformer(Transformer):
             else:
                 raise ValueError(f"Unknown name resolution type: {name}")
 
-        return NameResolution(rule_calls=rule_calls, data_types=data_types)
+        return self.factory.intern(
+            NameResolution(rule_calls=tuple(rule_calls), data_types=tuple(data_types))
+        )
 
     def xtext_current(self, *args):
         return XTEXT_CURRENT
@@ -265,3 +212,120 @@ class RuleBodyTransformer(Transformer):
 
     def non_parsing_list(self, *args):
         return NON_PARSING
+
+
+class _Flag:
+    """Marks a decorator or modifier of a rule statement."""
+
+    def __init__(self, attribute: str):
+        self.attribute = attribute
+
+
+@v_args(inline=True)
+class XTextRuleBuilder(RuleBodyTransformer):
+    """
+    Builds XTextRules straight from the XText parse in a single pass.
+
+    Passed to a LALR parser as its transformer, rules are built while
+    parsing and the parse tree is never materialized. Any other parser
+    can transform its tree with it afterwards. A whole file becomes an
+    XTextGrammar, a rule_statement a single rule.
+    """
+
+    def __init__(self, factory: Optional[ExpressionFactory] = None):
+        super().__init__(visit_tokens=True, factory=factory)
+        self._last_rule = time.perf_counter()
+
+    def reset(self, factory: Optional[ExpressionFactory] = None):
+        """Prepare for the next parse, sharing subtrees through the factory."""
+        self.factory = factory if factory is not None else ExpressionFactory()
+        self.called_rules = set()
+        self._last_rule = time.perf_counter()
+
+    def start(self, *items):
+        grammar = XTextGrammar()
+        for item in items:
+            if isinstance(item, XTextGrammar):
+                grammar = item
+            elif isinstance(item, GrammarImport):
+                grammar.imports.append(item)
+            else:
+                grammar.rules.append(item)
+        return grammar
+
+    def grammar_declaration(self, name, *sections):
+        grammar = XTextGrammar(name=".".join(name))
+        for section, names in sections:
+            if section == "with":
+                grammar.used_grammars = names
+            else:
+                grammar.hidden = names
+        return grammar
+
+    def with_section(self, *names):
+        return "with", [".".join(name) for name in names]
+
+    def hidden_section(self, names):
+        return "hidden", names
+
+    def hidden_item_list(self, *names):
+        return list(names)
+
+    def simple_import(self, url):
+        return GrammarImport(url[1:-1])
+
+    def import_with_alias(self, url, alias):
+        return GrammarImport(url[1:-1], alias)
+
+    import_statement = RuleBodyTransformer.passthru
+
+    def override_dec(self):
+        return _Flag("is_override")
+
+    def final_dec(self):
+        return _Flag("is_final")
+
+    def deprecated_dec(self):
+        return _Flag("is_deprecated")
+
+    def exported_dec(self):
+        return _Flag("is_exported")
+
+    def terminal_mod(self):
+        return _Flag("is_terminal")
+
+    def enum_mod(self):
+        return _Flag("is_enum")
+
+    def fragment_mod(self):
+        return _Flag("is_fragment")
+
+    decorators = RuleBodyTransformer.passthru
+    rule_modifiers = RuleBodyTransformer.passthru
+    rule_name = RuleBodyTransformer.passthru
+    return_type = RuleBodyTransformer.passthru
+
+    def rule_statement(self, *args):
+        # the rule name is the only plain string, everything below the
+        # rule body is reduced to expressions before the statement
+        rule = XTextRule()
+        for arg in args:
+            if isinstance(arg, _Flag):
+                setattr(rule, arg.attribute, True)
+            elif isinstance(arg, str):
+                rule.xtext_name = arg
+                rule.name = pascal_to_snake_case(arg)
+            elif isinstance(arg, DataType):
+                rule.return_type = arg
+            else:
+                rule.body = arg
+        # the rule calls of the body were collected since the last statement
+        rule.called_rules = self.called_rules
+        self.called_rules = set()
+
+        profiler = active()
+        if profiler is not None:
+            now = time.perf_counter()
+            profiler.add_rule_cost(rule.xtext_name, now - self._last_rule)
+            self._last_rule = now
+        return rule
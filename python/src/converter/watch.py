@@ -0,0 +1,246 @@
+import time
+from pathlib import Path
+from typing import Callable, Iterator, Optional, Union
+from lark import Lark
+from lark.exceptions import LarkError
+from .cache import ConversionCache
+from .corpus import PASSED, FileResult, collect_files, parse_file
+from .emitter import OutputFormat, emit_rules
+from .incremental import Document, incremental_options, root_rule
+from .keywords import collect_keywords
+from .lark_cache import ParserCache, build_lark
+from .parser import DEFAULT_GRAMMAR, ModuleLoader, build_meta_parser, process_rules
+from .passes import PassManager
+from .query import ModelIndex
+
+# Seconds between two polls of the watched files.
+DEFAULT_INTERVAL = 0.2
+
+# Seconds to wait for an editor to finish writing a file before reading it.
+SETTLE_TIME = 0.05
+
+
+def modification_times(paths: list[Path]) -> dict[Path, int]:
+    times = {}
+    for path in paths:
+        try:
+            times[path] = path.stat().st_mtime_ns
+        except FileNotFoundError:
+            pass
+    return times
+
+
+class FileWatcher:
+    """
+    Polls files for changes of their modification time.
+
+    The files are listed again on every poll, so new files in a watched
+    directory or matching a watched glob pattern are picked up too.
+    """
+
+    def __init__(
+        self, list_files: Callable[[], list[Path]], interval: float = DEFAULT_INTERVAL
+    ):
+        self.list_files = list_files
+        self.interval = interval
+        self.times = modification_times(list_files())
+
+    def poll(self) -> set[Path]:
+        """Files changed, created or deleted since the last poll."""
+        times = modification_times(self.list_files())
+        changed = {
+            path for path, mtime in times.items() if self.times.get(path) != mtime
+        }
+        changed |= self.times.keys() - times.keys()
+        self.times = times
+        return changed
+
+    def __iter__(self) -> Iterator[set[Path]]:
+        while True:
+            time.sleep(self.interval)
+            changed = self.poll()
+            if not changed:
+                continue
+            # editors save in several writes, wait until they are done
+            while True:
+                time.sleep(SETTLE_TIME)
+                settled = self.poll()
+                if not settled:
+                    break
+                changed |= settled
+            yield changed
+
+
+class WatchSession:
+    """
+    Converts the XText files and tests the corpus, keeping everything warm.
+
+    The module loader with its meta parser and conversion cache, and the
+    parser of the generated grammar stay in memory between updates. An
+    XText change reparses only the changed rule statements of the changed
+    file, or the whole changed file without a conversion cache, and the
+    generated grammar is only loaded into Lark again when its text changed,
+    from the parser cache when it was loaded before. A corpus change
+    retests just the changed files, and of a file that was parsed before
+    only the innermost block or top level elements around the changed text.
+    The model index is updated with the files that were retested.
+    """
+
+    def __init__(
+        self,
+        output: Path,
+        corpus: list[str],
+        lark_options: dict,
+        cache: Optional[ConversionCache],
+        format: OutputFormat = OutputFormat.LARK,
+        optimize: bool = True,
+        disabled: Optional[set[str]] = None,
+        enabled: Optional[set[str]] = None,
+        keywords: bool = False,
+        timeout: Optional[float] = None,
+        xtext_grammar: Union[str, Path] = DEFAULT_GRAMMAR,
+        search_path: Optional[list[Path]] = None,
+        parser_cache: Optional[ParserCache] = None,
+    ):
+        self.output = output
+        self.corpus = corpus
+        self.lark_options = lark_options
+        self.format = format
+        self.optimize = optimize
+        self.disabled = disabled
+        self.enabled = enabled
+        self.keywords = keywords
+        self.timeout = timeout
+        self.xtext_grammar = xtext_grammar
+        self.parser_cache = parser_cache
+        self.loader = ModuleLoader(
+            search_path,
+            "lalr",
+            cache,
+            meta_parser=build_meta_parser("lalr", cache=parser_cache),
+        )
+        # files of the XText grammar and the grammars it depends on
+        self.xtext_files: list[Path] = []
+        self.grammar: Optional[str] = None
+        self.parser: Optional[Lark] = None
+        self.results: dict[Path, FileResult] = {}
+        self.documents: dict[Path, Document] = {}
+        self.incremental = False
+        # elements of the files that parse, as of their last passing parse
+        self.index = ModelIndex()
+
+    def watched_files(self) -> list[Path]:
+        return self.xtext_files + self.corpus_files()
+
+    def corpus_files(self) -> list[Path]:
+        return collect_files(self.corpus)
+
+    def convert(self) -> bool:
+        """Convert the XText files, whether the generated grammar changed."""
+        try:
+            modules = self.loader.load(self.xtext_grammar)
+            self.xtext_files = [module.path for module in modules]
+            rules = process_rules(
+                [rule for module in modules for rule in module.grammar.rules],
+                self.loader.hidden(self.xtext_grammar),
+            )
+        except (LarkError, OSError, ValueError) as e:
+            print(f"Conversion failed: {e}")
+            return False
+        if rules is None or len(rules) == 0:
+            print("Conversion failed: no rules found.")
+            return False
+        if self.optimize:
+            PassManager(self.disabled, self.enabled).run(rules)
+
+        keyword_terminals = collect_keywords(rules) if self.keywords else None
+        emit_rules(rules, self.output, self.format, keyword_terminals)
+        grammar = self.output.read_text()
+        if grammar == self.grammar:
+            print(f"Converted {len(rules)} rules, {self.output} is unchanged.")
+            return False
+        print(f"Converted {len(rules)} rules into {self.output}.")
+        self.grammar = grammar
+        self.parser = None
+        return True
+
+    def load(self) -> bool:
+        """Load the generated grammar into Lark."""
+        if self.format is not OutputFormat.LARK or self.grammar is None:
+            return False
+        self.documents = {}
+        self.index = ModelIndex()
+        options = self.lark_options
+        # grammars with a root rule have their documents reparsed incrementally
+        self.incremental = root_rule(self.grammar) is not None
+        if self.incremental:
+            options = incremental_options(self.grammar, options)
+        try:
+            self.parser = build_lark(self.grammar, self.parser_cache, **options)
+        except LarkError as e:
+            # Lark lists every collision, the first one is enough
+            print(f"Grammar can't be loaded: {str(e).splitlines()[0]}")
+            return False
+        return True
+
+    def test(self, files: list[Path]):
+        """Parse the files, reporting failures and changed outcomes."""
+        if self.parser is None:
+            return
+        for path in files:
+            if self.incremental:
+                if path not in self.documents:
+                    self.documents[path] = Document(self.parser)
+                parser = self.documents[path]
+            else:
+                parser = self.parser
+            result = parse_file(parser, path, self.timeout, keep_tree=True)
+            if result.tree is not None:
+                self.index.update(str(path), result.tree)
+                result.tree = None
+            previous = self.results.get(path)
+            self.results[path] = result
+            if result.status != PASSED:
+                error = (result.error or "").splitlines()[:1]
+                print(f"Test {result.status} for {result.path}: {''.join(error)}")
+            elif previous is not None and previous.status != PASSED:
+                print(f"Test passes again for {result.path}")
+        passed = sum(1 for r in self.results.values() if r.status == PASSED)
+        print(
+            f"{passed} of {len(self.results)} files pass, "
+            f"{len(self.index)} elements indexed."
+        )
+
+    def update(self, changed: Optional[set[Path]] = None):
+        """
+        Bring the grammar and the test results up to date with the changes.
+
+        Without changes everything is converted and tested.
+        """
+        start = time.perf_counter()
+        corpus_files = self.corpus_files()
+        for path in set(self.results) - set(corpus_files):
+            del self.results[path]
+            self.documents.pop(path, None)
+            self.index.remove(str(path))
+
+        if changed is None:
+            retest = corpus_files
+        else:
+            retest = [path for path in corpus_files if path in changed]
+        if changed is None or changed & set(self.xtext_files):
+            if self.convert():
+                # results of the previous grammar don't mean anything anymore
+                self.results = {}
+                if self.load():
+                    retest = corpus_files
+        self.test(retest)
+        print(f"Updated in {(time.perf_counter() - start) * 1000:.0f} ms.")
+
+    def watch(self, interval: float = DEFAULT_INTERVAL):
+        """Update once, then after every change until interrupted."""
+        self.update()
+        for changed in FileWatcher(self.watched_files, interval):
+            names = ", ".join(sorted(path.name for path in changed))
+            print(f"Changed: {names}")
+            self.update(changed)
@@ -0,0 +1,69 @@
+import io
+import shutil
+from pathlib import Path
+from converter.cache import ConversionCache, split_rule_statements
+from converter.emitter import LarkEmitter
+from converter.parser import XTEXT_DIRECTORY, ModuleLoader, process_rules
+from converter.passes import PassManager
+
+
+def test_split_rule_statements():
+    content = (
+        "grammar a.B\n"
+        "import 'x' as X;\n"
+        "// a comment; with a semicolon\n"
+        "A : 'a;' | B ;\n"
+        '/* another; */ B : "b;" ;\n'
+    )
+    segments = split_rule_statements(content)
+    assert segments == [
+        "grammar a.B\nimport 'x' as X;",
+        "\n// a comment; with a semicolon\nA : 'a;' | B ;",
+        '\n/* another; */ B : "b;" ;',
+    ]
+    assert "".join(segments) + "\n" == content
+
+
+def test_split_rule_statements_trailing_content():
+    assert split_rule_statements("A : 'a' ;\n// done\n") == ["A : 'a' ;"]
+    assert split_rule_statements("A : 'a' ;\nB : 'b'") is None
+
+
+def _convert(path: Path, cache=None) -> str:
+    with ModuleLoader(cache=cache) as loader:
+        table = process_rules(loader.rules(path), loader.hidden(path))
+    PassManager().run(table)
+    out = io.StringIO()
+    LarkEmitter(out).emit(table)
+    return out.getvalue()
+
+
+def test_warm_conversion_matches_cold(tmp_path):
+    for source in XTEXT_DIRECTORY.glob("*.xtext"):
+        shutil.copy(source, tmp_path / source.name)
+    grammar = tmp_path / "SysML.xtext"
+    cache_directory = tmp_path / "cache"
+    _convert(grammar, ConversionCache(cache_directory))
+
+    content = grammar.read_text()
+    assert content.count("'package' Identification?") == 1
+    grammar.write_text(content.replace("'package' Identification?", "'pkg' Name?"))
+
+    cache = ConversionCache(cache_directory)
+    warm = _convert(grammar, cache)
+    # only the edited rule statement is parsed again
+    assert cache.misses == 1
+    assert cache.hits > 0
+    cold = _convert(grammar)
+    assert warm == cold
+    assert '"pkg"' in warm
+
+
+def test_unchanged_files_are_hits(tmp_path):
+    cache = ConversionCache(tmp_path)
+    cold = _convert(XTEXT_DIRECTORY / "SysML.xtext", cache)
+    assert cache.misses > 0
+
+    cache = ConversionCache(tmp_path)
+    assert _convert(XTEXT_DIRECTORY / "SysML.xtext", cache) == cold
+    assert cache.misses == 0
@@ -0,0 +1,76 @@
+import dataclasses
+import pickle
+import pytest
+from converter.expression import (
+    CardinalityType,
+    ExpressionFactory,
+    GroupExpression,
+    LiteralExpression,
+    OrExpression,
+    RuleCallExpression,
+    SequenceExpression,
+)
+
+
+def _names(factory: ExpressionFactory) -> GroupExpression:
+    """qualified_name ("," qualified_name)*, built bottom up."""
+    name = factory.intern(RuleCallExpression("qualified_name"))
+    comma = factory.intern(LiteralExpression('","'))
+    rest = factory.intern(
+        GroupExpression(
+            factory.intern(SequenceExpression((comma, name))),
+            cardinality_type=CardinalityType.ZERO_OR_MORE,
+        )
+    )
+    return factory.intern(SequenceExpression((name, rest)))
+
+
+def test_structural_equality():
+    a = _names(ExpressionFactory())
+    b = _names(ExpressionFactory())
+    assert a is not b
+    assert a == b
+    assert hash(a) == hash(b)
+    assert str(a) == 'qualified_name ("," qualified_name)*'
+
+
+def test_types_and_fields_are_compared():
+    assert RuleCallExpression("a") != LiteralExpression("a")
+    assert GroupExpression(RuleCallExpression("a")) != GroupExpression(
+        RuleCallExpression("a"), negated=True
+    )
+    assert OrExpression((RuleCallExpression("a"),)) != SequenceExpression(
+        (RuleCallExpression("a"),)
+    )
+
+
+def test_factory_shares_equal_subtrees():
+    factory = ExpressionFactory()
+    a = _names(factory)
+    b = _names(factory)
+    assert a is b
+    assert a.expressions[0] is a.expressions[1].expression.expressions[1]
+    # qualified_name, ",", the sequence in the group, the group and the root
+    assert len(factory) == 5
+
+
+def test_intern_tree_shares_unpickled_trees():
+    factory = ExpressionFactory()
+    a = _names(factory)
+    copy = pickle.loads(pickle.dumps(a))
+    assert copy == a and copy is not a
+    assert factory.intern_tree(copy) is a
+    assert len(factory) == 5
+
+
+def test_expressions_are_frozen_and_slotted():
+    expr = RuleCallExpression("a")
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        expr.value = "b"
+    assert not hasattr(expr, "__dict__")
+
+
+def test_hash_and_string_are_cached():
+    expr = _names(ExpressionFactory())
+    assert str(expr) is str(expr)
+    assert expr._hash == hash(expr)
@@ -0,0 +1,121 @@
+from lark import Lark, Token
+from converter.incremental import Document, block_rules, incremental_options
+
+# a converted grammar, blocks nested in blocks
+GRAMMAR = r"""
+start: model
+
+model: element*
+
+element: package | part
+
+package: "package" ID package_body
+
+package_body: ";" | "{" element* "}"
+
+part: "part" ID (":" ID)? part_body
+
+part_body: ";" | "{" (part | attribute)* "}"
+
+attribute: "attribute" ID ("=" INT)? ";"
+
+ID: (/[a-z]/ | /[A-Z]/ | "_")+
+
+INT.2: /[0-9]/+
+
+WS.1: /[\t\n\r\ ]/+
+
+
+%ignore WS
+"""
+
+TEXT = """package a {
+    part p : T {
+        attribute x = 1;
+        part q {
+            attribute y;
+        }
+    }
+    part r;
+}
+package b;
+"""
+
+
+def _parser() -> Lark:
+    return Lark(GRAMMAR, **incremental_options(GRAMMAR, {}))
+
+
+def _shape(node):
+    """The tree with the positions of every node, to compare trees."""
+    if isinstance(node, Token):
+        return (
+            node.type,
+            str(node),
+            node.start_pos,
+            node.line,
+            node.column,
+            node.end_pos,
+            node.end_line,
+            node.end_column,
+        )
+    meta = node.meta
+    positions = (
+        ()
+        if meta.empty
+        else (
+            meta.start_pos,
+            meta.line,
+            meta.column,
+            meta.end_pos,
+            meta.end_line,
+            meta.end_column,
+        )
+    )
+    return (node.data, positions, [_shape(child) for child in node.children])
+
+
+def _check(document: Document, text: str):
+    document.update(text)
+    assert _shape(document.tree) == _shape(document.parser.parse(text, start="start"))
+
+
+def test_block_rules():
+    assert block_rules(GRAMMAR) == ["package_body", "part_body"]
+
+
+def test_nested_edit_reparses_innermost_block():
+    document = Document(_parser(), TEXT)
+    text = TEXT.replace("attribute y;", "attribute yy = 2;\n            part s;")
+    _check(document, text)
+    # only the body of q
+    body = text.index("{", text.index("part q"))
+    assert document.reparsed == text.index("}", body) + 1 - body
+
+
+def test_edits_match_full_parse():
+    document = Document(_parser(), TEXT)
+    text = TEXT
+    for old, new in [
+        ("x = 1", "x = 12"),
+        ("part r;", "part r {\n        attribute z;\n    }"),
+        ("attribute z;", "attribute z;\n\n        attribute w;"),
+        ("package b;", "package b {\n}"),
+        ("    part p : T {", "    part p {"),
+    ]:
+        text = text.replace(old, new, 1)
+        _check(document, text)
+
+
+def test_edit_closing_a_block_reparses_the_enclosing_one():
+    document = Document(_parser(), TEXT)
+    text = TEXT.replace("attribute y;\n        }", "attribute y;\n        }}", 1)
+    text = text.replace("    part r;\n}", "    part r;\n", 1)
+    _check(document, text)
+
+
+def test_edit_between_top_level_elements():
+    document = Document(_parser(), TEXT)
+    text = TEXT.replace("package b;", "package c;\npackage b;")
+    _check(document, text)
+    assert document.reparsed < len(text)
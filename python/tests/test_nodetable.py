@@ -0,0 +1,92 @@
+import pytest
+from lark import Lark, Token, Tree
+from converter.nodetable import NodeTable, NodeTableWriter
+
+GRAMMAR = r"""
+start: element*
+element: "part" NAME body
+body: ";" | "{" element* "}"
+NAME: /[a-z]+/
+%import common.WS
+%ignore WS
+"""
+
+FILES = {
+    "a.sysml": "part a { part b; part c { part d; } }",
+    "b.sysml": "part e;\npart a;",
+}
+
+
+def _strip(node):
+    """The tree without positions, as NodeTable.tree rebuilds it."""
+    if isinstance(node, Token):
+        return Token(node.type, str(node))
+    return Tree(str(node.data), [_strip(child) for child in node.children])
+
+
+@pytest.fixture
+def trees():
+    parser = Lark(GRAMMAR, propagate_positions=True)
+    return {path: parser.parse(text) for path, text in FILES.items()}
+
+
+@pytest.fixture
+def table(tmp_path, trees):
+    writer = NodeTableWriter()
+    for path, tree in trees.items():
+        writer.add(path, tree)
+    output = tmp_path / "corpus.nodes"
+    writer.write(output)
+    with NodeTable(output) as table:
+        yield table
+
+
+def test_round_trip(table, trees):
+    assert table.files == list(FILES)
+    for root, (path, tree) in zip(table.roots, trees.items()):
+        assert table.file_of(root) == path
+        assert table.tree(root) == _strip(tree)
+    assert len(table) == sum(
+        1 + sum(len(subtree.children) for subtree in tree.iter_subtrees())
+        for tree in trees.values()
+    )
+
+
+def test_spans_and_texts(table):
+    names = [(table.file_of(node), table.text(node)) for node in table.find("NAME")]
+    assert names == [
+        ("a.sysml", "a"),
+        ("a.sysml", "b"),
+        ("a.sysml", "c"),
+        ("a.sysml", "d"),
+        ("b.sysml", "e"),
+        ("b.sysml", "a"),
+    ]
+    for node in table.find("NAME"):
+        text = FILES[table.file_of(node)]
+        assert text[table.start[node] : table.end[node]] == table.text(node)
+    last = list(table.find("NAME"))[-1]
+    assert table.line[last] == 2
+
+
+def test_structure(table):
+    root = table.roots[0]
+    assert table.kind_name(root) == "start"
+    assert table.parent[root] == -1
+    elements = list(table.children(root))
+    assert [table.kind_name(node) for node in elements] == ["element"]
+    assert all(table.parent[node] == root for node in elements)
+    # the subtree of the first file ends where the second one starts
+    assert table.subtree_end(root) == table.roots[1]
+    assert table.subtree_end(table.roots[1]) == len(table)
+    assert table.is_token(list(table.find("NAME"))[0])
+    assert table.text(root) is None
+    assert table.string_id("missing") is None
+    assert list(table.find("missing")) == []
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "other"
+    path.write_bytes(b"\0" * 64)
+    with pytest.raises(ValueError):
+        NodeTable(path)
@@ -0,0 +1,87 @@
+import json
+import re
+from converter.expression import (
+    CardinalityType,
+    GroupExpression,
+    LiteralExpression,
+    OrExpression,
+    RegularExpression,
+    RuleCallExpression,
+    SequenceExpression,
+)
+from converter.utils import RegexBuilder, literal_alternation
+
+
+def _literals(*texts: str) -> tuple[LiteralExpression, ...]:
+    return tuple(LiteralExpression(json.dumps(text)) for text in texts)
+
+
+def test_literal_alternation_matches_exactly_the_words():
+    words = ["part", "port", "portion", "in", "inout", "out", "", "a", "b"]
+    pattern, _ = literal_alternation(words)
+    for word in words:
+        assert re.fullmatch(pattern, word)
+    for word in ["pa", "portio", "inou", "ab", "parts"]:
+        assert not re.fullmatch(pattern, word)
+
+
+def test_literal_alternation_prefix_trie():
+    assert literal_alternation(["part", "port", "portion"]) == (
+        "p(?:art|ort(?:ion)?)",
+        False,
+    )
+    assert literal_alternation(["a", "b", "c"]) == ("[abc]", True)
+    assert literal_alternation(["", "a", "b"]) == ("[ab]?", False)
+    assert literal_alternation([""]) == ("", False)
+
+
+def test_longest_word_wins():
+    pattern, _ = literal_alternation(["in", "inout"])
+    assert re.match(pattern, "inout").group() == "inout"
+
+
+def test_builder_merges_literal_alternatives():
+    builder = RegexBuilder()
+    expr = OrExpression(_literals("in", "out", "inout"))
+    assert builder.words(expr) == {"in", "out", "inout"}
+    pattern = builder.pattern(expr)
+    for word in ["in", "out", "inout"]:
+        assert re.fullmatch(pattern, word)
+
+
+def test_builder_rejects_rule_calls():
+    builder = RegexBuilder()
+    expr = OrExpression((*_literals("a"), RuleCallExpression("name")))
+    assert builder.pattern(expr) is None
+    assert builder.words(expr) is None
+
+
+def test_single_part_sequence_keeps_atomic_flag():
+    builder = RegexBuilder()
+    digits = RegularExpression("/[0-9]/")
+    group = GroupExpression(
+        SequenceExpression((digits,)), cardinality_type=CardinalityType.AT_LEAST_ONE
+    )
+    pattern = builder.pattern(group)
+    assert pattern == "[0-9]+"
+    assert re.fullmatch(pattern, "123")
+
+
+def test_quantified_sequence_is_grouped():
+    builder = RegexBuilder()
+    group = GroupExpression(
+        SequenceExpression((RegularExpression("/[a-z]/"), *_literals("_"))),
+        cardinality_type=CardinalityType.ZERO_OR_MORE,
+    )
+    pattern = builder.pattern(group)
+    assert re.fullmatch(pattern, "a_b_")
+    assert not re.fullmatch(pattern, "ab_")
+
+
+def test_negated_characters():
+    builder = RegexBuilder()
+    expr = GroupExpression(OrExpression(_literals("'", "\\")), negated=True)
+    pattern = builder.pattern(expr)
+    assert re.fullmatch(pattern, "x")
+    assert not re.fullmatch(pattern, "'")
+    assert not re.fullmatch(pattern, "\\")